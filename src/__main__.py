@@ -0,0 +1,12 @@
+import argparse
+import sys
+from src import benchmark, grep
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m src')
+    commands = parser.add_subparsers(dest='command', required=True)
+    grep.add_arguments(commands.add_parser('grep', help="print the lines of files that contain a match of a pattern"))
+    benchmark.add_arguments(commands.add_parser('benchmark', help="measure compile and match performance, or compare two runs"))
+    args = parser.parse_args()
+    sys.exit(args.run(args))
@@ -0,0 +1,249 @@
+import os
+from array import array
+from typing import Iterable, Iterator
+from src.ast import ASTNode, ASTParser, AlternationNode, ConcatenationNode, LiteralNode, GroupNode, EscapedCharacterNode
+from src.charset import Text
+from src.dense import ClassMap, DenseDFA, bool_array
+from src.literals import Literals, Prefilter
+from src.search import Match
+from src.stats import CompileStats, stage
+
+
+# Characters the tokenizer treats specially, a pattern without them is a plain list of keywords separated by '|'
+SPECIAL_CHARACTERS = frozenset('()[]*+?.\\{')
+
+
+class AhoCorasick:
+    """
+    Finds keywords in a text in a single pass, one table lookup per character no matter how many keywords there are.
+
+    The keywords form a trie whose failure links are folded into a single transition table over character classes,
+    like the one of a `DenseDFA`: state 0 is unused (dead), state 1 is the root and `table[state * n_classes + class]`
+    is the next state. `fail[state]` is the state of the longest proper suffix that is also in the trie, `depth[state]`
+    the length of the trie path to the state and `longest[state]` the length of the longest keyword ending in it.
+
+    `dfa` is the table as a `DenseDFA` that accepts as soon as any keyword ended, the unanchored automaton of the keywords.
+    `match`, `search` and `finditer` behave like the ones of `Regex` and `Searcher` (leftmost-longest).
+    """
+
+    ROOT = 1
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        self.keywords = list(dict.fromkeys(keywords))
+        if not self.keywords or '' in self.keywords:
+            raise Exception("Aho-Corasick needs at least one keyword and no empty ones")
+
+        # Every character of the keywords is its own class, all other characters fall into class 0
+        class_of = {char: class_id for class_id, char in enumerate(sorted(set().union(*self.keywords)), start=1)}
+        n_classes = len(class_of) + 1
+
+        # Trie, state 0 is the dead state and state 1 the root
+        goto: dict[int, int] = {}
+        children: list[list[tuple[int, int]]] = [[], []]
+        depth = array('i', [0, 0])
+        is_keyword = bytearray(2)
+        for keyword in self.keywords:
+            state = AhoCorasick.ROOT
+            for char in keyword:
+                class_id = class_of[char]
+                next_state = goto.get(state * n_classes + class_id)
+                if next_state is None:
+                    next_state = len(depth)
+                    goto[state * n_classes + class_id] = next_state
+                    children[state].append((class_id, next_state))
+                    children.append([])
+                    depth.append(depth[state] + 1)
+                    is_keyword.append(0)
+                state = next_state
+            is_keyword[state] = 1
+
+        # Breadth first, so the failure target of every state is finished before the state itself
+        n_states = len(depth)
+        table = array('i', [0]) * (n_states * n_classes)
+        fail = array('i', [AhoCorasick.ROOT]) * n_states
+        longest = array('i', [0]) * n_states
+        root = AhoCorasick.ROOT
+        table[root * n_classes:(root + 1) * n_classes] = array('i', [root]) * n_classes
+        queue = [root]
+        for state in queue:
+            base = state * n_classes
+            if state != root:
+                fail_base = fail[state] * n_classes
+                table[base:base + n_classes] = table[fail_base:fail_base + n_classes]
+                longest[state] = depth[state] if is_keyword[state] else longest[fail[state]]
+            for class_id, child in children[state]:
+                fail[child] = table[fail[state] * n_classes + class_id] if state != root else root
+                table[base + class_id] = child
+                queue.append(child)
+        fail[0] = 0
+
+        self.table = table
+        self.n_classes = n_classes
+        self.fail = fail
+        self.depth = depth
+        self.longest = longest
+        self.is_keyword = bytes(is_keyword)
+        classes = ClassMap([(ord(char), ord(char), class_id) for char, class_id in class_of.items()])
+        self.dfa = DenseDFA(table, classes, bytes(1 if length else 0 for length in longest), root)
+        # The same interface as the searcher of a pattern (grep only needs the unanchored DFA and the prefilter)
+        self.unanchored = self.dfa
+        self.prefilter = Prefilter(self.__literals())
+
+    @property
+    def n_states(self) -> int:
+        return len(self.depth)
+
+    def __literals(self) -> Literals:
+        if len(self.keywords) == 1:
+            return Literals(self.keywords[0], self.keywords[0], self.keywords[0], self.keywords[0])
+        prefix = os.path.commonprefix(self.keywords)
+        suffix = os.path.commonprefix([keyword[::-1] for keyword in self.keywords])[::-1]
+        return Literals(None, prefix, suffix, max(prefix, suffix, key=len))
+
+    def match(self, string: Text) -> bool:
+        # The whole string is a keyword iff the trie path is never left, i.e. the depth grows with every character
+        table, n_classes, depth = self.table, self.n_classes, self.depth
+        state = AhoCorasick.ROOT
+        for length, class_id in enumerate(self.dfa.class_ids(string), start=1):
+            state = table[state * n_classes + class_id]
+            if depth[state] != length:
+                return False
+        return self.is_keyword[state] == 1
+
+    def match_many(self, strings: Iterable[Text]) -> "numpy.ndarray | list[bool]":
+        return bool_array([self.match(string) for string in strings])
+
+    def finditer(self, string: Text, pos: int = 0, endpos: int | None = None) -> Iterator[Match]:
+        length = len(string) if isinstance(string, str) else memoryview(string).nbytes
+        endpos = length if endpos is None else min(endpos, length)
+        if pos > endpos or not self.prefilter.may_contain_match(string, pos, endpos):
+            return
+        table, n_classes, depth, longest = self.table, self.n_classes, self.depth, self.longest
+
+        position = pos
+        while position < endpos:
+            state = AhoCorasick.ROOT
+            best_start = best_end = -1
+            for end, class_id in enumerate(self.dfa.class_ids(string, position, endpos), start=position + 1):
+                state = table[state * n_classes + class_id]
+                if best_start != -1 and end - depth[state] > best_start:
+                    # No keyword that starts at or before the best start is still being read
+                    break
+                if longest[state]:
+                    start = end - longest[state]
+                    if best_start == -1 or start <= best_start:
+                        best_start, best_end = start, end
+            if best_start == -1:
+                return
+            yield Match(string, best_start, best_end)
+            position = best_end
+
+    def search(self, string: Text, pos: int = 0, endpos: int | None = None) -> Match | None:
+        return next(self.finditer(string, pos, endpos), None)
+
+    def findall(self, string: Text, pos: int = 0, endpos: int | None = None) -> list[Text]:
+        return [match.group() for match in self.finditer(string, pos, endpos)]
+
+    def __repr__(self) -> str:
+        return f"AhoCorasick({len(self.keywords)} keywords, {self.n_states} states x {self.n_classes} classes)"
+
+
+def __literal_text(node: ASTNode) -> str | None:
+    if isinstance(node, LiteralNode):
+        return node.value
+    elif isinstance(node, EscapedCharacterNode):
+        return None if node.value in 'dws' else node.value
+    elif isinstance(node, ConcatenationNode):
+        parts = [__literal_text(subnode) for subnode in node.nodes]
+        return None if None in parts else ''.join(parts)
+    elif isinstance(node, GroupNode):
+        return __literal_text(node.node)
+    return None
+
+def keywords_of(node: ASTNode) -> list[str] | None:
+    """The keywords if the node is an alternation of plain literals (or a single literal), None otherwise."""
+    while isinstance(node, GroupNode):
+        node = node.node
+    branches = node.nodes if isinstance(node, AlternationNode) else [node]
+    keywords = []
+    for branch in branches:
+        text = __literal_text(branch)
+        if text is None:
+            nested = keywords_of(branch) if isinstance(branch, GroupNode) else None
+            if nested is None:
+                return None
+            keywords.extend(nested)
+        else:
+            keywords.append(text)
+    return keywords
+
+def pattern_keywords(pattern: str, parsed: ASTNode | None = None) -> list[str] | None:
+    """
+    The keywords of a pattern that is an alternation of plain literals, None for every other pattern.
+    parsed is the unoptimized AST of pattern if the caller already parsed it.
+    """
+    if not any(char in SPECIAL_CHARACTERS for char in pattern):
+        # A plain keyword list never needs the parser, which matters for lists of thousands of keywords
+        keywords = pattern.split('|')
+        return keywords if '' not in keywords else None
+    return keywords_of(parsed if parsed is not None else ASTParser(pattern).parse())
+
+def compile(pattern: str, stats: CompileStats | None = None, parsed: ASTNode | None = None) -> AhoCorasick:
+    with stage(stats, 'parse'):
+        keywords = pattern_keywords(pattern, parsed)
+    if keywords is None:
+        raise Exception(f"Pattern is not an alternation of literals: {pattern}")
+    with stage(stats, 'aho_corasick'):
+        automaton = AhoCorasick(keywords)
+    if stats is not None:
+        stats.counts["keywords"] = len(automaton.keywords)
+        stats.record_dense(automaton.dfa)
+    return automaton
+
+if __name__ == '__main__':
+    import random
+    import re
+    import time
+
+    def leftmost_longest(keywords: list[str], string: str, pos: int = 0, endpos: int | None = None) -> list[tuple[int, int]]:
+        # The stdlib tries the branches in order, the longest keywords first gives leftmost-longest matches
+        pattern = re.compile('|'.join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)))
+        return [match.span() for match in pattern.finditer(string, pos, len(string) if endpos is None else endpos)]
+
+    for keywords, text in [
+        (['he', 'she', 'his', 'hers'], 'ushers and his shepherd'),
+        (['a', 'ab', 'abc', 'bcd'], 'xabcdabca'),
+        (['abcd', 'bc'], 'abcd abc'),
+        (['aa'], 'aaaaa'),
+        (['foo', 'foobar', 'fox'], 'foobarfoxfoob'),
+    ]:
+        automaton = AhoCorasick(keywords)
+        assert [match.span() for match in automaton.finditer(text)] == leftmost_longest(keywords, text), f"Test failed for {keywords}"
+        assert all(automaton.match(keyword) for keyword in keywords) and not automaton.match(text)
+        binary = text.encode('latin-1')
+        assert [match.span() for match in automaton.finditer(binary)] == leftmost_longest(keywords, text)
+        assert [match.span() for match in automaton.finditer(memoryview(binary), 2, len(text) - 1)] == leftmost_longest(keywords, text, 2, len(text) - 1)
+        print(f"Test passed for {keywords}.")
+
+    rng = random.Random(1234)
+    for _ in range(200):
+        keywords = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 30)))
+        automaton = compile('|'.join(keywords))
+        assert [match.span() for match in automaton.finditer(text)] == leftmost_longest(keywords, text), f"Test failed for {keywords} in '{text}'"
+        assert automaton.match(text) == (text in keywords)
+    print("Test passed for random keyword lists.")
+
+    assert pattern_keywords('(foo|b\\.r)|baz') == ['foo', 'b.r', 'baz'] and pattern_keywords('foo|ba[rz]') is None
+    assert compile('(x|y)|zz').findall('axyzzz') == ['x', 'y', 'zz']
+    print("Test passed for detecting keyword lists.")
+
+    words = sorted({''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 10))) for _ in range(50_000)})
+    start_time = time.time()
+    automaton = compile('|'.join(words))
+    compile_time = time.time() - start_time
+    text = ' '.join(rng.choice(words) if rng.random() < 0.1 else 'zzzz' for _ in range(20_000))
+    start_time = time.time()
+    found = automaton.findall(text)
+    assert len(found) >= text.count(' ') // 20 and all(automaton.match(word) for word in found)
+    print(f"Test passed for {len(words)} keywords: {automaton}, compiled in {compile_time:.2f}s, searched {len(text)} characters in {time.time() - start_time:.2f}s.")
@@ -1,4 +1,5 @@
-from src.token import TokenType, Tokenizer
+from typing import Iterable
+from src.token import Token, TokenType, Tokenizer
 
 
 class ASTNode:
@@ -151,7 +152,7 @@ CharRange -> Char RangeTail
 RangeTail -> '-' CharRange | ε
 Group -> '(' Regex ')'
 QuantifiedUnit -> Unit Quantifier
-Quantifier -> '*' | '+' | '?' | '{' Number ',' Number '}'
+Quantifier -> '*' | '+' | '?' | '{' Number '}' | '{' Number ',' '}' | '{' Number ',' Number '}'
 Char -> any non-special character | '\' SpecialCharacter | '.'
 ```
 
@@ -169,8 +170,8 @@ In this structure, we've introduced `RegexTail`, `ConcatenationTail`, and `Range
 """
 
 class ASTParser:
-    def __init__(self, regex: str) -> None:
-        self.tokenizer = Tokenizer(regex)
+    def __init__(self, regex: str, tokens: Iterable[Token] | None = None) -> None:
+        self.tokenizer = Tokenizer(regex, tokens)
         
     def parse(self) -> ASTNode:
         return self.__parse_regex()
@@ -228,7 +229,10 @@ class ASTParser:
         elif self.tokenizer.match(TokenType.SPECIFIC_QUANTIFIER):
             quantifier_parts = self.tokenizer.previous.value.split(',')
             min = int(quantifier_parts[0]) if quantifier_parts[0] else 0
-            max = int(quantifier_parts[1]) if len(quantifier_parts) > 1 and quantifier_parts[1] else None
+            if len(quantifier_parts) == 1:
+                max = min  # {n} repeats exactly n times
+            else:
+                max = int(quantifier_parts[1]) if quantifier_parts[1] else None
             return SpecificQuantifierNode(unit, min, max)
         else:
             return unit  # Return the unit itself if no quantifier is present
@@ -0,0 +1,315 @@
+"""
+Benchmarks for the compile pipeline and the matching engines.
+
+Every case is a pattern with a fixed set of inputs, generated from a seeded random number generator,
+so two runs on the same machine measure exactly the same work. Every time is the best of `repeat` runs.
+The results are written as JSON:
+```
+{
+    "meta": {"python": ..., "platform": ..., "repeat": ..., "seed": ...},
+    "cases": {
+        "<case>": {
+            "pattern": ...,
+            "compile.<stage>.seconds": ...,    tokenize, parse, optimize, nfa, dfa, minimize, dense, derivative
+            "counts.<automaton>": ...,         NFA / DFA states and transitions, dense classes, derivative DFA states
+            "match.<engine>.<input>.seconds": ...,  automata of the engines of src.regex, the prefilter and the stdlib re, short and long inputs
+            "match.<engine>.<input>.chars": ...
+        }
+    }
+}
+```
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import re
+import sys
+import time
+from typing import Any, Callable
+from src.aho import pattern_keywords
+from src.ast import ASTParser
+from src.dense import DenseDFA
+from src.derivative import Terms, ast_to_term, derivatives_to_dfa
+from src.dfa import minimize_dfa, nfa_to_dfa
+from src.nfa import NFA, ast_to_nfa
+from src.optimize import optimize
+from src.regex import compile
+from src.token import Tokenizer
+
+
+FORMAT_VERSION = 2
+SEED = 1234
+# Time differences below this many seconds are measurement noise and never count as a regression
+NOISE_FLOOR = 50e-6
+# 'prefilter' is Regex.match of the default engine, which answers literal patterns without running the automaton
+ENGINES = ['dfa', 'dense', 'lazy', 'pike', 'aho', 'glushkov', 'derivative', 'lazy_derivative', 'codegen', 'prefilter', 're']
+
+
+def __words(rng: random.Random, alphabet: str, min_length: int, max_length: int, count: int) -> list[str]:
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(min_length, max_length))) for _ in range(count)]
+
+def __cases(rng: random.Random, scale: int) -> list[dict[str, Any]]:
+    """
+    Each case has the pattern, a list of short inputs, a single long input and the engines to run.
+    `scale` multiplies the amount of input, the patterns stay the same.
+    """
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    # Drawn from their own generator, so the inputs of the other cases stay the same
+    keywords = sorted(set(__words(random.Random(SEED), 'abcdef', 3, 8, 300)))
+    return [
+        {
+            "name": "literal",
+            "pattern": "hello world",
+            "short": ['hello world', 'hello there', 'hello worlds'] * 300 * scale,
+            "long": 'hello world' * 1000 * scale,
+        },
+        {
+            "name": "email",
+            "pattern": "[a-z]+@[a-z]+\\.com",
+            "short": [f"{user}@{host}.com" for user, host in zip(__words(rng, letters, 1, 12, 1000 * scale), __words(rng, letters, 1, 8, 1000 * scale))],
+            "long": 'a' * 20_000 * scale + '@' + 'b' * 20_000 * scale + '.com',
+        },
+        {
+            "name": "alternation",
+            "pattern": "(foo|bar|baz|qux)+",
+            "short": [''.join(rng.choice(['foo', 'bar', 'baz', 'qux']) for _ in range(rng.randint(1, 6))) for _ in range(1000 * scale)],
+            "long": ''.join(rng.choice(['foo', 'bar', 'baz', 'qux']) for _ in range(10_000 * scale)),
+        },
+        {
+            "name": "required_literal",
+            "pattern": "\\d+foo[a-z]*",
+            "short": __words(rng, '0123456789', 1, 10, 500 * scale) + [digits + 'foo' + word for digits, word in zip(__words(rng, '0123456789', 1, 10, 500 * scale), __words(rng, letters, 0, 6, 500 * scale))],
+            "long": '7' * 40_000 * scale + 'foo' + 'z' * 10_000 * scale,
+        },
+        {
+            "name": "word_sequence",
+            "pattern": "(\\w+\\s?){1,8}",
+            "short": [' '.join(__words(rng, letters, 1, 8, rng.randint(1, 8))) for _ in range(1000 * scale)],
+            "long": 'w' * 40_000 * scale,
+        },
+        # Pathological patterns: exponential for backtracking matchers or for subset construction
+        {
+            "name": "nested_star",
+            "pattern": "(a*)*b",
+            "short": ['a' * length for length in range(1, 21)] * 10 * scale,
+            "long": 'a' * 20_000 * scale,
+            # re backtracks exponentially on this pattern
+            "engines": ['dfa', 'dense', 'lazy', 'pike'],
+        },
+        {
+            "name": "optional_chain",
+            "pattern": "a?" * 16 + "a" * 16,
+            "short": ['a' * length for length in range(10, 33)] * 10 * scale,
+            "long": 'a' * 32,
+        },
+        {
+            "name": "dfa_blowup",
+            "pattern": "(a|b)*a(a|b){10,10}",
+            "short": __words(rng, 'ab', 11, 30, 1000 * scale),
+            "long": ''.join(rng.choice('ab') for _ in range(50_000 * scale)),
+        },
+        # Machine-generated alternation of keywords sharing prefixes and suffixes
+        {
+            "name": "keywords",
+            "pattern": '|'.join(keywords),
+            "short": [rng.choice(keywords) for _ in range(500 * scale)] + __words(rng, 'abcdef', 3, 8, 500 * scale),
+            "long": 'abcdef' * 5_000 * scale,
+        },
+    ]
+
+def __best_time(function: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+def __count_nfa_transitions(nfa: NFA) -> int:
+    return sum(len(edges) for edges in nfa.transitions) + sum(len(targets) for targets in nfa.epsilon_transitions)
+
+def benchmark_compile(pattern: str, repeat: int) -> dict[str, float | int]:
+    results: dict[str, float | int] = {}
+    results["compile.tokenize.seconds"] = __best_time(lambda: sum(1 for _ in Tokenizer.tokenize(pattern)), repeat)
+    results["compile.parse.seconds"] = __best_time(lambda: ASTParser(pattern).parse(), repeat)
+
+    parsed = ASTParser(pattern).parse()
+    results["compile.optimize.seconds"] = __best_time(lambda: optimize(parsed), repeat)
+    ast = optimize(parsed)
+    results["compile.nfa.seconds"] = __best_time(lambda: ast_to_nfa(ast), repeat)
+    nfa = ast_to_nfa(ast)
+    results["compile.dfa.seconds"] = __best_time(lambda: nfa_to_dfa(nfa), repeat)
+    dfa = nfa_to_dfa(nfa)
+    results["compile.minimize.seconds"] = __best_time(lambda: minimize_dfa(dfa), repeat)
+    minimized = minimize_dfa(dfa)
+    results["compile.dense.seconds"] = __best_time(lambda: DenseDFA.from_dfa(minimized), repeat)
+    dense = DenseDFA.from_dfa(minimized)
+
+    def derivative_dfa():
+        # From the optimized AST straight to the DFA, to compare against nfa + dfa
+        terms = Terms()
+        return derivatives_to_dfa(terms, ast_to_term(ast, terms))
+    results["compile.derivative.seconds"] = __best_time(derivative_dfa, repeat)
+    derivative_states = derivative_dfa().get_all_states()
+
+    dfa_states, minimized_states = dfa.get_all_states(), minimized.get_all_states()
+    results["counts.nfa_states"] = nfa.n_states
+    results["counts.nfa_transitions"] = __count_nfa_transitions(nfa)
+    results["counts.dfa_states"] = len(dfa_states)
+    results["counts.dfa_transitions"] = sum(len(state.transitions) for state in dfa_states)
+    results["counts.minimized_states"] = len(minimized_states)
+    results["counts.minimized_transitions"] = sum(len(state.transitions) for state in minimized_states)
+    results["counts.dense_classes"] = dense.n_classes
+    results["counts.derivative_states"] = len(derivative_states)
+    results["counts.derivative_transitions"] = sum(len(state.transitions) for state in derivative_states)
+    return results
+
+def benchmark_match(pattern: str, engine: str, short: list[str], long: str, repeat: int) -> dict[str, float | int]:
+    if engine == 're':
+        match = re.compile(pattern).fullmatch
+    elif engine == 'prefilter':
+        match = compile(pattern).match
+    else:
+        # The automaton itself, Regex.match would decide literal patterns with the prefilter instead
+        match = compile(pattern, engine=engine).automaton.match
+
+    def run_short() -> None:
+        for string in short:
+            match(string)
+
+    return {
+        f"match.{engine}.short.seconds": __best_time(run_short, repeat),
+        f"match.{engine}.short.chars": sum(map(len, short)),
+        f"match.{engine}.long.seconds": __best_time(lambda: match(long), repeat),
+        f"match.{engine}.long.chars": len(long),
+    }
+
+def run(repeat: int = 5, scale: int = 1, engines: list[str] | None = None, names: list[str] | None = None, log: Callable[[str], None] = lambda line: None) -> dict[str, Any]:
+    rng = random.Random(SEED)
+    cases: dict[str, dict[str, Any]] = {}
+    for case in __cases(rng, scale):
+        if names and case["name"] not in names:
+            continue
+        results: dict[str, Any] = {"pattern": case["pattern"]}
+        results.update(benchmark_compile(case["pattern"], repeat))
+        pattern = case["pattern"] if len(case["pattern"]) <= 40 else case["pattern"][:37] + '...'
+        log(f"{case['name']}: compiled '{pattern}' to {results['counts.minimized_states']} states")
+        for engine in case.get("engines", ENGINES):
+            if engines and engine not in engines:
+                continue
+            if engine == 'aho' and pattern_keywords(case["pattern"]) is None:
+                # Aho-Corasick only compiles alternations of literals
+                continue
+            results.update(benchmark_match(case["pattern"], engine, case["short"], case["long"], repeat))
+            chars = results[f"match.{engine}.short.chars"] + results[f"match.{engine}.long.chars"]
+            seconds = results[f"match.{engine}.short.seconds"] + results[f"match.{engine}.long.seconds"]
+            log(f"    {engine:>15}: {chars / seconds / 1e6:8.2f} M chars/s")
+        cases[case["name"]] = results
+
+    return {
+        "meta": {
+            "format": FORMAT_VERSION,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "scale": scale,
+            "seed": SEED,
+        },
+        "cases": cases,
+    }
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float = 0.1, noise_floor: float = NOISE_FLOOR) -> list[str]:
+    """
+    Returns a line for every metric of new that regressed against old.
+    Times regress if they are more than `threshold` (relative) and `noise_floor` (absolute) slower, counts regress if they grow at all.
+    """
+    for key in ("format", "scale", "seed"):
+        if old["meta"][key] != new["meta"][key]:
+            raise Exception(f"Can not compare runs with different {key}: {old['meta'][key]} and {new['meta'][key]}")
+
+    regressions = []
+    for name, new_results in new["cases"].items():
+        old_results = old["cases"].get(name)
+        if old_results is None or old_results.get("pattern") != new_results.get("pattern"):
+            continue
+        for metric, new_value in new_results.items():
+            old_value = old_results.get(metric)
+            if old_value is None or metric == "pattern" or metric.endswith(".chars"):
+                continue
+            if metric.startswith("counts."):
+                if new_value > old_value:
+                    regressions.append(f"{name} {metric}: {old_value} -> {new_value}")
+            elif new_value > old_value * (1 + threshold) and new_value - old_value > noise_floor:
+                regressions.append(f"{name} {metric}: {old_value:.6f}s -> {new_value:.6f}s ({new_value / old_value - 1:+.0%})")
+    return regressions
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('-o', '--output', help="write the results as JSON to this file (default: standard output)")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per measurement, the best one is reported")
+    parser.add_argument('--scale', type=int, default=1, help="multiplies the amount of input per case")
+    parser.add_argument('--engine', action='append', dest='engines', choices=ENGINES, help="only run this engine (repeatable)")
+    parser.add_argument('--case', action='append', dest='names', help="only run this case (repeatable)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files instead and exit with 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown that counts as a regression (default: 0.1)")
+    parser.add_argument('--noise-floor', type=float, default=NOISE_FLOOR, help=f"absolute slowdown in seconds below which times never regress (default: {NOISE_FLOOR})")
+    parser.set_defaults(run=main)
+
+def main(args: argparse.Namespace) -> int:
+    if args.compare:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            regressions = compare(json.load(old_file), json.load(new_file), args.threshold, args.noise_floor)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regressions")
+        return 1 if regressions else 0
+
+    results = run(args.repeat, args.scale, args.engines, args.names, log=lambda line: print(line, file=sys.stderr))
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(data + '\n')
+    else:
+        print(data)
+    return 0
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    results = run(repeat=1, engines=['dfa', 'prefilter', 're'], names=['literal', 'email'], log=print)
+    assert set(results["cases"]) == {'literal', 'email'}
+    assert all(f"match.{engine}.long.seconds" in case for case in results["cases"].values() for engine in ['dfa', 'prefilter', 're'])
+    assert compare(results, results) == []
+
+    # A slower stage and a grown automaton are regressions, a slowdown below the noise floor is not
+    slower = json.loads(json.dumps(results))
+    slower["cases"]["email"]["match.dfa.long.seconds"] = results["cases"]["email"]["match.dfa.long.seconds"] * 2 + 1e-3
+    slower["cases"]["email"]["counts.dfa_states"] += 1
+    slower["cases"]["literal"]["compile.parse.seconds"] += NOISE_FLOOR / 2
+    regressions = compare(results, slower)
+    assert sorted(regression.split(':')[0] for regression in regressions) == ["email counts.dfa_states", "email match.dfa.long.seconds"], regressions
+    assert compare(slower, results) == []
+    print("Test passed for comparing runs.")
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    with tempfile.TemporaryDirectory() as directory:
+        old_path, new_path = os.path.join(directory, 'old.json'), os.path.join(directory, 'new.json')
+        for path, data in [(old_path, results), (new_path, slower)]:
+            with open(path, 'w') as file:
+                json.dump(data, file)
+        assert main(parser.parse_args(['--compare', old_path, old_path])) == 0
+        assert main(parser.parse_args(['--compare', old_path, new_path])) == 1
+        assert main(parser.parse_args(['--compare', new_path, old_path])) == 0
+    print("Test passed for the exit status.")
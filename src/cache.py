@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, NamedTuple, TypeVar
+
+
+T = TypeVar('T')
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class _PendingBuild:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+
+
+class CompileCache(Generic[T]):
+    """
+    A process-wide, size-bounded LRU cache of compiled automata.
+
+    Concurrent callers asking for the same key while it is being built wait for that single build
+    instead of racing to compile the same pattern several times.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        if maxsize < 0:
+            raise Exception("Cache size must be non-negative")
+        self.__maxsize = maxsize
+        self.__entries: OrderedDict[Hashable, T] = OrderedDict()
+        self.__pending: dict[Hashable, _PendingBuild] = {}
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def get_or_build(self, key: Hashable, build: Callable[[], T]) -> T:
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+                return self.__entries[key]
+
+            pending = self.__pending.get(key)
+            is_owner = pending is None
+            if pending is None:
+                pending = _PendingBuild()
+                self.__pending[key] = pending
+                self.__misses += 1
+            else:
+                # Someone else is already building this key, share their result
+                self.__hits += 1
+
+        if not is_owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value = build()
+        except BaseException as error:
+            pending.error = error
+            with self.__lock:
+                del self.__pending[key]
+            pending.done.set()
+            raise
+
+        pending.value = value
+        with self.__lock:
+            del self.__pending[key]
+            if self.__maxsize > 0:
+                self.__entries[key] = value
+                self.__evict(self.__maxsize)
+        pending.done.set()
+        return value
+
+    def resize(self, maxsize: int) -> None:
+        if maxsize < 0:
+            raise Exception("Cache size must be non-negative")
+        with self.__lock:
+            self.__maxsize = maxsize
+            self.__evict(maxsize)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__hits = 0
+            self.__misses = 0
+            self.__evictions = 0
+
+    def info(self) -> CacheInfo:
+        with self.__lock:
+            return CacheInfo(self.__hits, self.__misses, self.__evictions, self.__maxsize, len(self.__entries))
+
+    def __evict(self, maxsize: int) -> None:
+        # Caller must hold the lock
+        while len(self.__entries) > maxsize:
+            self.__entries.popitem(last=False)
+            self.__evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__entries
+
+
+if __name__ == '__main__':
+    builds = []
+
+    def build(value: str) -> Callable[[], str]:
+        def inner() -> str:
+            builds.append(value)
+            return value.upper()
+        return inner
+
+    cache: CompileCache[str] = CompileCache(maxsize=2)
+    assert cache.get_or_build('a', build('a')) == 'A'
+    assert cache.get_or_build('a', build('a')) == 'A'
+    assert cache.get_or_build('b', build('b')) == 'B'
+    assert cache.get_or_build('c', build('c')) == 'C'  # Evicts 'a'
+    assert 'a' not in cache and 'b' in cache and 'c' in cache
+    assert builds == ['a', 'b', 'c']
+    assert cache.info() == CacheInfo(hits=1, misses=3, evictions=1, maxsize=2, currsize=2)
+
+    cache.resize(1)
+    assert len(cache) == 1 and 'c' in cache
+    cache.clear()
+    assert cache.info() == CacheInfo(hits=0, misses=0, evictions=0, maxsize=1, currsize=0)
+    print("Test passed for LRU eviction and resizing.")
+
+    # Concurrent callers share a single build
+    release = threading.Event()
+    slow_builds = []
+
+    def slow_build() -> str:
+        slow_builds.append(1)
+        release.wait()
+        return 'slow'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_build('slow', slow_build))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['slow'] * 8, results
+    assert len(slow_builds) == 1, slow_builds
+    print("Test passed for concurrent builds.")
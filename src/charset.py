@@ -0,0 +1,98 @@
+import mmap
+from typing import Hashable, Iterable, TypeVar
+
+
+# Inclusive range of code points, a single character 'a' is (97, 97)
+Interval = tuple[int, int]
+
+# Everything the engines can match against. Binary input is matched byte by byte,
+# each byte standing for the code point with the same value (i.e. as if it was decoded as latin-1)
+Text = str | bytes | bytearray | memoryview | mmap.mmap
+
+T = TypeVar('T', bound=Hashable)
+
+
+WILDCARD: tuple[Interval, ...] = ((0, 255),)
+DIGIT: tuple[Interval, ...] = ((ord('0'), ord('9')),)
+WORD: tuple[Interval, ...] = ((ord('0'), ord('9')), (ord('A'), ord('Z')), (ord('_'), ord('_')), (ord('a'), ord('z')))
+SPACE: tuple[Interval, ...] = ((ord('\t'), ord('\r')), (ord(' '), ord(' ')))
+
+
+def normalize(intervals: Iterable[Interval]) -> tuple[Interval, ...]:
+    """Sorts the intervals and merges overlapping or adjacent ones. Empty intervals (start > end) are dropped."""
+    merged: list[list[int]] = []
+    for start, end in sorted(interval for interval in intervals if interval[0] <= interval[1]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple((start, end) for start, end in merged)
+
+def split_disjoint(edges: Iterable[tuple[int, int, T]]) -> list[tuple[int, int, frozenset[T]]]:
+    """
+    Splits possibly overlapping labelled intervals into sorted, disjoint intervals,
+    each with the set of all labels whose interval covers it.
+    Adjacent intervals with the same label set are merged again.
+    """
+    events: dict[int, list[tuple[int, T]]] = {}
+    for start, end, label in edges:
+        events.setdefault(start, []).append((1, label))
+        events.setdefault(end + 1, []).append((-1, label))
+
+    result: list[tuple[int, int, frozenset[T]]] = []
+    active: dict[T, int] = {}
+    points = sorted(events)
+    for point, next_point in zip(points, points[1:]):
+        for delta, label in events[point]:
+            count = active.get(label, 0) + delta
+            if count:
+                active[label] = count
+            else:
+                del active[label]
+
+        if not active:
+            continue
+        labels = frozenset(active)
+        if result and result[-1][1] == point - 1 and result[-1][2] == labels:
+            result[-1] = (result[-1][0], next_point - 1, labels)
+        else:
+            result.append((point, next_point - 1, labels))
+
+    return result
+
+def as_symbols(text: Text) -> str | memoryview:
+    """Strings are walked character by character, everything else is viewed as unsigned bytes without copying it."""
+    if isinstance(text, str):
+        return text
+    return memoryview(text).cast('B')
+
+def codepoint(symbol: str | int) -> int:
+    return symbol if isinstance(symbol, int) else ord(symbol)
+
+def format_interval(interval: Interval) -> str:
+    start, end = interval
+    if start == end:
+        return chr(start)
+    return f"{chr(start)}-{chr(end)}"
+
+
+if __name__ == '__main__':
+    assert normalize([(5, 3), (ord('a'), ord('c')), (ord('b'), ord('f')), (ord('g'), ord('g')), (0, 1)]) == ((0, 1), (ord('a'), ord('g')))
+    print("Test passed for normalize.")
+
+    assert split_disjoint([(0, 10, 'x'), (5, 15, 'y'), (20, 20, 'x')]) == [
+        (0, 4, frozenset('x')),
+        (5, 10, frozenset('xy')),
+        (11, 15, frozenset('y')),
+        (20, 20, frozenset('x')),
+    ]
+    assert split_disjoint([(0, 4, 'x'), (5, 9, 'x')]) == [(0, 9, frozenset('x'))]
+    print("Test passed for split_disjoint.")
+
+    assert format_interval((ord('a'), ord('z'))) == 'a-z'
+    assert format_interval((ord('q'), ord('q'))) == 'q'
+    print("Test passed for format_interval.")
+
+    assert list(as_symbols(b'ab')) == [97, 98] and list(as_symbols(memoryview(bytearray(b'ab')))) == [97, 98]
+    assert [codepoint(symbol) for symbol in as_symbols('ab')] == [97, 98]
+    print("Test passed for as_symbols.")
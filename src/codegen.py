@@ -0,0 +1,295 @@
+"""
+Compiles a DFA into the source of a Python module that matches the pattern:
+```
+VERSION = 2
+COMPILER = 1
+PATTERN = '[a-z]+@[a-z]+\\.com'
+N_STATES = 8
+ACCEPTING = frozenset([8])
+MEMO_SIZE = 1024
+
+def step(state, value):
+    if state < 5:
+        if state == 1:
+            if 97 <= value <= 122:
+                return 2
+            return 0
+        elif state == 2:
+            if value == 64:
+                return 3
+            elif 97 <= value <= 122:
+                return 2
+            return 0
+        ...
+    else:
+        ...
+
+TRANSITIONS = [{None: state} for state in range(N_STATES + 1)]
+
+def match(string):
+    ...
+```
+`step` is the DFA as straight-line code: the state and then the code point are dispatched on with balanced trees of comparisons.
+In CPython a dictionary lookup is much cheaper than a chain of comparisons, so `match` only calls `step` the first time
+a character (or byte) is read in a state. The target is memoized in `TRANSITIONS[state]`, a dictionary that maps characters
+straight to the dictionary of the next state, so the hot loop is a single subscript per character without any calls.
+A missing key raises the `KeyError` that leads to `step`, and dead transitions lead to the empty dictionary of state 0.
+A state memoizes at most `MEMO_SIZE` characters, like the bounded cache of the lazy DFA, further ones always go through `step`.
+"""
+
+import builtins
+import hashlib
+import importlib.util
+import os
+import py_compile
+import tempfile
+from typing import Any, Callable
+from src.ast import ASTNode
+from src.charset import Text
+from src.dense import DenseDFA
+from src.dfa import Budget, DFAState, compile as dfa_compile
+from src.serialize import COMPILER_VERSION
+from src.stats import CompileStats, stage
+
+
+CODEGEN_VERSION = 2
+# Chains of at most this many comparisons are emitted as if/elif, longer ones are split in half
+LEAF_SIZE = 4
+# Characters (and bytes) memoized per state by the generated match
+MEMO_SIZE = 1024
+
+__MATCH = """
+# TRANSITIONS[state] maps the characters (and bytes) read in the state so far to TRANSITIONS[next state], key None is the state itself
+TRANSITIONS = [{None: state} for state in range(N_STATES + 1)]
+
+def match(string):
+    if not isinstance(string, str):
+        string = memoryview(string).cast('B')
+    transitions = TRANSITIONS[1]
+    symbols = iter(string)
+    while True:
+        try:
+            for symbol in symbols:
+                transitions = transitions[symbol]
+            return transitions[None] in ACCEPTING
+        except KeyError:
+            state = transitions[None]
+            if not state:
+                return False
+            next_transitions = TRANSITIONS[step(state, symbol if symbol.__class__ is int else ord(symbol))]
+            if len(transitions) <= MEMO_SIZE:
+                transitions[symbol] = next_transitions
+            transitions = next_transitions
+"""
+
+
+def __emit_transitions(lines: list[str], edges: list[tuple[int, int, int]], indent: str) -> None:
+    if len(edges) > LEAF_SIZE:
+        middle = len(edges) // 2
+        lines.append(f"{indent}if value < {edges[middle][0]}:")
+        __emit_transitions(lines, edges[:middle], indent + '    ')
+        lines.append(f"{indent}else:")
+        __emit_transitions(lines, edges[middle:], indent + '    ')
+        return
+
+    for i, (start, end, target) in enumerate(edges):
+        condition = f"value == {start}" if start == end else f"{start} <= value <= {end}"
+        lines.append(f"{indent}{'if' if i == 0 else 'elif'} {condition}:")
+        lines.append(f"{indent}    return {target}")
+    lines.append(f"{indent}return 0")
+
+def __emit_states(lines: list[str], transitions: list[list[tuple[int, int, int]]], state_ids: range, indent: str) -> None:
+    if len(state_ids) > LEAF_SIZE:
+        middle = state_ids[len(state_ids) // 2]
+        lines.append(f"{indent}if state < {middle}:")
+        __emit_states(lines, transitions, range(state_ids.start, middle), indent + '    ')
+        lines.append(f"{indent}else:")
+        __emit_states(lines, transitions, range(middle, state_ids.stop), indent + '    ')
+        return
+
+    for i, state_id in enumerate(state_ids):
+        if len(state_ids) == 1:
+            __emit_transitions(lines, transitions[state_id], indent)
+            continue
+        # The last state of the range is the only one left, it needs no comparison
+        if i == 0:
+            lines.append(f"{indent}if state == {state_id}:")
+        elif i < len(state_ids) - 1:
+            lines.append(f"{indent}elif state == {state_id}:")
+        else:
+            lines.append(f"{indent}else:")
+        __emit_transitions(lines, transitions[state_id], indent + '    ')
+
+def _header(pattern: str) -> str:
+    # Identifies the pattern and the compiler, ModuleCache checks it before it runs a cached module
+    return f"# Generated by src.codegen, do not edit\nVERSION = {CODEGEN_VERSION}\nCOMPILER = {COMPILER_VERSION}\nPATTERN = {repr(pattern)}\n"
+
+def generate(start_dfa_state: DFAState, pattern: str) -> str:
+    """The source of a module whose `match` function runs the DFA."""
+    # State 0 is the dead state, like in the dense DFA
+    states = DenseDFA.number_states(start_dfa_state)
+    index = {state: i for i, state in enumerate(states, start=1)}
+    transitions: list[list[tuple[int, int, int]]] = [[]]
+    for state in states:
+        transitions.append(sorted((start, end, index[next_state]) for (start, end), next_state in state.transitions.items()))
+
+    lines = [
+        f"N_STATES = {len(states)}",
+        f"ACCEPTING = frozenset({repr([index[state] for state in states if state.is_final])})",
+        f"MEMO_SIZE = {MEMO_SIZE}",
+        "",
+        "def step(state, value):",
+    ]
+    __emit_states(lines, transitions, range(1, len(transitions)), '    ')
+    return _header(pattern) + '\n'.join(lines) + '\n' + __MATCH
+
+
+class GeneratedDFA:
+    """
+    A DFA compiled into a specialized Python module, see `generate`.
+    `match` is the generated function itself, `step(state, codepoint)` the generated transition function.
+    """
+
+    def __init__(self, source: str, namespace: dict[str, Any]) -> None:
+        self.source = source
+        self.pattern: str = namespace["PATTERN"]
+        self.n_states: int = namespace["N_STATES"]
+        self.step: Callable[[int, int], int] = namespace["step"]
+        self.match: Callable[[Text], bool] = namespace["match"]
+
+    @staticmethod
+    def from_source(source: str) -> "GeneratedDFA":
+        namespace: dict[str, Any] = {}
+        exec(builtins.compile(source, '<generated matcher>', 'exec'), namespace)
+        return GeneratedDFA(source, namespace)
+
+    def __repr__(self) -> str:
+        return f"GeneratedDFA({repr(self.pattern)}, {self.n_states} states, {len(self.source.splitlines())} lines)"
+
+
+def compile(pattern: str, minimize: bool = True, stats: CompileStats | None = None, budget: Budget | None = None, ast: ASTNode | None = None) -> GeneratedDFA:
+    dfa = dfa_compile(pattern, minimize, stats, budget, ast)
+    with stage(stats, 'codegen'):
+        generated = GeneratedDFA.from_source(generate(dfa, pattern))
+    if stats is not None:
+        stats.record_codegen(generated)
+    return generated
+
+
+class ModuleCache:
+    """
+    Keeps generated matchers as Python modules in a directory, one file per pattern named after the hash of the pattern and its compile options.
+    Python keeps the bytecode of imported modules in `__pycache__`, so loading a cached matcher skips the tokenizer, the parser,
+    the NFA, subset construction, code generation and byte-compilation.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, pattern: str, minimize: bool = True) -> str:
+        key = f"{CODEGEN_VERSION}\0{COMPILER_VERSION}\0{minimize}\0{pattern}".encode('utf-8', 'surrogatepass')
+        return os.path.join(self.directory, 'rx_' + hashlib.sha256(key).hexdigest() + '.py')
+
+    @staticmethod
+    def __load(path: str, pattern: str) -> GeneratedDFA:
+        with open(path, encoding='utf-8') as file:
+            source = file.read()
+        # Nothing is executed unless the file was generated for this pattern by this version of the compiler
+        if not source.startswith(_header(pattern)):
+            raise Exception(f"{path} was not generated for {repr(pattern)} by this compiler")
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+        if spec is None or spec.loader is None:
+            raise Exception(f"Can not import {path}")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return GeneratedDFA(source, vars(module))
+
+    def get_or_compile(self, pattern: str, minimize: bool = True, budget: Budget | None = None, ast: ASTNode | None = None) -> GeneratedDFA:
+        path = self.path(pattern, minimize)
+        try:
+            return self.__load(path, pattern)
+        except Exception:
+            # Missing, corrupt or outdated file, it is (over)written below
+            pass
+
+        source = generate(dfa_compile(pattern, minimize, budget=budget, ast=ast), pattern)
+        # Write to a temporary file first, so concurrent readers never see a partially written file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+                file.write(source)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        # Written right away (even if Python is told not to write bytecode), so the next process only unmarshals it
+        py_compile.compile(path, doraise=True)
+        return self.__load(path, pattern)
+
+
+if __name__ == '__main__':
+    import time
+    from src.test import REGEX_TEST_CASES, test_regex
+
+    def parse(pattern: str) -> GeneratedDFA:
+        return compile(pattern)
+
+    def match(compiled: GeneratedDFA, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: GeneratedDFA) -> None:
+        print(f"Pattern '{pattern}' compiled to {compiled}")
+
+    test_regex(parse, match, log)
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+    test_regex(lambda pattern: compile(pattern, minimize=False), match, lambda pattern, compiled: None)
+
+    # Many states and many transitions per state are dispatched on with nested comparisons
+    for pattern in ['(a|b)*a(a|b){8,8}', '[a-z]{0,3}(alpha|beta|gamma|delta|epsilon|zeta|eta|theta)', '[Ā-Ȁ]x|一+']:
+        compiled, expected = compile(pattern), dfa_compile(pattern)
+        for string in ['a' * 9, 'ba' + 'b' * 8, 'abzeta', 'zzztheta', 'theta2', 'Őx', '一一', '一x', '']:
+            assert compiled.match(string) == expected.match(string), f"Test failed for '{pattern}' and '{string}'"
+    print("Test passed for large DFAs.")
+
+    # Characters and bytes are memoized in the same dictionaries without getting mixed up
+    compiled = compile('[a-c]+x')
+    for string in ['abcx', b'abcx', bytearray(b'bx'), memoryview(b'ax'), 'abc', b'a', 'ab\x00x', b'\x61x']:
+        expected = dfa_compile('[a-c]+x').match(string)
+        assert compiled.match(string) == expected and compiled.match(string) == expected, f"Test failed for {repr(string)}"
+    print("Test passed for mixed str and bytes input.")
+
+    # Each state memoizes at most MEMO_SIZE characters, the others still match through step
+    compiled = compile('[一-鿿]+')
+    text = ''.join(map(chr, range(0x4E00, 0x4E00 + 4 * MEMO_SIZE)))
+    assert compiled.match(text) and compiled.match(text[::-1])
+    namespace = compiled.match.__globals__
+    assert all(len(transitions) <= MEMO_SIZE + 1 for transitions in namespace["TRANSITIONS"])
+    print("Test passed for the bounded transition memo.")
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ModuleCache(directory)
+        start_time = time.time()
+        for case in REGEX_TEST_CASES:
+            cache.get_or_compile(case["pattern"])
+        cold_time = time.time() - start_time
+        assert len([name for name in os.listdir(directory) if name.endswith('.py')]) == len(REGEX_TEST_CASES)
+        assert os.listdir(os.path.join(directory, '__pycache__'))
+
+        start_time = time.time()
+        for case in REGEX_TEST_CASES:
+            compiled = ModuleCache(directory).get_or_compile(case["pattern"])
+            assert all(compiled.match(string) for string in case["matching"])
+            assert not any(compiled.match(string) for string in case["not_matching"])
+        warm_time = time.time() - start_time
+
+        with open(cache.path('a'), 'w') as file:
+            file.write("this is not python")
+        assert cache.get_or_compile('a').match('a') and cache.get_or_compile('a').pattern == 'a'
+
+        # A file of another pattern (or with a stale header) is regenerated without running any of it
+        marker = os.path.join(directory, 'executed')
+        with open(cache.path('b'), 'w') as file:
+            file.write(f"PATTERN = 'b'\nopen({repr(marker)}, 'w').close()\n")
+        assert cache.get_or_compile('b').match('b') and not os.path.exists(marker)
+    print(f"Test passed for the module cache, cold {cold_time * 1000:.1f}ms, warm {warm_time * 1000:.1f}ms.")
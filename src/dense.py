@@ -0,0 +1,279 @@
+from array import array
+from bisect import bisect_right
+from itertools import chain
+from typing import Iterable, Iterator
+from src.ast import ASTNode
+from src.charset import Text, format_interval
+from src.dfa import Budget, DFAState, alphabet_classes, compile as dfa_compile
+from src.stats import CompileStats, stage
+from src.test import REGEX_TEST_CASES, test_regex
+
+try:
+    import numpy
+except ImportError:  # Optional, match_many falls back to matching one string at a time
+    numpy = None
+
+
+class ClassMap(dict[int, int]):
+    """
+    Maps code points to their equivalence class, every code point the pattern never mentions falls into class 0.
+
+    The classes are stored as sorted, disjoint intervals and looked up by bisection.
+    The dictionary itself only memoizes the code points that were actually looked up,
+    which also makes it usable as a `str.translate` table. Latin-1 code points are always memoized,
+    the others only until the memo holds MEMO_SIZE entries, so text in other scripts cannot grow it without bound.
+    """
+
+    MEMO_SIZE = 1024
+
+    def __init__(self, intervals: list[tuple[int, int, int]]) -> None:
+        super().__init__()
+        self.intervals = sorted(intervals)
+        self.__starts = [start for start, _, _ in self.intervals]
+
+    def __missing__(self, codepoint: int) -> int:
+        i = bisect_right(self.__starts, codepoint) - 1
+        class_id = self.intervals[i][2] if i >= 0 and codepoint <= self.intervals[i][1] else 0
+        if codepoint <= 0xFF or len(self) < ClassMap.MEMO_SIZE:
+            self[codepoint] = class_id
+        return class_id
+
+    def below(self, size: int) -> list[int]:
+        """The class ids of the code points 0 to size - 1, built from the intervals without filling the memo."""
+        class_ids = [0] * size
+        for start, end, class_id in self.intervals[:bisect_right(self.__starts, size - 1)]:
+            end = min(end, size - 1)
+            class_ids[start:end + 1] = [class_id] * (end + 1 - start)
+        return class_ids
+
+
+class DenseDFA:
+    """
+    A DFA flattened into a single integer transition table.
+
+    Characters are mapped to equivalence classes (characters that every state treats the same way share a class),
+    so the table only needs `n_states * n_classes` entries, indexed by `state * n_classes + class`.
+    State 0 is the dead state and class 0 stands for every character the pattern never mentions.
+    """
+
+    DEAD = 0
+    # Input is translated to class ids in blocks, so large buffers are never copied as a whole.
+    # Blocks start small and grow, so scans that stop early only translate about as much as they read
+    MIN_BLOCK_SIZE = 1 << 8
+    MAX_BLOCK_SIZE = 1 << 16
+    # Number of strings match_many advances together, bounds the size of the padded class id matrix
+    BATCH_SIZE = 1 << 14
+
+    def __init__(self, table: array, classes: ClassMap, accepting: bytes, start: int) -> None:
+        self.table = table
+        self.classes = classes
+        self.accepting = accepting
+        self.start = start
+        self.n_states = len(accepting)
+        self.n_classes = len(table) // self.n_states
+        # Binary input is matched byte by byte, byte b standing for code point b
+        self.byte_classes = classes.below(256)
+        self.__byte_translation = bytes(self.byte_classes) if self.n_classes <= 256 else None
+        self.__numpy_tables = None
+
+    @staticmethod
+    def number_states(start_dfa_state: DFAState) -> list[DFAState]:
+        # Breadth first, so that the same DFA always produces the same table. states[i] becomes state i + 1
+        states = [start_dfa_state]
+        seen = {start_dfa_state}
+        for state in states:
+            for next_state in state.transitions.values():
+                if next_state not in seen:
+                    seen.add(next_state)
+                    states.append(next_state)
+        return states
+
+    @staticmethod
+    def from_dfa(start_dfa_state: DFAState) -> "DenseDFA":
+        states = DenseDFA.number_states(start_dfa_state)
+        index = {state: i for i, state in enumerate(states, start=1)}
+
+        # All code points that lead to the same target in every state share one class
+        class_intervals = alphabet_classes(states)
+        classes = ClassMap([(start, end, class_id) for class_id, intervals in enumerate(class_intervals, start=1) for start, end in intervals])
+
+        n_classes = len(class_intervals) + 1
+        table = array('i', [DenseDFA.DEAD]) * ((len(states) + 1) * n_classes)
+        for class_id, intervals in enumerate(class_intervals, start=1):
+            codepoint = intervals[0][0]
+            for state_id, state in enumerate(states, start=1):
+                next_state = state.next_state(codepoint)
+                if next_state is not None:
+                    table[state_id * n_classes + class_id] = index[next_state]
+
+        accepting = bytes([0] + [1 if state.is_final else 0 for state in states])
+        return DenseDFA(table, classes, accepting, 1)
+
+    def translate(self, block: str | memoryview) -> bytes | list[int]:
+        """The class ids of a string or a memoryview of bytes, as bytes if every class id fits into one."""
+        if isinstance(block, str):
+            if self.n_classes <= 256:
+                # Translate the whole block to class ids in C
+                return block.translate(self.classes).encode('latin-1')
+            return [self.classes[ord(char)] for char in block]
+        if self.__byte_translation is not None:
+            return block.tobytes().translate(self.__byte_translation)
+        return [self.byte_classes[byte] for byte in block]
+
+    def class_ids(self, text: Text, start: int = 0, end: int | None = None, reverse: bool = False) -> Iterator[int]:
+        """Iterates over the class ids of text[start:end] (backwards if reverse is set), translating one block at a time."""
+        symbols = text if isinstance(text, str) else memoryview(text).cast('B')
+        end = len(symbols) if end is None else end
+        if reverse:
+            blocks = (reversed(self.translate(symbols[block_start:block_end])) for block_start, block_end in _blocks(start, end, reverse))
+        else:
+            blocks = (self.translate(symbols[block_start:block_end]) for block_start, block_end in _blocks(start, end, reverse))
+        return chain.from_iterable(blocks)
+
+    def match(self, string: Text) -> bool:
+        table, n_classes = self.table, self.n_classes
+        state = self.start
+
+        for class_id in self.class_ids(string):
+            state = table[state * n_classes + class_id]
+            if state == DenseDFA.DEAD:
+                return False
+
+        return self.accepting[state] == 1
+
+    def match_many(self, strings: Iterable[Text]) -> "numpy.ndarray | list[bool]":
+        """
+        Matches every string, returning a boolean NumPy array (or a list of booleans if NumPy is not installed).
+
+        With NumPy the strings are translated to a padded matrix of class ids and a whole batch of strings
+        advances through the transition table at once, one column of the matrix per step.
+        """
+        strings = list(strings)
+        if numpy is None:
+            return [self.match(string) for string in strings]
+
+        lengths = numpy.fromiter((len(string) if isinstance(string, str) else memoryview(string).nbytes for string in strings), dtype=numpy.intp, count=len(strings))
+        # Strings of similar length are batched together, so short strings are not padded to the longest one
+        order = numpy.argsort(lengths, kind='stable')
+        result = numpy.zeros(len(strings), dtype=bool)
+        for batch_start in range(0, len(strings), DenseDFA.BATCH_SIZE):
+            batch = order[batch_start:batch_start + DenseDFA.BATCH_SIZE]
+            result[batch] = self.__match_batch([strings[i] for i in batch], lengths[batch])
+        return result
+
+    def __match_batch(self, strings: list[Text], lengths: "numpy.ndarray") -> "numpy.ndarray":
+        if self.__numpy_tables is None:
+            # The extra last column maps every state to itself, it pads strings that are shorter than the longest one
+            table = numpy.frombuffer(self.table, dtype=numpy.int32).reshape(self.n_states, self.n_classes)
+            padded_table = numpy.hstack([table, numpy.arange(self.n_states, dtype=numpy.int32)[:, None]])
+            intervals = numpy.array(self.classes.intervals, dtype=numpy.int64).reshape(-1, 3)
+            self.__numpy_tables = (padded_table, intervals[:, 0], intervals[:, 1], intervals[:, 2], numpy.frombuffer(self.accepting, dtype=numpy.uint8))
+        padded_table, starts, ends, interval_classes, accepting = self.__numpy_tables
+
+        # Bytes stand for the code points 0-255, which is exactly what decoding them as latin-1 produces
+        text = ''.join(string if isinstance(string, str) else memoryview(string).cast('B').tobytes().decode('latin-1') for string in strings)
+        codepoints = numpy.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=numpy.uint32).astype(numpy.int64)
+        i = numpy.searchsorted(starts, codepoints, side='right') - 1
+        in_interval = (i >= 0) & (codepoints <= ends[i]) if len(starts) else numpy.zeros(len(codepoints), dtype=bool)
+        class_ids = numpy.where(in_interval, interval_classes[i] if len(starts) else 0, 0)
+
+        width = int(lengths.max()) if len(strings) else 0
+        padded = numpy.full((len(strings), width), self.n_classes, dtype=numpy.intp)
+        padded[numpy.arange(width) < lengths[:, None]] = class_ids
+        columns = numpy.ascontiguousarray(padded.T)
+
+        states = numpy.full(len(strings), self.start, dtype=numpy.intp)
+        for column in columns:
+            states = padded_table[states, column]
+        return accepting[states] == 1
+
+    def to_dot(self) -> str:
+        labels: dict[int, list[str]] = {}
+        for start, end, class_id in self.classes.intervals:
+            labels.setdefault(class_id, []).append(format_interval((start, end)))
+
+        dot_str = 'digraph DenseDFA {\n'
+        dot_str += '    rankdir=LR;\n'
+        dot_str += '    node [shape = circle];\n'
+        dot_str += f'    start -> S{self.start};\n'
+        for state in range(1, self.n_states):
+            if self.accepting[state]:
+                dot_str += f'    S{state} [shape=doublecircle];\n'
+            for class_id, chars in labels.items():
+                target = self.table[state * self.n_classes + class_id]
+                if target != DenseDFA.DEAD:
+                    dot_str += f'    S{state} -> S{target} [ label="{",".join(chars)}" ];\n'
+        dot_str += '}\n'
+
+        return dot_str
+
+
+def bool_array(results: list[bool]) -> "numpy.ndarray | list[bool]":
+    """results as a boolean NumPy array like DenseDFA.match_many returns it, the list itself if NumPy is not installed."""
+    return numpy.asarray(results, dtype=bool) if numpy is not None else results
+
+def _blocks(start: int, end: int, reverse: bool) -> Iterator[tuple[int, int]]:
+    size = DenseDFA.MIN_BLOCK_SIZE
+    while start < end:
+        if reverse:
+            yield max(start, end - size), end
+            end -= size
+        else:
+            yield start, min(start + size, end)
+            start += size
+        size = min(size * 2, DenseDFA.MAX_BLOCK_SIZE)
+
+def compile(pattern: str, minimize: bool = True, stats: CompileStats | None = None, budget: Budget | None = None, ast: ASTNode | None = None) -> DenseDFA:
+    dfa = dfa_compile(pattern, minimize, stats, budget, ast)
+    with stage(stats, 'dense'):
+        dense = DenseDFA.from_dfa(dfa)
+    if stats is not None:
+        stats.record_dense(dense)
+    return dense
+
+if __name__ == '__main__':
+    import sys
+
+    def parse(pattern: str) -> DenseDFA:
+        return compile(pattern)
+
+    def match(compiled: DenseDFA, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: DenseDFA) -> None:
+        dfa = dfa_compile(pattern)
+        dict_size = sum(sys.getsizeof(state.transitions) for state in dfa.get_all_states())
+        dense_size = sys.getsizeof(compiled.table) + sys.getsizeof(compiled.classes.intervals) + sys.getsizeof(compiled.accepting)
+        print(f"{compiled.n_states} states x {compiled.n_classes} classes, {dense_size} bytes (dict transitions: {dict_size} bytes)")
+
+    test_regex(parse, match, log)
+
+    # Binary input is matched without decoding it first
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+    test_regex(parse, lambda compiled, string: compiled.match(memoryview(bytearray(string, 'latin-1'))), lambda pattern, compiled: None)
+
+    import mmap
+    import tempfile
+    with tempfile.TemporaryFile() as file:
+        file.write(b'ab' * 100_000 + b'c')
+        file.flush()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            assert compile('(ab)*c').match(mapped)
+            assert not compile('(ab)*').match(mapped)
+    print("Test passed for memory mapped input.")
+
+    strings = [string for case in REGEX_TEST_CASES for string in case["matching"] + case["not_matching"]]
+    strings += [string.encode('latin-1') for string in strings] + ['\u00e9\U0001F600', '']
+    for case in REGEX_TEST_CASES:
+        compiled = compile(case["pattern"])
+        assert list(compiled.match_many(strings)) == [compiled.match(string) for string in strings]
+    print(f"Test passed for matching {len(strings)} strings at once{'' if numpy is not None else ' (without NumPy)'}.")
+
+    # Building the byte table leaves the memo empty, and text outside Latin-1 only fills it up to its cap
+    compiled = compile('[a-zЀ-ӿ]+')
+    assert len(compiled.classes) == 0
+    assert compiled.byte_classes == [compiled.classes[byte] for byte in range(256)]
+    assert list(compiled.translate('aЀ!')) == list(compiled.translate(memoryview('aЀ!'.encode('utf-8')))[:1]) + [compiled.classes[0x400], 0]
+    assert compiled.match(''.join(chr(codepoint) for codepoint in range(0x400, 0x500)) * 8)
+    assert len(compiled.classes) <= ClassMap.MEMO_SIZE
+    print("Test passed for the class map memo.")
@@ -0,0 +1,499 @@
+import time
+from bisect import bisect_right
+from itertools import count
+from src.ast import ASTNode, AlternationNode, ConcatenationNode, LiteralNode, RangeNode, ClassNode, ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode, SpecificQuantifierNode, GroupNode, EscapedCharacterNode
+from src.charset import DIGIT, SPACE, WILDCARD, WORD, Interval, Text, as_symbols, codepoint, normalize, split_disjoint
+from src.dfa import Budget, BudgetExceeded, DFAState, minimize_dfa
+from src.optimize import parse_pattern
+from src.stats import CompileStats, estimate_dfa_state_bytes, stage
+from src.test import test_regex
+
+
+EMPTY, EPSILON, CHARS, CONCAT, UNION, STAR = range(6)
+
+# Ids are never reused, so terms of different tables (e.g. before and after a flush of the lazy DFA) never get mixed up
+_ids = count()
+
+
+class Term:
+    """
+    A regular expression in canonical form. Terms are interned by `Terms`, so equal terms are the same object
+    and can be compared and hashed by identity.
+
+    `intervals` are the sorted, disjoint code points of a CHARS term, `children` the subterms of the others:
+    CONCAT has two (concatenations nest to the right), UNION at least two sorted by id, STAR one.
+    """
+    __slots__ = ('kind', 'id', 'intervals', 'starts', 'children', 'nullable', 'derivatives', '_first')
+
+    def __init__(self, kind: int, intervals: tuple[Interval, ...] = (), children: tuple["Term", ...] = ()) -> None:
+        self.kind = kind
+        self.id = next(_ids)
+        self.intervals = intervals
+        self.starts = [start for start, _ in intervals]  # For bisection
+        self.children = children
+        if kind == CONCAT:
+            self.nullable = children[0].nullable and children[1].nullable
+        elif kind == UNION:
+            self.nullable = any(child.nullable for child in children)
+        else:
+            self.nullable = kind in (EPSILON, STAR)
+        # Memoized derivatives by code point, entries are only ever added
+        self.derivatives: dict[int, Term] = {}
+        self._first: tuple[Term, ...] | None = None
+
+    def contains(self, value: int) -> bool:
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.intervals[i][1]
+
+    @property
+    def first(self) -> tuple["Term", ...]:
+        """The CHARS terms the first character of a match is read by, the derivative only depends on which of them contain it."""
+        # Computed bottom-up with an explicit stack, long concatenations nest far deeper than the recursion limit
+        stack = [self]
+        while stack:
+            term = stack[-1]
+            if term._first is not None:
+                stack.pop()
+                continue
+            children = term.children if term.kind != CONCAT or term.children[0].nullable else term.children[:1]
+            pending = [child for child in children if child._first is None]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            if term.kind == CHARS:
+                term._first = (term,)
+            elif term.kind == CONCAT:
+                head, tail = term.children
+                term._first = head._first + tail._first if head.nullable else head._first
+            elif term.kind in (UNION, STAR):
+                term._first = tuple({chars.id: chars for child in term.children for chars in child._first}.values())
+            else:
+                term._first = ()
+        return self._first
+
+    def __repr__(self) -> str:
+        if self.kind == EMPTY:
+            return '∅'
+        elif self.kind == EPSILON:
+            return 'ε'
+        elif self.kind == CHARS:
+            return '[' + ''.join(chr(start) if start == end else f"{chr(start)}-{chr(end)}" for start, end in self.intervals) + ']'
+        elif self.kind == CONCAT:
+            return ''.join(map(repr, self.children))
+        elif self.kind == UNION:
+            return '(' + '|'.join(map(repr, self.children)) + ')'
+        return f"({repr(self.children[0])})*"
+
+
+# Shared by all tables, the derivative of both is empty
+EMPTY_TERM = Term(EMPTY)
+EPSILON_TERM = Term(EPSILON)
+
+
+class Terms:
+    """
+    Hash-consing table for terms. The smart constructors bring every term into a canonical form
+    (unions are flattened, deduplicated and sorted, their character classes merged, empty and epsilon terms absorbed),
+    so derivatives that denote the same expression end up as the same term and thereby the same DFA state.
+    """
+
+    def __init__(self) -> None:
+        self.__table: dict[tuple, Term] = {}
+
+    def __len__(self) -> int:
+        return len(self.__table)
+
+    def values(self) -> list[Term]:
+        return list(self.__table.values())
+
+    def __intern(self, kind: int, intervals: tuple[Interval, ...] = (), children: tuple[Term, ...] = ()) -> Term:
+        key = (kind, intervals, tuple(child.id for child in children))
+        term = self.__table.get(key)
+        if term is None:
+            term = Term(kind, intervals, children)
+            self.__table[key] = term
+        return term
+
+    def chars(self, intervals: tuple[Interval, ...]) -> Term:
+        intervals = normalize(intervals)
+        return self.__intern(CHARS, intervals) if intervals else EMPTY_TERM
+
+    def concat(self, head: Term, tail: Term) -> Term:
+        if head is EMPTY_TERM or tail is EMPTY_TERM:
+            return EMPTY_TERM
+        # Concatenations nest to the right: the factors of head are prepended to tail one by one, starting with the last
+        factors = []
+        while head.kind == CONCAT:
+            factors.append(head.children[0])
+            head = head.children[1]
+        factors.append(head)
+        for factor in reversed(factors):
+            if factor is not EPSILON_TERM:
+                tail = factor if tail is EPSILON_TERM else self.__intern(CONCAT, children=(factor, tail))
+        return tail
+
+    def union(self, terms: list[Term]) -> Term:
+        members: dict[int, Term] = {}
+        intervals: list[Interval] = []
+        for term in terms:
+            for member in term.children if term.kind == UNION else (term,):
+                if member.kind == CHARS:
+                    intervals.extend(member.intervals)
+                elif member is not EMPTY_TERM:
+                    members[member.id] = member
+        if intervals:
+            chars = self.chars(tuple(intervals))
+            members[chars.id] = chars
+        if EPSILON_TERM.id in members and any(member.nullable for member in members.values() if member is not EPSILON_TERM):
+            del members[EPSILON_TERM.id]
+
+        if not members:
+            return EMPTY_TERM
+        elif len(members) == 1:
+            return next(iter(members.values()))
+        return self.__intern(UNION, children=tuple(members[id] for id in sorted(members)))
+
+    def star(self, term: Term) -> Term:
+        if term is EMPTY_TERM or term is EPSILON_TERM:
+            return EPSILON_TERM
+        elif term.kind == STAR:
+            return term
+        return self.__intern(STAR, children=(term,))
+
+    def optional(self, term: Term) -> Term:
+        return self.union([EPSILON_TERM, term])
+
+    def copy(self, term: Term) -> Term:
+        """The same expression as term (which may belong to another table), interned in this table."""
+        copies: dict[int, Term] = {EMPTY_TERM.id: EMPTY_TERM, EPSILON_TERM.id: EPSILON_TERM}
+        reachable: dict[int, Term] = {}
+        stack = [term]
+        while stack:
+            subterm = stack.pop()
+            if subterm.id not in reachable and subterm.id not in copies:
+                reachable[subterm.id] = subterm
+                stack.extend(subterm.children)
+
+        # Children have smaller ids than their parents, so copying by increasing id never needs recursion
+        for id in sorted(reachable):
+            subterm = reachable[id]
+            if subterm.kind == CHARS:
+                copies[id] = self.chars(subterm.intervals)
+            elif subterm.kind == CONCAT:
+                copies[id] = self.concat(copies[subterm.children[0].id], copies[subterm.children[1].id])
+            elif subterm.kind == UNION:
+                copies[id] = self.union([copies[child.id] for child in subterm.children])
+            else:
+                copies[id] = self.star(copies[subterm.children[0].id])
+        return copies[term.id]
+
+    @staticmethod
+    def __known_derivative(term: Term, value: int) -> Term | None:
+        if term.kind == CHARS:
+            return EPSILON_TERM if term.contains(value) else EMPTY_TERM
+        elif term.kind in (EMPTY, EPSILON):
+            return EMPTY_TERM
+        return term.derivatives.get(value)
+
+    def derivative(self, term: Term, value: int) -> Term:
+        """The term matching the rest of every string term matches that starts with the code point value."""
+        # The derivatives of the subterms are memoized first, bottom-up with an explicit stack instead of recursion
+        stack = [term]
+        while stack:
+            subterm = stack[-1]
+            if self.__known_derivative(subterm, value) is not None:
+                stack.pop()
+                continue
+            children = subterm.children if subterm.kind != CONCAT or subterm.children[0].nullable else subterm.children[:1]
+            pending = [child for child in children if self.__known_derivative(child, value) is None]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+
+            if subterm.kind == CONCAT:
+                head, tail = subterm.children
+                derivative = self.concat(self.__known_derivative(head, value), tail)
+                if head.nullable:
+                    derivative = self.union([derivative, self.__known_derivative(tail, value)])
+            elif subterm.kind == UNION:
+                derivative = self.union([self.__known_derivative(child, value) for child in subterm.children])
+            else:
+                derivative = self.concat(self.__known_derivative(subterm.children[0], value), subterm)
+            subterm.derivatives[value] = derivative
+        return self.__known_derivative(term, value)
+
+    def classes(self, term: Term) -> list[Interval]:
+        """
+        Sorted, disjoint intervals such that the derivative of term is the same for all code points of an interval.
+        The derivative for code points outside of all of them is empty.
+        """
+        return [(start, end) for start, end, _ in split_disjoint((start, end, chars.id) for chars in term.first for start, end in chars.intervals)]
+
+
+def __intervals(node: ASTNode) -> tuple[Interval, ...] | None:
+    """The code points of a node that reads exactly one character, None for every other node."""
+    def range_intervals(range_node: RangeNode) -> tuple[Interval, ...]:
+        return WILDCARD if range_node.is_wildcard else ((ord(range_node.start), ord(range_node.end)),)
+
+    if isinstance(node, LiteralNode):
+        return ((ord(node.value), ord(node.value)),)
+    elif isinstance(node, RangeNode):
+        return range_intervals(node)
+    elif isinstance(node, ClassNode):
+        return tuple(interval for range_node in node.ranges for interval in range_intervals(range_node))
+    elif isinstance(node, EscapedCharacterNode):
+        shorthands = {'d': DIGIT, 'w': WORD, 's': SPACE}
+        return shorthands.get(node.value, ((ord(node.value), ord(node.value)),))
+    return None
+
+def ast_to_term(node: ASTNode, terms: Terms) -> Term:
+    intervals = __intervals(node)
+    if intervals is not None:
+        return terms.chars(intervals)
+    elif isinstance(node, GroupNode):
+        return ast_to_term(node.node, terms)
+    elif isinstance(node, ConcatenationNode):
+        term = EPSILON_TERM
+        for subnode in reversed(node.nodes):
+            term = terms.concat(ast_to_term(subnode, terms), term)
+        return term
+    elif isinstance(node, AlternationNode):
+        return terms.union([ast_to_term(subnode, terms) for subnode in node.nodes])
+    elif isinstance(node, ZeroOrMoreNode):
+        return terms.star(ast_to_term(node.node, terms))
+    elif isinstance(node, OneOrMoreNode):
+        body = ast_to_term(node.node, terms)
+        return terms.concat(body, terms.star(body))
+    elif isinstance(node, ZeroOrOneNode):
+        return terms.optional(ast_to_term(node.node, terms))
+    elif isinstance(node, SpecificQuantifierNode):
+        # x{2,4} is xx(x(x)?)?, x{2,} is xxx*, the body is converted once and shared by all copies
+        body = ast_to_term(node.node, terms)
+        term = terms.star(body) if node.max is None else EPSILON_TERM
+        for _ in range(0 if node.max is None else node.max - node.min):
+            term = terms.optional(terms.concat(body, term))
+        for _ in range(node.min):
+            term = terms.concat(body, term)
+        return term
+    else:
+        raise Exception(f"Unknown node type: {node}")
+
+def derivatives_to_dfa(terms: Terms, start: Term, budget: Budget | None = None) -> DFAState:
+    """
+    Builds the DFA whose states are the derivatives of start, without an NFA and without subset construction.
+    The states are keyed by the ids of their terms, the empty term is the implicit dead state.
+    """
+    if budget is None:
+        budget = Budget()
+    max_states, max_bytes = budget.max_states, budget.max_bytes
+    deadline = time.perf_counter() + budget.max_seconds if budget.max_seconds is not None else None
+    n_bytes = 0
+    start_dfa_state = DFAState(frozenset((start.id,)), start.nullable)
+    dfa_states = {start.id: start_dfa_state}
+    unmarked = [(start, start_dfa_state)]
+
+    while unmarked:
+        if deadline is not None and time.perf_counter() > deadline:
+            raise BudgetExceeded(f"Derivative construction exceeded the budget of {budget.max_seconds} seconds after {len(dfa_states)} DFA states")
+        term, dfa_state = unmarked.pop()
+
+        transitions: list[tuple[int, int, DFAState]] = []
+        for start_point, end_point in terms.classes(term):
+            next_term = terms.derivative(term, start_point)
+            if next_term is EMPTY_TERM:
+                continue
+            next_dfa_state = dfa_states.get(next_term.id)
+            if next_dfa_state is None:
+                next_dfa_state = DFAState(frozenset((next_term.id,)), next_term.nullable)
+                dfa_states[next_term.id] = next_dfa_state
+                unmarked.append((next_term, next_dfa_state))
+                if max_states is not None and len(dfa_states) > max_states:
+                    raise BudgetExceeded(f"The DFA exceeds the budget of {max_states} states")
+            if transitions and transitions[-1][1] == start_point - 1 and transitions[-1][2] is next_dfa_state:
+                transitions[-1] = (transitions[-1][0], end_point, next_dfa_state)
+            else:
+                transitions.append((start_point, end_point, next_dfa_state))
+
+        for start_point, end_point, next_dfa_state in transitions:
+            dfa_state._add_transition(start_point, end_point, next_dfa_state)
+        if max_bytes is not None:
+            n_bytes += estimate_dfa_state_bytes(dfa_state)
+            if n_bytes > max_bytes:
+                raise BudgetExceeded(f"The DFA exceeds the budget of {max_bytes} bytes after {len(dfa_states)} states")
+
+    return start_dfa_state
+
+
+class LazyDerivativeDFA:
+    """
+    A DFA whose states are derivatives of the pattern, computed the first time a character is read in a state.
+
+    The interned terms and the transitions taken between them are kept in a cache of about `max_cache_size` entries.
+    A step that finds the cache full flushes it first and continues from a copy of the current term,
+    so memory stays bounded like for the lazy DFA over the NFA.
+    The transitions are kept in a table owned by the DFA, keyed by term id. A flush swaps in a new table and new terms
+    and never changes the old ones, so other threads can keep stepping through them.
+    """
+
+    def __init__(self, term: Term, max_cache_size: int = 100_000) -> None:
+        if max_cache_size < 4:
+            raise Exception("The lazy DFA cache must hold at least four entries")
+        self.max_cache_size = max_cache_size
+        self.flushes = 0
+        self.__term = term
+        self.__terms = Terms()
+        # Transitions by term id, then by character (or byte)
+        self.__table: dict[int, dict[str | int, Term]] = {}
+        self.__transitions = 0
+        self.start = self.__terms.copy(term)
+
+    @property
+    def cache_size(self) -> int:
+        return len(self.__terms) + self.__transitions
+
+    def __flush(self) -> Terms:
+        # The old terms and transitions are left to the garbage collector
+        self.flushes += 1
+        terms = Terms()
+        self.start = terms.copy(self.__term)
+        self.__terms, self.__table, self.__transitions = terms, {}, 0
+        return terms
+
+    def _step(self, term: Term, symbol: str | int) -> Term:
+        terms = self.__terms
+        if self.cache_size >= self.max_cache_size:
+            terms = self.__flush()
+            term = terms.copy(term)
+
+        next_term = terms.derivative(term, codepoint(symbol))
+        self.__table.setdefault(term.id, {})[symbol] = next_term
+        self.__transitions += 1
+        return next_term
+
+    def match(self, string: Text) -> bool:
+        table = self.__table
+        term = self.start
+
+        for symbol in as_symbols(string):
+            transitions = table.get(term.id)
+            next_term = transitions.get(symbol) if transitions is not None else None
+            if next_term is None:
+                next_term = self._step(term, symbol)
+                table = self.__table
+            if next_term is EMPTY_TERM:
+                return False
+            term = next_term
+
+        return term.nullable
+
+    def __repr__(self) -> str:
+        return f"LazyDerivativeDFA({repr(self.__term)})"
+
+
+def __pattern_term(pattern: str, stats: CompileStats | None, ast: ASTNode | None) -> tuple[Terms, Term]:
+    ast = parse_pattern(pattern, stats) if ast is None else ast
+    terms = Terms()
+    with stage(stats, 'derivative'):
+        term = ast_to_term(ast, terms)
+    return terms, term
+
+def compile(pattern: str, minimize: bool = True, stats: CompileStats | None = None, budget: Budget | None = None, ast: ASTNode | None = None) -> DFAState:
+    terms, term = __pattern_term(pattern, stats, ast)
+    with stage(stats, 'derivative'):
+        dfa = derivatives_to_dfa(terms, term, budget)
+    if stats is not None:
+        stats.record_terms(terms)
+        stats.record_dfa('dfa', dfa)
+    if not minimize:
+        return dfa
+
+    with stage(stats, 'minimize'):
+        minimized = minimize_dfa(dfa)
+    if stats is not None:
+        stats.record_dfa('minimized', minimized)
+    return minimized
+
+def compile_lazy(pattern: str, max_cache_size: int = 100_000, stats: CompileStats | None = None, ast: ASTNode | None = None) -> LazyDerivativeDFA:
+    terms, term = __pattern_term(pattern, stats, ast)
+    if stats is not None:
+        stats.record_terms(terms)
+    return LazyDerivativeDFA(term, max_cache_size)
+
+if __name__ == '__main__':
+    import itertools
+    import random
+    import re
+    from src.dfa import compile as dfa_compile
+
+    def parse(pattern: str) -> DFAState:
+        return compile(pattern)
+
+    def match(compiled: DFAState, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: DFAState) -> None:
+        unminimized = compile(pattern, minimize=False)
+        print(f"Derivatives built {len(unminimized.get_all_states())} states, minimized to {len(compiled.get_all_states())} states")
+
+    test_regex(parse, match, log)
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+    test_regex(lambda pattern: compile(pattern, minimize=False), match, lambda pattern, compiled: None)
+    test_regex(compile_lazy, lambda compiled, string: compiled.match(string), lambda pattern, compiled: None)
+    test_regex(compile_lazy, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+    # A tiny cache is flushed all the time but still matches correctly
+    test_regex(lambda pattern: compile_lazy(pattern, max_cache_size=4), lambda compiled, string: compiled.match(string), lambda pattern, compiled: None)
+
+    # Canonical forms: equal expressions are the same term
+    terms = Terms()
+    a, b = terms.chars(((97, 97),)), terms.chars(((98, 98),))
+    assert terms.union([a, b]) is terms.chars(((97, 98),)) and terms.union([terms.star(a), EPSILON_TERM, terms.star(a)]) is terms.star(a)
+    assert terms.concat(terms.concat(a, b), a) is terms.concat(a, terms.concat(b, a)) and terms.star(terms.star(a)) is terms.star(a)
+    assert terms.copy(terms.concat(a, b)) is terms.concat(a, b) and Terms().copy(terms.concat(a, b)) is not terms.concat(a, b)
+    print("Test passed for canonical terms.")
+
+    # Against the stdlib, and the derivative DFAs are never much larger than the minimal ones
+    for pattern in ['(a|ab)(c|bcd)?d*', '((a|b)*|c)+d', 'a{0,0}b|ab', '(ab?){2,3}c', '(a|b)*a(a|b){3}', '(a?){3}a{3}', '[a-c]{2,}d?', '(abc|bcd|cde|.d)+']:
+        compiled, lazy = compile(pattern, minimize=False), compile_lazy(pattern)
+        n_states, n_minimal = len(compiled.get_all_states()), len(dfa_compile(pattern).get_all_states())
+        assert n_minimal <= n_states <= 2 * n_minimal, f"{n_states} derivative states for '{pattern}', the minimal DFA has {n_minimal}"
+        for length in range(7):
+            for string in map(''.join, itertools.product('abcd', repeat=length)):
+                expected = re.fullmatch(pattern, string) is not None
+                assert compiled.match(string) == lazy.match(string) == expected, f"Test failed for '{pattern}' and '{string}'"
+    print("Test passed for patterns against the stdlib.")
+
+    # The full DFA of this pattern has 2^21 states, the lazy one only builds what the input visits
+    lazy = compile_lazy('(a|b)*a(a|b){20,20}', max_cache_size=1000)
+    rng = random.Random(0)
+    string = ''.join(rng.choice('ab') for _ in range(20000)) + 'a' * 21
+    assert lazy.match(string) and not lazy.match(string + 'b' * 21)
+    assert lazy.flushes > 0
+    print(f"Matched exponential pattern lazily with {lazy.flushes} cache flushes.")
+
+    for budget in [Budget(max_states=1000), Budget(max_bytes=100_000), Budget(max_seconds=0.0)]:
+        try:
+            compile('(a|b)*a(a|b){12,12}', budget=budget)
+            assert False, f"Expected {budget} to be exceeded"
+        except BudgetExceeded as error:
+            print(f"Test passed for {budget}: {error}")
+
+    # Terms of long concatenations nest thousands of levels deep, they are walked without recursion
+    assert compile('x*' * 1500 + 'y').match('xxy') and not compile('x*' * 1500 + 'y').match('xxz')
+    assert compile_lazy('x?' * 1500 + 'y').match('xxy') and not compile_lazy('x?' * 1500 + 'y').match('xxz')
+    assert compile('a' * 3000).match('a' * 3000) and not compile('a' * 3000).match('a' * 2999)
+    assert compile_lazy('a' * 3000).match(b'a' * 3000) and not compile_lazy('a' * 3000).match('a' * 3001)
+    # Every step of a tiny cache copies the current term into a new table
+    assert not compile_lazy('a' * 3000, max_cache_size=4).match('aab')
+    print("Test passed for long concatenations.")
+
+    # Threads keep matching through terms of a flushed cache, and the shared terms are never written to
+    from concurrent.futures import ThreadPoolExecutor
+    lazy = compile_lazy('(a|b)*a(a|b){6,6}', max_cache_size=16)
+    strings = [''.join('ab'[(i >> bit) & 1] for bit in range(12)) for i in range(4096)]
+    with ThreadPoolExecutor(8) as executor:
+        for _ in range(3):
+            assert list(executor.map(lazy.match, strings)) == [string[-7] == 'a' for string in strings]
+    assert lazy.flushes > 0 and not EMPTY_TERM.derivatives and not EPSILON_TERM.derivatives
+    print(f"Test passed for concurrent matches with {lazy.flushes} cache flushes.")
@@ -1,40 +1,81 @@
-from src.nfa import NFAState, ast_to_nfa
-from src.ast import ASTParser
+import time
+from bisect import bisect_left, bisect_right
+from typing import Callable, Hashable, NamedTuple
+from src.charset import Interval, Text, as_symbols, codepoint, format_interval, split_disjoint
+from src.nfa import NFA, ast_to_nfa
+from src.ast import ASTNode
+from src.optimize import parse_pattern
+from src.stats import CompileStats, estimate_dfa_state_bytes, stage
 from src.test import test_regex
 
 
+class Budget(NamedTuple):
+    """
+    Limits for subset construction, which can create exponentially many states.
+    `max_states` bounds the number of DFA states, `max_bytes` their estimated memory and `max_seconds` the time spent.
+    None means no limit.
+    """
+    max_states: int | None = None
+    max_bytes: int | None = None
+    max_seconds: float | None = None
+
+
+class BudgetExceeded(Exception):
+    """Raised by `nfa_to_dfa` as soon as the DFA outgrows its budget."""
+
+
 class DFAState:
-    def __init__(self, nfa_states: set[NFAState] | frozenset[NFAState]) -> None:
-        self.nfa_states = frozenset(nfa_states)  # Immutable set for hashing
-        self.transitions: dict[str, DFAState] = {}
-        self.is_final: bool = any(state.is_final for state in nfa_states)
+    def __init__(self, nfa_states: frozenset[int], is_final: bool = False, id: int | None = None) -> None:
+        self.nfa_states = nfa_states  # Ids of the NFA states, frozensets cache their hash
+        # Set by the minimizer to tell merged states apart, their unions of NFA states can be equal
+        self.id = id
+        # Disjoint code point intervals, additionally kept as sorted lists for bisection
+        self.transitions: dict[Interval, DFAState] = {}
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self.targets: list[DFAState] = []
+        # Memoizes the bisection for characters (or bytes) that were already looked up while matching
+        self.__memo: dict[str | int, DFAState] = {}
+        self.is_final = is_final
+
+    def _add_transition(self, start: int, end: int, state: "DFAState") -> None:
+        self.transitions[(start, end)] = state
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.targets.insert(i, state)
+        self.__memo.clear()
 
-    def _add_transition(self, char: str, state: "DFAState") -> None:
-        self.transitions[char] = state
+    def next_state(self, codepoint: int) -> "DFAState | None":
+        i = bisect_right(self.starts, codepoint) - 1
+        if i >= 0 and codepoint <= self.ends[i]:
+            return self.targets[i]
+        return None
 
-    def match(self, string: str) -> bool:
+    def match(self, string: Text) -> bool:
         current_state = self
 
-        for char in string:
-            if char in current_state.transitions:
-                current_state = current_state.transitions[char]
-            else:
-                # If there is no transition for this character, the string does not match
-                return False
+        for symbol in as_symbols(string):
+            next_state = current_state.__memo.get(symbol)
+            if next_state is None:
+                next_state = current_state.next_state(codepoint(symbol))
+                if next_state is None:
+                    # If there is no transition for this character, the string does not match
+                    return False
+                current_state.__memo[symbol] = next_state
+            current_state = next_state
 
         # After processing all characters, check if we are in a final state
         return current_state.is_final
     
     def get_all_states(self) -> set["DFAState"]:
-        visited = set()
-
-        def visit(state: DFAState) -> None:
-            if state not in visited:
-                visited.add(state)
-                for next_state in state.transitions.values():
-                    visit(next_state)
-
-        visit(self)
+        visited = {self}
+        stack = [self]
+        while stack:
+            for next_state in stack.pop().transitions.values():
+                if next_state not in visited:
+                    visited.add(next_state)
+                    stack.append(next_state)
         return visited
         
     def to_dot(self) -> str:
@@ -51,74 +92,221 @@ class DFAState:
         dot_str += f'    start -> S{hash(self)};\n'
         
         for state in all_states:
-            for char, next_state in state.transitions.items():
-                dot_str += f'    S{hash(state)} -> S{hash(next_state)} [ label="{char}" ];\n'
+            for interval, next_state in state.transitions.items():
+                dot_str += f'    S{hash(state)} -> S{hash(next_state)} [ label="{format_interval(interval)}" ];\n'
         
         dot_str += '}\n'
         
         return dot_str
 
     def __hash__(self) -> int:
-        h = hash(tuple(sorted(id(state) for state in self.nfa_states)))
-        return h if h >= 0 else -h
+        return hash((self.id, self.nfa_states))
 
     def __eq__(self, other: "DFAState") -> bool:
-        return self.nfa_states == other.nfa_states
+        return self.id == other.id and self.nfa_states == other.nfa_states
 
 
-def __epsilon_closure(nfa_state: NFAState, visited: set[NFAState] | None = None) -> set[NFAState]:
-    if visited is None:
-        visited = set()
+def nfa_to_dfa(nfa: NFA, stats: CompileStats | None = None, budget: Budget | None = None) -> DFAState:
+    is_final, nfa_transitions = nfa.is_final, nfa.transitions
+    if budget is None:
+        budget = Budget()
+    max_states, max_bytes = budget.max_states, budget.max_bytes
+    deadline = time.perf_counter() + budget.max_seconds if budget.max_seconds is not None else None
+    n_bytes = 0
+    start_nfa_states = nfa.epsilon_closures()[0]
+    start_dfa_state = DFAState(start_nfa_states, any(is_final[state] for state in start_nfa_states))
+    unmarked_states = [start_dfa_state]
 
-    closure = {nfa_state}
+    dfa_state_mapping = {start_nfa_states: start_dfa_state}
+    # The same set of target states is usually reached from many DFA states
+    closure_of_targets: dict[frozenset[int], frozenset[int]] = {}
+    closure_lookups = 0
 
-    if nfa_state in visited:
-        return closure
+    while unmarked_states:
+        if deadline is not None and time.perf_counter() > deadline:
+            raise BudgetExceeded(f"Subset construction exceeded the budget of {budget.max_seconds} seconds after {len(dfa_state_mapping)} DFA states")
+        current_dfa_state = unmarked_states.pop()
 
-    visited.add(nfa_state)
-    closure.update(__epsilon_closure_set(nfa_state.epsilon_transitions, visited))
+        # Split the (possibly overlapping) intervals of all NFA states into disjoint intervals with their target states
+        edges = (edge for nfa_state in current_dfa_state.nfa_states for edge in nfa_transitions[nfa_state])
+        new_transitions: list[tuple[int, int, DFAState]] = []
+        for start, end, next_nfa_states in split_disjoint(edges):
+            frozen_next_nfa_states_closure = closure_of_targets.get(next_nfa_states)
+            closure_lookups += 1
+            if frozen_next_nfa_states_closure is None:
+                frozen_next_nfa_states_closure = nfa.epsilon_closure(next_nfa_states)
+                closure_of_targets[next_nfa_states] = frozen_next_nfa_states_closure
 
-    return closure
+            if frozen_next_nfa_states_closure in dfa_state_mapping:
+                # Reuse existing DFA state
+                next_dfa_state = dfa_state_mapping[frozen_next_nfa_states_closure]
+            else:
+                # Create new DFA state
+                next_dfa_state = DFAState(frozen_next_nfa_states_closure, any(is_final[state] for state in frozen_next_nfa_states_closure))
+                unmarked_states.append(next_dfa_state)
+                dfa_state_mapping[frozen_next_nfa_states_closure] = next_dfa_state
+                if max_states is not None and len(dfa_state_mapping) > max_states:
+                    raise BudgetExceeded(f"The DFA exceeds the budget of {max_states} states")
 
-def __epsilon_closure_set(nfa_states: set[NFAState], visited: set[NFAState]) -> set[NFAState]:
-    closure = set()
-    for nfa_state in nfa_states:
-        closure.update(__epsilon_closure(nfa_state, visited))
-    return closure
+            new_transitions.append((start, end, next_dfa_state))
 
-def nfa_to_dfa(start_nfa_state: NFAState) -> DFAState:
-    start_dfa_state = DFAState(__epsilon_closure(start_nfa_state))
-    unmarked_states = [start_dfa_state]
+        for start, end, next_dfa_state in __merge_adjacent(new_transitions):
+            current_dfa_state._add_transition(start, end, next_dfa_state)
+        if max_bytes is not None:
+            n_bytes += estimate_dfa_state_bytes(current_dfa_state)
+            if n_bytes > max_bytes:
+                raise BudgetExceeded(f"The DFA exceeds the budget of {max_bytes} bytes after {len(dfa_state_mapping)} states")
 
-    dfa_state_mapping = {frozenset(__epsilon_closure(start_nfa_state)): start_dfa_state}
+    if stats is not None:
+        # Every lookup needs the epsilon closure of a set of target states, only the first one for a set computes it
+        stats.counts["epsilon_closure_lookups"] = closure_lookups
+        stats.counts["epsilon_closure_unions"] = len(closure_of_targets)
+    return start_dfa_state
 
-    while unmarked_states:
-        current_dfa_state = unmarked_states.pop()
+def __merge_adjacent(transitions: list[tuple[int, int, DFAState]]) -> list[tuple[int, int, DFAState]]:
+    merged: list[tuple[int, int, DFAState]] = []
+    for start, end, state in sorted(transitions, key=lambda transition: transition[0]):
+        if merged and merged[-1][1] == start - 1 and merged[-1][2] is state:
+            merged[-1] = (merged[-1][0], end, state)
+        else:
+            merged.append((start, end, state))
+    return merged
+
+def alphabet_classes(states: list[DFAState]) -> list[list[Interval]]:
+    """
+    Partitions all code points that have a transition in any of the states into equivalence classes.
+    All code points of a class lead to the same target in every state, so each class can be treated as a single symbol.
+    """
+    points = sorted({point for state in states for start, end in state.transitions for point in (start, end + 1)})
 
-        for char in set().union(*(state.transitions for state in current_dfa_state.nfa_states)):
-            if char:
-                next_nfa_states: set[NFAState] = set()
-                for nfa_state in current_dfa_state.nfa_states:
-                    next_nfa_states.update(nfa_state.transitions[char])
+    columns: dict[tuple[int, ...], list[Interval]] = {}
+    for start, next_point in zip(points, points[1:]):
+        column = tuple(id(state.next_state(start)) for state in states)
+        columns.setdefault(column, []).append((start, next_point - 1))
 
-                next_nfa_states_closure = __epsilon_closure_set(next_nfa_states, set())
-                frozen_next_nfa_states_closure = frozenset(next_nfa_states_closure)
+    no_transitions = tuple(id(None) for _ in states)
+    return [intervals for column, intervals in columns.items() if column != no_transitions]
 
-                if frozen_next_nfa_states_closure in dfa_state_mapping:
-                    # Reuse existing DFA state
-                    next_dfa_state = dfa_state_mapping[frozen_next_nfa_states_closure]
+def __reachable_states(start_dfa_state: DFAState) -> list[DFAState]:
+    # Breadth first, so that the order of the states is deterministic
+    states = [start_dfa_state]
+    seen = {start_dfa_state}
+    for state in states:
+        for next_state in state.transitions.values():
+            if next_state not in seen:
+                seen.add(next_state)
+                states.append(next_state)
+    return states
+
+def minimize_dfa(start_dfa_state: DFAState, key: Callable[[DFAState], Hashable] | None = None) -> DFAState:
+    """
+    Merges equivalent states using Hopcroft's partition refinement.
+    States that can never reach a final state are dropped, a missing transition already rejects the input.
+
+    By default states are distinguished by whether they are final, `key` can distinguish them further
+    (e.g. by which of several patterns they accept). States with different keys are never merged.
+    """
+    if key is None:
+        key = lambda state: state.is_final
+
+    states = __reachable_states(start_dfa_state)
+    index = {state: i for i, state in enumerate(states)}
+    dead = len(states)  # Implicit sink for all missing transitions
+    # Each equivalence class of code points is a single symbol, represented by its first code point
+    alphabet = [intervals[0][0] for intervals in alphabet_classes(states)]
+
+    # inverse[symbol][target] = all states that move to target on symbol
+    inverse: list[dict[int, list[int]]] = [{} for _ in alphabet]
+    for i, state in enumerate(states):
+        for symbol, codepoint in enumerate(alphabet):
+            next_state = state.next_state(codepoint)
+            target = index[next_state] if next_state is not None else dead
+            inverse[symbol].setdefault(target, []).append(i)
+    for symbol in range(len(alphabet)):
+        inverse[symbol].setdefault(dead, []).append(dead)
+
+    initial_blocks: dict[Hashable, set[int]] = {}
+    for i, state in enumerate(states):
+        initial_blocks.setdefault(key(state), set()).add(i)
+    initial_blocks.setdefault(key(DFAState(frozenset())), set()).add(dead)
+    blocks = list(initial_blocks.values())
+    block_of = [0] * (dead + 1)
+    for block_id, block in enumerate(blocks):
+        for i in block:
+            block_of[i] = block_id
+
+    worklist = set(range(len(blocks)))
+    while worklist:
+        splitter = list(blocks[worklist.pop()])
+        for predecessors in inverse:
+            touched: dict[int, set[int]] = {}
+            for target in splitter:
+                for i in predecessors.get(target, ()):
+                    touched.setdefault(block_of[i], set()).add(i)
+
+            for block_id, inside in touched.items():
+                block = blocks[block_id]
+                if len(inside) == len(block):
+                    continue
+
+                # Split the block into the states that move into the splitter and those that don't
+                block -= inside
+                new_block_id = len(blocks)
+                blocks.append(inside)
+                for i in inside:
+                    block_of[i] = new_block_id
+
+                if block_id in worklist:
+                    worklist.add(new_block_id)
                 else:
-                    # Create new DFA state
-                    next_dfa_state = DFAState(next_nfa_states_closure)
-                    unmarked_states.append(next_dfa_state)
-                    dfa_state_mapping[frozen_next_nfa_states_closure] = next_dfa_state
+                    worklist.add(new_block_id if len(inside) <= len(block) else block_id)
 
-                current_dfa_state._add_transition(char, next_dfa_state)
+    dead_block = block_of[dead]
+    if block_of[0] == dead_block:
+        # The pattern can not match anything
+        return DFAState(frozenset())
 
-    return start_dfa_state
+    minimized: dict[int, DFAState] = {}
+    for block_id, block in enumerate(blocks):
+        if block_id != dead_block:
+            representative = states[next(iter(block))]
+            # The unions of the NFA states of two blocks can be equal, the block id keeps the states apart.
+            # The union is kept for callers like `RegexSet`
+            nfa_states = frozenset().union(*(states[i].nfa_states for i in block))
+            minimized[block_id] = DFAState(nfa_states, representative.is_final, block_id)
+
+    for block_id, minimized_state in minimized.items():
+        representative = states[next(iter(blocks[block_id]))]
+        transitions = [
+            (start, end, minimized[block_of[index[next_state]]])
+            for (start, end), next_state in representative.transitions.items()
+            if block_of[index[next_state]] != dead_block
+        ]
+        for start, end, next_state in __merge_adjacent(transitions):
+            minimized_state._add_transition(start, end, next_state)
+
+    return minimized[block_of[0]]
 
-def compile(pattern: str) -> DFAState:
-    return nfa_to_dfa(ast_to_nfa(ASTParser(pattern).parse()))
+def compile(pattern: str, minimize: bool = True, stats: CompileStats | None = None, budget: Budget | None = None, ast: ASTNode | None = None) -> DFAState:
+    # ast is the pattern's AST from `parse_pattern` if the caller already has it
+    ast = parse_pattern(pattern, stats) if ast is None else ast
+    with stage(stats, 'nfa'):
+        nfa = ast_to_nfa(ast)
+    with stage(stats, 'epsilon_closure'):
+        nfa.epsilon_closures()
+    with stage(stats, 'dfa'):
+        dfa = nfa_to_dfa(nfa, stats, budget)
+    if stats is not None:
+        stats.record_nfa(nfa)
+        stats.record_dfa('dfa', dfa)
+    if not minimize:
+        return dfa
+
+    with stage(stats, 'minimize'):
+        minimized = minimize_dfa(dfa)
+    if stats is not None:
+        stats.record_dfa('minimized', minimized)
+    return minimized
 
 if __name__ == '__main__':
     def parse(pattern: str) -> DFAState:
@@ -130,7 +318,38 @@ if __name__ == '__main__':
     def log(pattern: str, compiled: DFAState) -> None:
         # print(f"Pattern '{pattern}' compiled to NFA:\n{compiled}")
         print(compiled.to_dot())
-        pass
+        unminimized = compile(pattern, minimize=False)
+        print(f"Minimized from {len(unminimized.get_all_states())} to {len(compiled.get_all_states())} states")
     
     test_regex(parse, match, log)
-        
\ No newline at end of file
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+    test_regex(lambda pattern: compile(pattern, minimize=False), match, lambda pattern, compiled: None)
+        
+    # The epsilon closures of long optional chains are computed without recursion
+    deep = compile('x?' * 400 + 'y')
+    assert deep.match('x' * 400 + 'y') and not deep.match('x' * 401 + 'y')
+    print("Test passed for a chain of 400 optional characters.")
+
+    # Blocks whose NFA states have the same union still become different states
+    start, final, first, second, third, fourth = (DFAState(frozenset(ids), is_final) for ids, is_final in [
+        ({0}, False), ({9}, True), ({1, 2}, True), ({3}, True), ({1}, False), ({2, 3, 9}, False),
+    ])
+    for character, state in zip('abcd', [first, second, third, fourth]):
+        start._add_transition(ord(character), ord(character), state)
+    for state in [third, fourth]:
+        state._add_transition(ord('e'), ord('e'), final)
+    minimized = minimize_dfa(start)
+    assert len(minimized.get_all_states()) == 3
+    assert sorted(sorted(state.nfa_states) for state in minimized.get_all_states()) == [[0], [1, 2, 3, 9], [1, 2, 3, 9]]
+    assert minimized.match('a') and minimized.match('ce') and not minimized.match('c') and not minimized.match('ae')
+    print("Test passed for minimized states with equal NFA states.")
+
+    # Subset construction stops as soon as the DFA outgrows its budget
+    blowup = '(a|b)*a(a|b){12,12}'
+    for budget in [Budget(max_states=1000), Budget(max_bytes=100_000), Budget(max_seconds=0.0)]:
+        try:
+            compile(blowup, budget=budget)
+            assert False, f"Expected {budget} to be exceeded"
+        except BudgetExceeded as error:
+            print(f"Test passed for {budget}: {error}")
+    assert compile('(a|b)*a(a|b){3,3}', budget=Budget(max_states=100, max_bytes=1 << 20, max_seconds=10.0)).match('bbaabb')
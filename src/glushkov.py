@@ -0,0 +1,227 @@
+from src.ast import ASTNode, AlternationNode, ConcatenationNode, LiteralNode, RangeNode, ClassNode, ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode, SpecificQuantifierNode, GroupNode, EscapedCharacterNode
+from src.charset import DIGIT, SPACE, WILDCARD, WORD, Interval, Text, normalize, split_disjoint
+from src.dense import ClassMap
+from src.dfa import BudgetExceeded
+from src.optimize import parse_pattern
+from src.stats import CompileStats, stage
+from src.test import test_regex
+
+
+# engine='auto' uses the bit-parallel matcher for patterns with at most this many positions
+MAX_POSITIONS = 64
+# compile refuses larger patterns: the follow sets grow quadratically, 1024 positions already take seconds and megabytes
+POSITION_LIMIT = 256
+# Bits of the state looked up at once in the follow tables
+CHUNK_BITS = 8
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+class Glushkov:
+    """
+    The position automaton of a pattern, simulated bit-parallel: no determinization, one state per character of the pattern.
+
+    Every character class of the pattern is a position, bit p of the state is set when position p was the last one read
+    and bit 0 stands for the start. `follow[p]` are the usual Glushkov follow sets as bitmasks, `follow[0]` is the first set
+    and `accept` the last set (with the start if the pattern matches the empty string).
+    A step is `next = follow(state) & masks[class of character]`, where follow(state) is the union of `follow[p]` of the active
+    positions. Most edges go from a position to the next one, those are a single shift; the others are looked up
+    in tables that give the union for `CHUNK_BITS` positions at once.
+    """
+
+    def __init__(self, ast: ASTNode) -> None:
+        positions: list[tuple[Interval, ...]] = [()]
+        follow = [0]
+        nullable, first, last = _linearize(ast, positions, follow)
+        follow[0] = first
+        self.n_positions = len(positions) - 1
+        self.follow = follow
+        self.accept = last | (1 if nullable else 0)
+
+        # Edges p -> p + 1 are done by shifting the whole state
+        self.shift = sum(1 << (p + 1) for p, targets in enumerate(follow) if targets >> (p + 1) & 1)
+        irregular = [targets & ~(1 << (p + 1)) for p, targets in enumerate(follow)]
+        self.chunks: list[tuple[int, list[int]]] = []
+        for offset in range(0, len(follow), CHUNK_BITS):
+            sources = irregular[offset:offset + CHUNK_BITS]
+            if not any(sources):
+                continue
+            table = [0] * (1 << len(sources))
+            for bits in range(1, len(table)):
+                # The union for bits is the one for bits without its lowest bit plus the lowest bit's targets
+                table[bits] = table[bits & (bits - 1)] | sources[(bits & -bits).bit_length() - 1]
+            self.chunks.append((offset, table))
+
+        # Characters that every position treats the same way share a class, class 0 (no position) has the empty mask
+        class_ids: dict[int, int] = {0: 0}
+        class_intervals = []
+        for start, end, labels in split_disjoint((start, end, p) for p, intervals in enumerate(positions) for start, end in intervals):
+            class_intervals.append((start, end, class_ids.setdefault(sum(1 << p for p in labels), len(class_ids))))
+        self.classes = ClassMap(class_intervals)
+        self.masks = list(class_ids)
+        self.byte_masks = [self.masks[class_id] for class_id in self.classes.below(256)]
+
+    def match(self, string: Text) -> bool:
+        if isinstance(string, str):
+            masks = self.masks
+            # Translate the whole string to class ids in C if they fit into bytes
+            ids = string.translate(self.classes).encode('latin-1') if len(masks) <= 256 else [self.classes[ord(char)] for char in string]
+        else:
+            masks, ids = self.byte_masks, memoryview(string).cast('B')
+
+        shift, chunks = self.shift, self.chunks
+        state = 1
+        if not chunks:
+            for class_id in ids:
+                state = ((state << 1) & shift) & masks[class_id]
+                if not state:
+                    return False
+        elif len(chunks) == 1:
+            # The common case, one table covers all edges that are not a shift
+            (offset, table), = chunks
+            for class_id in ids:
+                state = (((state << 1) & shift) | table[(state >> offset) & CHUNK_MASK]) & masks[class_id]
+                if not state:
+                    return False
+        else:
+            for class_id in ids:
+                reach = (state << 1) & shift
+                for offset, table in chunks:
+                    reach |= table[(state >> offset) & CHUNK_MASK]
+                state = reach & masks[class_id]
+                if not state:
+                    return False
+        return state & self.accept != 0
+
+    def __repr__(self) -> str:
+        return f"Glushkov({self.n_positions} positions, {len(self.chunks)} follow tables)"
+
+
+def __intervals(node: ASTNode) -> tuple[Interval, ...] | None:
+    """The code points of a node that reads exactly one character, None for every other node."""
+    def range_intervals(range_node: RangeNode) -> tuple[Interval, ...]:
+        return WILDCARD if range_node.is_wildcard else ((ord(range_node.start), ord(range_node.end)),)
+
+    if isinstance(node, LiteralNode):
+        return ((ord(node.value), ord(node.value)),)
+    elif isinstance(node, RangeNode):
+        return normalize(range_intervals(node))
+    elif isinstance(node, ClassNode):
+        return normalize(interval for range_node in node.ranges for interval in range_intervals(range_node))
+    elif isinstance(node, EscapedCharacterNode):
+        shorthands = {'d': DIGIT, 'w': WORD, 's': SPACE}
+        return shorthands.get(node.value, ((ord(node.value), ord(node.value)),))
+    return None
+
+def __add_follow(follow: list[int], sources: int, targets: int) -> None:
+    while sources:
+        lowest = sources & -sources
+        follow[lowest.bit_length() - 1] |= targets
+        sources ^= lowest
+
+def _linearize(node: ASTNode, positions: list[tuple[Interval, ...]], follow: list[int]) -> tuple[bool, int, int]:
+    """
+    Adds the positions of node, filling in the follow sets between them.
+    Returns whether node matches the empty string and the bitmasks of its first and last positions.
+    """
+    intervals = __intervals(node)
+    if intervals is not None:
+        position = len(positions)
+        positions.append(intervals)
+        follow.append(0)
+        return False, 1 << position, 1 << position
+    elif isinstance(node, GroupNode):
+        return _linearize(node.node, positions, follow)
+    elif isinstance(node, ConcatenationNode):
+        nullable, first, last = True, 0, 0
+        for subnode in node.nodes:
+            sub_nullable, sub_first, sub_last = _linearize(subnode, positions, follow)
+            __add_follow(follow, last, sub_first)
+            first = first | sub_first if nullable else first
+            last = last | sub_last if sub_nullable else sub_last
+            nullable = nullable and sub_nullable
+        return nullable, first, last
+    elif isinstance(node, AlternationNode):
+        nullable, first, last = False, 0, 0
+        for subnode in node.nodes:
+            sub_nullable, sub_first, sub_last = _linearize(subnode, positions, follow)
+            nullable, first, last = nullable or sub_nullable, first | sub_first, last | sub_last
+        return nullable, first, last
+    elif isinstance(node, (ZeroOrMoreNode, OneOrMoreNode)):
+        nullable, first, last = _linearize(node.node, positions, follow)
+        __add_follow(follow, last, first)
+        return nullable or isinstance(node, ZeroOrMoreNode), first, last
+    elif isinstance(node, ZeroOrOneNode):
+        _, first, last = _linearize(node.node, positions, follow)
+        return True, first, last
+    elif isinstance(node, SpecificQuantifierNode):
+        # Every copy of the body gets its own positions: x{2,4} is xxx?x?, x{2,} is xxx*
+        optional = [ZeroOrMoreNode(node.node)] if node.max is None else [ZeroOrOneNode(node.node)] * (node.max - node.min)
+        return _linearize(ConcatenationNode([node.node] * node.min + optional), positions, follow)
+    else:
+        raise Exception(f"Unknown node type: {node}")
+
+def count_positions(node: ASTNode) -> int:
+    """The number of positions of the position automaton of node, without building it."""
+    if __intervals(node) is not None:
+        return 1
+    elif isinstance(node, (ConcatenationNode, AlternationNode)):
+        return sum(count_positions(subnode) for subnode in node.nodes)
+    elif isinstance(node, (GroupNode, ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode)):
+        return count_positions(node.node)
+    elif isinstance(node, SpecificQuantifierNode):
+        return count_positions(node.node) * (node.min + 1 if node.max is None else node.max)
+    else:
+        raise Exception(f"Unknown node type: {node}")
+
+def compile(pattern: str, stats: CompileStats | None = None, max_positions: int = POSITION_LIMIT, ast: ASTNode | None = None) -> Glushkov:
+    """The position automaton of pattern, raises `BudgetExceeded` before building it if it would have more than max_positions positions."""
+    ast = parse_pattern(pattern, stats) if ast is None else ast
+    n_positions = count_positions(ast)
+    if n_positions > max_positions:
+        raise BudgetExceeded(f"The position automaton exceeds the budget of {max_positions} positions ({n_positions} positions)")
+    with stage(stats, 'glushkov'):
+        glushkov = Glushkov(ast)
+    if stats is not None:
+        stats.record_glushkov(glushkov)
+    return glushkov
+
+if __name__ == '__main__':
+    import itertools
+    import re
+    import time
+
+    def parse(pattern: str) -> Glushkov:
+        return compile(pattern)
+
+    def match(compiled: Glushkov, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: Glushkov) -> None:
+        print(f"Pattern '{pattern}' compiled to {compiled}")
+
+    test_regex(parse, match, log)
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+
+    # Quantifiers, nested loops and more positions than one follow table holds, against the stdlib
+    for pattern in ['(a|ab)(c|bcd)?d*', '((a|b)*|c)+d', 'a{0,0}b|ab', '(ab?){2,3}c', '(a|b)*a(a|b){3}', '(a?){3}a{3}', '[a-c]{2,}d?', '(abc|bcd|cde|.d)+']:
+        compiled = compile(pattern)
+        assert compiled.n_positions == count_positions(parse_pattern(pattern))
+        for length in range(7):
+            for string in map(''.join, itertools.product('abcd', repeat=length)):
+                assert compiled.match(string) == (re.fullmatch(pattern, string) is not None), f"Test failed for '{pattern}' and '{string}'"
+    print("Test passed for patterns against the stdlib.")
+
+    # Exponentially many DFA states, but only 22 positions ([ab]*a[ab]{20} once optimized) and nothing to determinize
+    start_time = time.time()
+    compiled = compile('(a|b)*a(a|b){20}')
+    compile_time = time.time() - start_time
+    assert compiled.match('b' + 'a' + 'ab' * 10) and not compiled.match('a' + 'b' * 21)
+    assert compile('(a|b)*a(a|b){20}', max_positions=MAX_POSITIONS).n_positions == 22
+    for pattern, max_positions in [('(a|b)*a(a|b){70}', MAX_POSITIONS), ('[a-z]{1,5000}', POSITION_LIMIT)]:
+        start_time = time.time()
+        try:
+            compile(pattern, max_positions=max_positions)
+            assert False, f"Test failed for '{pattern}', which has too many positions"
+        except BudgetExceeded:
+            assert time.time() - start_time < 0.1
+    print(f"Test passed for {compiled}, compiled in {compile_time * 1000:.2f}ms.")
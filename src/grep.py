@@ -0,0 +1,277 @@
+import argparse
+import mmap
+import os
+import sys
+from multiprocessing import Pool, RawArray
+from typing import BinaryIO, Iterator, MutableSequence
+from src.dense import DenseDFA
+from src.regex import compile
+from src.serialize import from_bytes, to_bytes
+
+
+DEFAULT_CHUNK_SIZE = 1 << 24
+
+# Set in every worker process by _init_worker, the automaton is sent once per worker instead of once per chunk
+_worker_dfa: DenseDFA | None = None
+_worker_required: bytes | None = b''
+# With -l, flags shared by all workers: set for every file that has a matching line, its other chunks are skipped
+_worker_matched: MutableSequence[int] | None = None
+
+
+def _init_worker(data: bytes, required: bytes | None, matched: MutableSequence[int] | None = None) -> None:
+    global _worker_dfa, _worker_required, _worker_matched
+    _worker_dfa = from_bytes(data)
+    _worker_required = required
+    _worker_matched = matched
+
+def utf8_pattern(pattern: str) -> str:
+    """
+    The pattern over the UTF-8 encoded text, files are matched byte by byte (so `.` matches a single byte).
+    Characters above U+007F become a group of their bytes, so quantifiers still apply to the whole character.
+    In a character class they would become a class of single bytes, so they are rejected there.
+    """
+    translated: list[str] = []
+    in_class = escaped = False
+    for char in pattern:
+        if ord(char) > 0x7F:
+            if in_class:
+                raise Exception(f"Character {repr(char)} in a character class, grep only supports ASCII characters in classes")
+            if escaped:
+                translated.pop()
+            translated.append('(' + char.encode('utf-8').decode('latin-1') + ')')
+        else:
+            translated.append(char)
+            if not escaped and char == '[':
+                in_class = True
+            elif not escaped and char == ']':
+                in_class = False
+        escaped = not escaped and char == '\\'
+    return ''.join(translated)
+
+def line_chunks(mapped: mmap.mmap | bytes, chunk_size: int) -> Iterator[tuple[int, int]]:
+    """Splits the input into (start, end) ranges of about chunk_size bytes, each ending right after a newline (or at the end of the input)."""
+    start, size = 0, len(mapped)
+    while start < size:
+        end = min(start + chunk_size, size)
+        if end < size:
+            newline = mapped.find(b'\n', end - 1)
+            end = size if newline == -1 else newline + 1
+        yield start, end
+        start = end
+
+def matching_lines(dfa: DenseDFA, chunk: bytes, required: bytes | None = b'') -> Iterator[tuple[int, int]]:
+    """
+    Yields the (start, end) range of every line of the chunk that contains a match, excluding the newline.
+    `dfa` has to be unanchored (`.*R`), a line matches as soon as the DFA reaches an accepting state.
+    Only lines containing `required`, a literal every match contains, are scanned (None if no line can match).
+    """
+    if required is None:
+        return
+    table, n_classes, accepting = dfa.table, dfa.n_classes, dfa.accepting
+    start = dfa.start
+    # Translate the whole chunk once, lines are then scanned on the class ids
+    class_ids = dfa.translate(memoryview(chunk))
+    line_start, length = 0, len(chunk)
+
+    while line_start < length:
+        if required:
+            # Jump straight to the next line that contains the required literal
+            position = chunk.find(required, line_start)
+            if position == -1:
+                return
+            line_start = chunk.rfind(b'\n', line_start, position) + 1 or line_start
+        line_end = chunk.find(b'\n', line_start)
+        if line_end == -1:
+            line_end = length
+
+        if accepting[start]:
+            yield line_start, line_end
+        else:
+            state = start
+            for class_id in class_ids[line_start:line_end]:
+                state = table[state * n_classes + class_id]
+                if accepting[state]:
+                    yield line_start, line_end
+                    break
+
+        line_start = line_end + 1
+
+def _grep_chunk(task: tuple[str, int, int, int, bool]) -> tuple[str, list[bytes] | int]:
+    path, index, start, end, count_only = task
+    if _worker_matched is not None and _worker_matched[index]:
+        return path, 0
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        chunk = mapped[start:end]
+
+    lines = matching_lines(_worker_dfa, chunk, _worker_required)
+    if _worker_matched is not None:
+        # Only whether the file matches is printed, the first matching line decides it
+        if next(lines, None) is None:
+            return path, 0
+        _worker_matched[index] = 1
+        return path, 1
+    if count_only:
+        return path, sum(1 for _ in lines)
+    return path, [chunk[line_start:line_end] for line_start, line_end in lines]
+
+def __tasks(paths: list[str], chunk_size: int, count_only: bool, errors: dict[str, str]) -> Iterator[tuple[str, int, int, int, bool]]:
+    for index, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    chunks = list(line_chunks(mapped, chunk_size))
+        except OSError as error:
+            errors[path] = error.strerror
+            continue
+        for start, end in chunks:
+            yield path, index, start, end, count_only
+
+def grep(
+    pattern: str,
+    paths: list[str],
+    count: bool = False,
+    files_with_matches: bool = False,
+    jobs: int | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output: BinaryIO | None = None,
+) -> int:
+    """
+    Writes every line of the files that contains a match of pattern (or the counts with `count`,
+    or only the names of matching files with `files_with_matches`) to output, in the order of the files.
+
+    The files are memory mapped and split into line-aligned chunks, which are matched by a pool of `jobs` processes.
+    The pattern is matched against the UTF-8 encoding of the text, see `utf8_pattern`.
+    Returns the exit status of grep: 0 if any line matched, 1 if none did and 2 if a file could not be read.
+    """
+    if output is None:
+        output = sys.stdout.buffer
+    jobs = jobs or os.cpu_count() or 1
+    searcher = compile(utf8_pattern(pattern)).searcher
+    dfa = searcher.unanchored
+    # Files are matched as bytes, None if the required literal can not occur in them
+    binary_literals = searcher.prefilter.binary_literals
+    required = binary_literals.required if binary_literals is not None else None
+    count_only = count or files_with_matches
+    with_names = len(paths) > 1
+    errors: dict[str, str] = {}
+    counts = dict.fromkeys(paths, 0)
+    order = list(counts)
+    index_of = {path: i for i, path in enumerate(order)}
+    tasks = __tasks(order, chunk_size, count_only, errors)
+
+    if jobs == 1:
+        _init_worker(to_bytes(dfa), required, bytearray(len(order)) if files_with_matches else None)
+        pool = None
+        results = map(_grep_chunk, tasks)
+    else:
+        matched = RawArray('b', len(order)) if files_with_matches else None
+        pool = Pool(jobs, initializer=_init_worker, initargs=(to_bytes(dfa), required, matched))
+        results = pool.imap(_grep_chunk, tasks)
+
+    finished = 0
+
+    def finish(until: int) -> None:
+        # All chunks of the files before order[until] are matched, write their summaries
+        nonlocal finished
+        for path in order[finished:until]:
+            if path in errors:
+                continue
+            if count:
+                output.write(__name_prefix(path, with_names) + f"{counts[path]}\n".encode())
+            elif files_with_matches and counts[path]:
+                output.write(path.encode('utf-8', 'surrogateescape') + b'\n')
+        finished = max(finished, until)
+
+    try:
+        # Results arrive in the order of the tasks, so lines are written in file order as soon as their chunk is done
+        for path, result in results:
+            finish(index_of[path])
+            if count_only:
+                counts[path] += result
+            else:
+                counts[path] += len(result)
+                prefix = __name_prefix(path, with_names)
+                for line in result:
+                    output.write(prefix + line + b'\n')
+        finish(len(order))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    output.flush()
+
+    for path, error in errors.items():
+        print(f"grep: {path}: {error}", file=sys.stderr)
+    if errors:
+        return 2
+    return 0 if any(counts.values()) else 1
+
+def __name_prefix(path: str, with_names: bool) -> bytes:
+    return path.encode('utf-8', 'surrogateescape') + b':' if with_names else b''
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('pattern', help="the pattern, a line is printed if any part of it matches")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-c', '--count', action='store_true', help="print the number of matching lines per file instead")
+    output.add_argument('-l', '--files-with-matches', action='store_true', help="print only the names of files with a matching line")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="approximate number of bytes per chunk")
+    parser.set_defaults(run=run)
+
+def run(args: argparse.Namespace) -> int:
+    return grep(args.pattern, args.files, args.count, args.files_with_matches, args.jobs, args.chunk_size)
+
+
+if __name__ == '__main__':
+    import io
+    import re
+    import tempfile
+
+    lines = [f"{i} {'ab' * (i % 4)} {'x' if i % 7 == 0 else ''}" for i in range(200)] + ['', 'no digits here']
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ('first.log', 'second.log')]
+        with open(paths[0], 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        with open(paths[1], 'w') as file:
+            file.write('\n'.join(reversed(lines)))  # No trailing newline
+
+        for pattern in ['[0-9]+7', '(ab)+ x', 'x?', 'no digits', 'abababab']:
+            for jobs, chunk_size in [(1, 1), (1, 64), (2, 100), (2, DEFAULT_CHUNK_SIZE)]:
+                output = io.BytesIO()
+                grep(pattern, paths, jobs=jobs, chunk_size=chunk_size, output=output)
+                expected = [f"{path}:{line}" for path, text in zip(paths, [lines, lines[::-1]]) for line in text if re.search(pattern, line)]
+                assert output.getvalue().decode().splitlines() == expected, f"Test failed for '{pattern}' with {jobs} jobs and chunks of {chunk_size} bytes"
+            print(f"Test passed for pattern '{pattern}'.")
+
+        output = io.BytesIO()
+        assert grep('7 ', paths[:1], count=True, jobs=2, chunk_size=50, output=output) == 0
+        assert output.getvalue() == f"{sum(1 for line in lines if '7 ' in line)}\n".encode()
+        output = io.BytesIO()
+        assert grep('no digits', [*paths, os.path.join(directory, 'missing.log')], files_with_matches=True, jobs=1, output=output) == 2
+        assert output.getvalue().decode().splitlines() == paths
+        for jobs in [1, 2]:
+            output = io.BytesIO()
+            assert grep('[0-9]', paths, files_with_matches=True, jobs=jobs, chunk_size=1, output=output) == 0
+            assert output.getvalue().decode().splitlines() == paths
+        # Once a file has a matching line, its remaining chunks are not even read
+        _init_worker(to_bytes(compile('a').searcher.unanchored), b'', bytearray([1]))
+        assert _grep_chunk((os.path.join(directory, 'missing.log'), 0, 0, 10, True)) == (os.path.join(directory, 'missing.log'), 0)
+        print("Test passed for counts and file names.")
+
+        # Patterns match the UTF-8 encoding of the text, also with quantifiers on characters of several bytes
+        unicode_lines = ['café', 'cafe', 'caféé au lait', 'naïve', 'Grüße', '日本語のテキスト', '']
+        with open(paths[0], 'w', encoding='utf-8') as file:
+            file.write('\n'.join(unicode_lines) + '\n')
+        for pattern in ['café', 'caf(é)+ ', 'é{2,2}', 'ï|ü', '本+語', 'a\\é', '[a-z]ß']:
+            output = io.BytesIO()
+            grep(pattern, paths[:1], jobs=1, output=output)
+            assert output.getvalue().decode('utf-8').splitlines() == [line for line in unicode_lines if re.search(pattern, line)], f"Test failed for '{pattern}'"
+        try:
+            grep('[éè]', paths[:1], jobs=1, output=io.BytesIO())
+        except Exception as error:
+            assert 'class' in str(error)
+        else:
+            assert False, "Expected an error for a non-ASCII character in a class"
+        print("Test passed for UTF-8 files.")
@@ -0,0 +1,140 @@
+from src.charset import Text, as_symbols, codepoint
+from src.nfa import NFA, ast_to_nfa
+from src.ast import ASTNode
+from src.optimize import parse_pattern
+from src.stats import CompileStats, stage
+from src.test import test_regex
+
+
+class LazyDFAState:
+    def __init__(self, nfa_states: frozenset[int], is_final: bool) -> None:
+        self.nfa_states = nfa_states
+        # Filled in on demand, the first time a character (or byte) is read in this state
+        self.transitions: dict[str | int, LazyDFAState] = {}
+        self.is_final = is_final
+
+
+class LazyDFA:
+    """
+    A DFA whose states and transitions are computed from the NFA the first time they are needed.
+
+    Built states and transitions are kept in a cache holding at most `max_cache_size` entries.
+    When the cache is full it is flushed and rebuilt from the state currently being matched,
+    so memory stays bounded even for patterns whose full DFA would be exponentially large.
+    """
+
+    def __init__(self, nfa: NFA, max_cache_size: int = 100_000) -> None:
+        if max_cache_size < 4:
+            raise Exception("The lazy DFA cache must hold at least four entries")
+        self.max_cache_size = max_cache_size
+        self.flushes = 0
+        self.nfa = nfa
+        self.__start_nfa_states = nfa.epsilon_closure([0])
+        self.__states: dict[frozenset[int], LazyDFAState] = {}
+        self.__cache_size = 0
+        self.__dead = LazyDFAState(frozenset(), False)
+        self.start = self.__intern(self.__start_nfa_states)
+
+    @property
+    def cache_size(self) -> int:
+        return self.__cache_size
+
+    @property
+    def dead(self) -> LazyDFAState:
+        # No continuation of the input can match anymore once this state is reached
+        return self.__dead
+
+    def __intern(self, nfa_states: frozenset[int]) -> LazyDFAState:
+        if not nfa_states:
+            return self.__dead
+        state = self.__states.get(nfa_states)
+        if state is None:
+            is_final = self.nfa.is_final
+            state = LazyDFAState(nfa_states, any(is_final[nfa_state] for nfa_state in nfa_states))
+            self.__states[nfa_states] = state
+            self.__cache_size += 1
+        return state
+
+    def __flush(self) -> None:
+        self.flushes += 1
+        self.__states = {}
+        self.__cache_size = 0
+        self.start = self.__intern(self.__start_nfa_states)
+
+    def _step(self, state: LazyDFAState, symbol: str | int) -> LazyDFAState:
+        # A step adds at most one state and one transition
+        if self.__cache_size + 2 > self.max_cache_size:
+            # Keep matching from a fresh copy of the current state, the old states are left to the garbage collector
+            self.__flush()
+            state = self.__intern(state.nfa_states)
+
+        value = codepoint(symbol)
+        transitions = self.nfa.transitions
+        next_nfa_states = {
+            next_state
+            for nfa_state in state.nfa_states
+            for start, end, next_state in transitions[nfa_state]
+            if start <= value <= end
+        }
+        next_state = self.__intern(self.nfa.epsilon_closure(next_nfa_states))
+        state.transitions[symbol] = next_state
+        self.__cache_size += 1
+        return next_state
+
+    def step(self, state: LazyDFAState, symbol: str | int) -> LazyDFAState:
+        next_state = state.transitions.get(symbol)
+        return next_state if next_state is not None else self._step(state, symbol)
+
+    def match(self, string: Text) -> bool:
+        state = self.start
+        dead = self.__dead
+
+        for symbol in as_symbols(string):
+            next_state = state.transitions.get(symbol)
+            if next_state is None:
+                next_state = self._step(state, symbol)
+            if next_state is dead:
+                return False
+            state = next_state
+
+        return state.is_final
+
+
+def compile(pattern: str, max_cache_size: int = 100_000, stats: CompileStats | None = None, ast: ASTNode | None = None) -> LazyDFA:
+    ast = parse_pattern(pattern, stats) if ast is None else ast
+    with stage(stats, 'nfa'):
+        nfa = ast_to_nfa(ast)
+    with stage(stats, 'epsilon_closure'):
+        nfa.epsilon_closures()
+    if stats is not None:
+        stats.record_nfa(nfa)
+    return LazyDFA(nfa, max_cache_size)
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    def parse(pattern: str) -> LazyDFA:
+        return compile(pattern)
+
+    def match(compiled: LazyDFA, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: LazyDFA) -> None:
+        pass
+
+    test_regex(parse, match, log)
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+
+    # A tiny cache is flushed all the time but still matches correctly
+    test_regex(lambda pattern: compile(pattern, max_cache_size=4), match, log)
+
+    # The full DFA of this pattern has 2^21 states, the lazy one only builds what the input visits
+    start_time = time.time()
+    compiled = compile('(a|b)*a(a|b){20,20}', max_cache_size=1000)
+    rng = random.Random(0)
+    string = ''.join(rng.choice('ab') for _ in range(20000)) + 'a' * 21
+    assert compiled.match(string)
+    assert not compiled.match(string + 'b' * 21)
+    assert compiled.cache_size <= compiled.max_cache_size
+    print(f"Matched exponential pattern lazily in {time.time() - start_time:.3f}s with {compiled.flushes} cache flushes.")
@@ -0,0 +1,202 @@
+import os
+from typing import NamedTuple
+from src.ast import ASTNode, ASTParser, AlternationNode, ConcatenationNode, LiteralNode, RangeNode, ClassNode, ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode, SpecificQuantifierNode, GroupNode, EscapedCharacterNode
+from src.charset import Text
+
+
+class Literals(NamedTuple):
+    """
+    Literals that every string matched by a node contains.
+    `exact` is the only string the node matches (or None), every match starts with `prefix`, ends with `suffix`
+    and contains `required` somewhere, the longest such literal that was found.
+    """
+    exact: str | None
+    prefix: str
+    suffix: str
+    required: str
+
+
+NOTHING = Literals(None, '', '', '')
+
+
+def __literal(string: str) -> Literals:
+    return Literals(string, string, string, string)
+
+def __longest(*literals: str) -> str:
+    return max(literals, key=len)
+
+def __concatenate(left: Literals, right: Literals) -> Literals:
+    if left.exact is not None and right.exact is not None:
+        return __literal(left.exact + right.exact)
+    prefix = left.exact + right.prefix if left.exact is not None else left.prefix
+    suffix = left.suffix + right.exact if right.exact is not None else right.suffix
+    # The end of the left match and the start of the right match are adjacent in every match
+    return Literals(None, prefix, suffix, __longest(left.required, right.required, left.suffix + right.prefix, prefix, suffix))
+
+def __alternate(branches: list[Literals]) -> Literals:
+    if branches[0].exact is not None and all(branch.exact == branches[0].exact for branch in branches):
+        return branches[0]
+    prefix = os.path.commonprefix([branch.prefix for branch in branches])
+    suffix = os.path.commonprefix([branch.suffix[::-1] for branch in branches])[::-1]
+    return Literals(None, prefix, suffix, __longest(prefix, suffix))
+
+def __repeat(literals: Literals, min: int, max: int | None) -> Literals:
+    if literals.exact == '':
+        return literals
+    if min == 0:
+        return NOTHING
+
+    if literals.exact is not None:
+        repeated = __literal(literals.exact * min)
+    else:
+        repeated = literals
+        for _ in range(min - 1):
+            repeated = __concatenate(repeated, literals)
+    if max == min:
+        return repeated
+    # Any number of further repetitions may follow, but the last one still ends with the suffix of the node
+    return Literals(None, repeated.prefix, literals.suffix, __longest(repeated.required, literals.suffix))
+
+def __single_character(node: RangeNode) -> str | None:
+    if not node.is_wildcard and node.start == node.end:
+        return node.start
+    return None
+
+def extract_literals(node: ASTNode) -> Literals:
+    if isinstance(node, LiteralNode):
+        return __literal(node.value)
+    elif isinstance(node, ConcatenationNode):
+        literals = __literal('')
+        for subnode in node.nodes:
+            literals = __concatenate(literals, extract_literals(subnode))
+        return literals
+    elif isinstance(node, AlternationNode):
+        return __alternate([extract_literals(subnode) for subnode in node.nodes])
+    elif isinstance(node, RangeNode):
+        character = __single_character(node)
+        return __literal(character) if character is not None else NOTHING
+    elif isinstance(node, ClassNode):
+        characters = {__single_character(range_node) for range_node in node.ranges}
+        return __literal(characters.pop()) if len(characters) == 1 and None not in characters else NOTHING
+    elif isinstance(node, (ZeroOrMoreNode, ZeroOrOneNode)):
+        return __repeat(extract_literals(node.node), 0, None)
+    elif isinstance(node, OneOrMoreNode):
+        return __repeat(extract_literals(node.node), 1, None)
+    elif isinstance(node, SpecificQuantifierNode):
+        return __repeat(extract_literals(node.node), node.min, node.max)
+    elif isinstance(node, GroupNode):
+        return extract_literals(node.node)
+    elif isinstance(node, EscapedCharacterNode):
+        return NOTHING if node.value in 'dws' else __literal(node.value)
+    else:
+        raise Exception(f"Unknown node type: {node}")
+
+
+def _find(text: Text, literal: str | bytes, start: int, end: int) -> int | None:
+    # None if the text can not be searched without copying it (memoryviews have no find)
+    if isinstance(text, memoryview):
+        return None
+    return text.find(literal, start, end)
+
+
+class Prefilter:
+    """
+    Decides what it can about a string with the C implemented `find`, `startswith` and `endswith`, before any automaton runs.
+    Strings without the required literals are rejected, and patterns that are a single literal never need an automaton.
+    """
+
+    def __init__(self, literals: Literals) -> None:
+        self.literals = literals
+        # False if there is nothing to check, the automaton alone decides every string
+        self.is_useful = literals != NOTHING
+        try:
+            # The literals as they occur in binary input, None if they contain code points that never occur in it
+            self.__binary_literals: Literals | None = Literals(*(None if literal is None else literal.encode('latin-1') for literal in literals))
+        except UnicodeEncodeError:
+            self.__binary_literals = None
+
+    @property
+    def is_literal(self) -> bool:
+        return self.literals.exact is not None
+
+    @property
+    def binary_literals(self) -> Literals | None:
+        """The literals as they occur in binary input, None if they contain code points that never occur in it."""
+        return self.__binary_literals
+
+    def _literals_for(self, text: Text) -> Literals | None:
+        return self.literals if isinstance(text, str) else self.__binary_literals
+
+    def match(self, string: Text) -> bool | None:
+        """True or False if the prefilter already knows whether the whole string matches, None if the automaton has to decide."""
+        literals = self._literals_for(string)
+        if literals is None:
+            return False
+        exact, prefix, suffix, required = literals
+
+        if isinstance(string, (str, bytes, bytearray)):
+            if exact is not None:
+                return string == exact
+            if not string.startswith(prefix) or not string.endswith(suffix) or required not in string:
+                return False
+            return None
+
+        view = memoryview(string).cast('B')
+        if exact is not None:
+            return view == exact
+        if view[:len(prefix)] != prefix or view[len(view) - len(suffix):] != suffix:
+            return False
+        if _find(string, required, 0, len(view)) == -1:
+            return False
+        return None
+
+    def may_contain_match(self, string: Text, pos: int, endpos: int) -> bool:
+        """False if no match can lie within string[pos:endpos], because the required literal does not occur there."""
+        literals = self._literals_for(string)
+        if literals is None:
+            return False
+        return _find(string, literals.required, pos, endpos) != -1
+
+    def find_literal(self, string: Text, pos: int, endpos: int) -> int | None:
+        """The position of the next occurrence of a pure literal pattern in string[pos:endpos], -1 if there is none and None if the text can not be searched."""
+        literals = self._literals_for(string)
+        if literals is None:
+            return -1
+        return _find(string, literals.exact, pos, endpos)
+
+
+def compile(pattern: str) -> Prefilter:
+    return Prefilter(extract_literals(ASTParser(pattern).parse()))
+
+if __name__ == '__main__':
+    import re
+    from src.test import REGEX_TEST_CASES
+
+    expected_literals = {
+        'foo': Literals('foo', 'foo', 'foo', 'foo'),
+        '\\d+foo[a-z]*': Literals(None, '', '', 'foo'),
+        'ab[0-9]+cd': Literals(None, 'ab', 'cd', 'ab'),
+        '(abc|abd)x': Literals(None, 'ab', 'x', 'ab'),
+        '(ab)+c': Literals(None, 'ab', 'abc', 'abc'),
+        'x(ab){2,2}y?': Literals(None, 'xabab', '', 'xabab'),
+        '[a]\\.b': Literals('a.b', 'a.b', 'a.b', 'a.b'),
+        '(foo|bar)?baz': Literals(None, '', 'baz', 'baz'),
+        'a*': Literals(None, '', '', ''),
+    }
+    for pattern, expected in expected_literals.items():
+        literals = extract_literals(ASTParser(pattern).parse())
+        assert literals == expected, f"Test failed for '{pattern}'. Expected {expected}, but got {literals}"
+    print(f"Test passed for {len(expected_literals)} literal extractions.")
+
+    # The prefilter may only reject strings that really do not match, and is always right when it decides
+    for case in REGEX_TEST_CASES + [{"pattern": pattern, "matching": [], "not_matching": []} for pattern in expected_literals]:
+        prefilter = compile(case["pattern"])
+        for string in case["matching"] + case["not_matching"] + ['foo', '12foo', 'abab', 'xababy', 'a.b', 'barbaz', 'abdx', '']:
+            expected = re.fullmatch(case["pattern"], string) is not None
+            for text in (string, string.encode('latin-1'), memoryview(string.encode('latin-1'))):
+                decided = prefilter.match(text)
+                assert decided is None or decided == expected, f"Test failed for '{case['pattern']}' and {text!r}"
+                if expected:
+                    assert prefilter.may_contain_match(text, 0, len(string))
+    assert compile('été').match(b'ete') is False and compile('xΔ+').match(b'x') is False
+    print("Test passed for the prefilter.")
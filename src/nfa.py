@@ -1,221 +1,391 @@
-from collections import defaultdict
+from itertools import islice
+from typing import Iterable
+from src.charset import DIGIT, SPACE, WILDCARD, WORD, Interval, Text, format_interval, normalize
 from src.ast import ASTNode, ASTParser, AlternationNode, ConcatenationNode, LiteralNode, RangeNode, ClassNode, ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode, SpecificQuantifierNode, GroupNode, EscapedCharacterNode
 from src.test import REGEX_TEST_CASES, test_regex
 
 
-class NFAState:
-    def __init__(self) -> None:
-        self.transitions: dict[str, set[NFAState]] = defaultdict(set)
-        self.epsilon_transitions: set[NFAState] = set()
-        self.is_final: bool = False
-
-    def _add_transition(self, char: str, state: "NFAState") -> None:
-        self.transitions[char].add(state)
-
-    def _add_epsilon_transition(self, state: "NFAState") -> None:
-        self.epsilon_transitions.add(state)
-        
-    def match(self, string: str) -> bool:
-        def dfs(state: NFAState, position: int) -> bool:
-            if position == len(string):
-                return state.is_final or any(dfs(next_state, position) for next_state in state.epsilon_transitions)
+Edge = tuple[int, int, int]  # (start, end, target state)
 
-            # Epsilon transitions
-            if any(dfs(next_state, position) for next_state in state.epsilon_transitions):
-                return True
 
-            # Regular transitions
-            if any(dfs(next_state, position + 1) for next_state in state.transitions[string[position]]):
-                return True
+class NFA:
+    """
+    A compact NFA graph: states are the integers 0..n_states - 1 and state 0 is the start state.
+    `transitions[state]` holds the interval edges and `epsilon_transitions[state]` the epsilon targets of a state,
+    both become tuples once construction is finished.
+    """
 
-            return False
+    __slots__ = ('transitions', 'epsilon_transitions', 'is_final', '_closures')
 
-        return dfs(self, 0)
+    def __init__(self) -> None:
+        self.transitions: list[list[Edge] | tuple[Edge, ...]] = []
+        self.epsilon_transitions: list[list[int] | tuple[int, ...]] = []
+        self.is_final = bytearray()
+        self._closures: list[frozenset[int]] | None = None
+
+    @property
+    def n_states(self) -> int:
+        return len(self.is_final)
+
+    def _add_state(self) -> int:
+        self.transitions.append([])
+        self.epsilon_transitions.append([])
+        self.is_final.append(0)
+        return len(self.is_final) - 1
+
+    def _add_transition(self, state: int, start: int, end: int, target: int) -> None:
+        self.transitions[state].append((start, end, target))
+
+    def _add_epsilon_transition(self, state: int, target: int) -> None:
+        self.epsilon_transitions[state].append(target)
+
+    def _append(self, other: "NFA") -> int:
+        # Copies all states of other into this NFA, shifted by the returned offset
+        offset = self.n_states
+        self.transitions.extend([(start, end, target + offset) for start, end, target in edges] for edges in other.transitions)
+        self.epsilon_transitions.extend([target + offset for target in targets] for targets in other.epsilon_transitions)
+        self.is_final += other.is_final
+        return offset
+
+    def _splice(self, fragment: "NFA", start_state: int) -> int:
+        """
+        Copies all states of fragment into this NFA, its start state 0 becoming start_state.
+        Returns the offset of the other states of fragment in this NFA (state i of fragment becomes state i + offset).
+        Nothing in fragment may lead back into its start state, which holds for everything `__convert_node` builds.
+        """
+        offset = self.n_states - 1
+        transitions, epsilon_transitions = fragment.transitions, fragment.epsilon_transitions
+        self.transitions[start_state] += [(start, end, target + offset) for start, end, target in transitions[0]]
+        self.epsilon_transitions[start_state] += [target + offset for target in epsilon_transitions[0]]
+        self.transitions += [[(start, end, target + offset) for start, end, target in edges] for edges in islice(transitions, 1, None)]
+        self.epsilon_transitions += [[target + offset for target in targets] for targets in islice(epsilon_transitions, 1, None)]
+        self.is_final += fragment.is_final[1:]
+        return offset
+
+    def _freeze(self) -> "NFA":
+        self.transitions = [tuple(edges) for edges in self.transitions]
+        self.epsilon_transitions = [tuple(dict.fromkeys(targets)) for targets in self.epsilon_transitions]
+        self._closures = None
+        return self
+
+    @staticmethod
+    def union(nfas: list["NFA"]) -> tuple["NFA", list[int]]:
+        """
+        Joins the NFAs under a new start state, which has an epsilon transition to each of their start states.
+        Returns the joined NFA and the offset of every NFA's states in it.
+        """
+        union = NFA()
+        start = union._add_state()
+        offsets = []
+        for nfa in nfas:
+            offset = union._append(nfa)
+            union._add_epsilon_transition(start, offset)
+            offsets.append(offset)
+        return union._freeze(), offsets
+
+    def final_states(self) -> list[int]:
+        return [state for state, is_final in enumerate(self.is_final) if is_final]
+
+    def epsilon_closures(self) -> list[frozenset[int]]:
+        """
+        The epsilon closure of every state, computed once for the whole NFA and cached.
+        States on an epsilon cycle share one closure, and each closure is built from the already finished closures
+        of the components it reaches, so no state is expanded twice.
+        """
+        if self._closures is None:
+            epsilon_transitions = self.epsilon_transitions
+            closures: list[frozenset[int]] = [frozenset()] * self.n_states
+            component_of = [0] * self.n_states
+            # Tarjan emits every component after all components reachable from it
+            for component_id, component in enumerate(_strongly_connected_components(epsilon_transitions)):
+                for state in component:
+                    component_of[state] = component_id
+                closure = set(component)
+                for state in component:
+                    for next_state in epsilon_transitions[state]:
+                        if component_of[next_state] != component_id:
+                            closure |= closures[next_state]
+                frozen_closure = frozenset(closure)
+                for state in component:
+                    closures[state] = frozen_closure
+            self._closures = closures
+        return self._closures
+
+    def epsilon_closure(self, states: Iterable[int]) -> frozenset[int]:
+        closures = self.epsilon_closures()
+        closure: set[int] = set()
+        for state in states:
+            # A state inside the closure already has its own closure included
+            if state not in closure:
+                closure |= closures[state]
+        return frozenset(closure)
+
+    def match(self, string: Text) -> bool:
+        # Imported here, the VM is built on top of this module
+        from src.pike import PikeVM
+        return PikeVM(self).match(string)
 
     def to_dot(self) -> str:
         dot_graph = "digraph NFA {\n"
         dot_graph += "    rankdir=LR;\n"
         dot_graph += "    node [shape = circle];\n"
 
-        # Traversal
-        visited = set()
-        def dfs(state: NFAState):
-            nonlocal dot_graph
-            
-            if state in visited:
-                return
-            visited.add(state)
-
-            if state.is_final:
-                dot_graph += f"    {id(state)} [shape=doublecircle];\n"
-
-            for char, states in state.transitions.items():
-                for next_state in states:
-                    dot_graph += f"    {id(state)} -> {id(next_state)} [label=\"{char}\"];\n"
-                    dfs(next_state)
-
-            for next_state in state.epsilon_transitions:
-                dot_graph += f"    {id(state)} -> {id(next_state)} [label=\"ε\"];\n"
-                dfs(next_state)
-
-        dfs(self)
-        
-        dot_graph += "    start -> " + str(id(self)) + ";\n"
+        for state in range(self.n_states):
+            if self.is_final[state]:
+                dot_graph += f"    {state} [shape=doublecircle];\n"
+
+            for start, end, next_state in self.transitions[state]:
+                dot_graph += f"    {state} -> {next_state} [label=\"{format_interval((start, end))}\"];\n"
+
+            for next_state in self.epsilon_transitions[state]:
+                dot_graph += f"    {state} -> {next_state} [label=\"ε\"];\n"
+
+        dot_graph += "    start -> 0;\n"
         dot_graph += "}"
 
         return dot_graph
 
     
-def __convert_node(node: ASTNode, start_state: NFAState) -> NFAState:
+def _strongly_connected_components(successors: list[list[int] | tuple[int, ...]]) -> list[list[int]]:
+    # Iterative version of Tarjan's algorithm, deeply nested patterns must not hit the recursion limit
+    n = len(successors)
+    index = [-1] * n
+    lowlink = [0] * n
+    on_stack = bytearray(n)
+    stack: list[int] = []
+    components: list[list[int]] = []
+    counter = 0
+
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            state, i = work.pop()
+            if i == 0:
+                index[state] = lowlink[state] = counter
+                counter += 1
+                stack.append(state)
+                on_stack[state] = 1
+
+            edges = successors[state]
+            while i < len(edges):
+                next_state = edges[i]
+                i += 1
+                if index[next_state] == -1:
+                    # Descend into next_state, continue with the remaining edges of state afterwards
+                    work.append((state, i))
+                    work.append((next_state, 0))
+                    break
+                elif on_stack[next_state]:
+                    lowlink[state] = min(lowlink[state], index[next_state])
+            else:
+                if lowlink[state] == index[state]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == state:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[state])
+
+    return components
+
+def __convert_node(node: ASTNode, nfa: NFA, start_state: int) -> int:
     if isinstance(node, LiteralNode):
-        return __convert_literal_node(node, start_state)
+        return __convert_literal_node(node, nfa, start_state)
     elif isinstance(node, ConcatenationNode):
-        return __convert_concatenation_node(node, start_state)
+        return __convert_concatenation_node(node, nfa, start_state)
     elif isinstance(node, AlternationNode):
-        return __convert_alternation_node(node, start_state)
+        return __convert_alternation_node(node, nfa, start_state)
     elif isinstance(node, RangeNode):
-        return __convert_range_node(node, start_state)
+        return __convert_range_node(node, nfa, start_state)
     elif isinstance(node, ClassNode):
-        return __convert_class_node(node, start_state)
+        return __convert_class_node(node, nfa, start_state)
     elif isinstance(node, ZeroOrMoreNode):
-        return __convert_zero_or_more_node(node, start_state)
+        return __convert_zero_or_more_node(node, nfa, start_state)
     elif isinstance(node, OneOrMoreNode):
-        return __convert_one_or_more_node(node, start_state)
+        return __convert_one_or_more_node(node, nfa, start_state)
     elif isinstance(node, ZeroOrOneNode):
-        return __convert_zero_or_one_node(node, start_state)
+        return __convert_zero_or_one_node(node, nfa, start_state)
     elif isinstance(node, SpecificQuantifierNode):
-        return __convert_specific_quantifier_node(node, start_state)
+        return __convert_specific_quantifier_node(node, nfa, start_state)
     elif isinstance(node, GroupNode):
-        return __convert_group_node(node, start_state)
+        return __convert_group_node(node, nfa, start_state)
     elif isinstance(node, EscapedCharacterNode):
-        return __convert_escaped_character_node(node, start_state)
+        return __convert_escaped_character_node(node, nfa, start_state)
     else:
         raise Exception(f"Unknown node type: {node}")
 
-def __convert_literal_node(node: LiteralNode, start_state: NFAState) -> NFAState:
-    end_state = NFAState()
-    start_state._add_transition(node.value, end_state)
+def __convert_literal_node(node: LiteralNode, nfa: NFA, start_state: int) -> int:
+    end_state = nfa._add_state()
+    nfa._add_transition(start_state, ord(node.value), ord(node.value), end_state)
     return end_state
 
-def __convert_concatenation_node(node: ConcatenationNode, start_state: NFAState) -> NFAState:
+def __convert_concatenation_node(node: ConcatenationNode, nfa: NFA, start_state: int) -> int:
     current_state = start_state
     for subnode in node.nodes:
-        current_state = __convert_node(subnode, current_state)
+        current_state = __convert_node(subnode, nfa, current_state)
     return current_state
 
-def __convert_alternation_node(node: AlternationNode, start_state: NFAState) -> NFAState:
-    end_state = NFAState()
+def __convert_alternation_node(node: AlternationNode, nfa: NFA, start_state: int) -> int:
+    end_state = nfa._add_state()
     for subnode in node.nodes:
-        branch_state = __convert_node(subnode, start_state)
-        branch_state._add_epsilon_transition(end_state)
+        branch_state = __convert_node(subnode, nfa, start_state)
+        nfa._add_epsilon_transition(branch_state, end_state)
     return end_state
 
-def __convert_range_node(node: RangeNode, start_state: NFAState) -> NFAState:	
-    end_state = NFAState()
-    start, end = node.start, node.end
-    if start == RangeNode.WILDCARD and end == RangeNode.WILDCARD:
-        for char in range(256):
-            start_state._add_transition(chr(char), end_state)
-    else:
-        for char in range(ord(start), ord(end) + 1):
-            start_state._add_transition(chr(char), end_state)
-    return end_state
+def __range_intervals(node: RangeNode) -> tuple[Interval, ...]:
+    if node.is_wildcard:
+        return WILDCARD
+    return ((ord(node.start), ord(node.end)),)
 
-def __convert_class_node(node: ClassNode, start_state: NFAState) -> NFAState:
-    end_state = NFAState()
-    for range_node in node.ranges:
-        __convert_range_node(range_node, start_state)._add_epsilon_transition(end_state)
+def __add_intervals(intervals: tuple[Interval, ...], nfa: NFA, start_state: int) -> int:
+    end_state = nfa._add_state()
+    for start, end in intervals:
+        nfa._add_transition(start_state, start, end, end_state)
     return end_state
 
-def __convert_zero_or_more_node(node: ZeroOrMoreNode, start_state: NFAState) -> NFAState:
-    loop_state = NFAState()
-    end_state = NFAState()
-    start_state._add_epsilon_transition(loop_state)
-    loop_state._add_epsilon_transition(end_state)
-    __convert_node(node.node, loop_state)._add_epsilon_transition(loop_state)
+def __convert_range_node(node: RangeNode, nfa: NFA, start_state: int) -> int:
+    return __add_intervals(normalize(__range_intervals(node)), nfa, start_state)
+
+def __convert_class_node(node: ClassNode, nfa: NFA, start_state: int) -> int:
+    intervals = normalize(interval for range_node in node.ranges for interval in __range_intervals(range_node))
+    return __add_intervals(intervals, nfa, start_state)
+
+def __convert_zero_or_more_node(node: ZeroOrMoreNode, nfa: NFA, start_state: int) -> int:
+    loop_state = nfa._add_state()
+    end_state = nfa._add_state()
+    nfa._add_epsilon_transition(start_state, loop_state)
+    nfa._add_epsilon_transition(loop_state, end_state)
+    nfa._add_epsilon_transition(__convert_node(node.node, nfa, loop_state), loop_state)
     return end_state
 
-def __convert_one_or_more_node(node: OneOrMoreNode, start_state: NFAState) -> NFAState:
-    repeat_state = NFAState()
-    start_state._add_epsilon_transition(repeat_state)
-    end_state = __convert_node(node.node, repeat_state)
+def __convert_one_or_more_node(node: OneOrMoreNode, nfa: NFA, start_state: int) -> int:
+    repeat_state = nfa._add_state()
+    nfa._add_epsilon_transition(start_state, repeat_state)
+    end_state = __convert_node(node.node, nfa, repeat_state)
 
     # Ensure loop back for one or more occurrences
-    end_state._add_epsilon_transition(repeat_state)
+    nfa._add_epsilon_transition(end_state, repeat_state)
 
     # Final state to mark the acceptance of the input
-    final_state = NFAState()
-    end_state._add_epsilon_transition(final_state)
+    final_state = nfa._add_state()
+    nfa._add_epsilon_transition(end_state, final_state)
     return final_state
 
-def __convert_specific_quantifier_node(node: SpecificQuantifierNode, start_state: NFAState) -> NFAState:
+def __convert_specific_quantifier_node(node: SpecificQuantifierNode, nfa: NFA, start_state: int) -> int:
     if node.max != None and node.min > node.max:
         raise Exception("SpecificQuantifierNode min must be less than or equal to max")
-    
+
+    # The body is converted once, every repetition splices a copy of it in by shifting its state ids,
+    # so large counts never walk the AST again
+    fragment = NFA()
+    fragment._add_state()
+    fragment_end = __convert_node(node.node, fragment, 0)
+
+    if fragment.n_states == 2 and fragment_end == 1 and not fragment.epsilon_transitions[0]:
+        # A single character (class): every repetition is one new state reached by the same intervals
+        intervals = [(start, end) for start, end, _ in fragment.transitions[0]]
+
+        def repeat(state: int) -> int:
+            next_state = nfa._add_state()
+            nfa.transitions[state] += [(start, end, next_state) for start, end in intervals]
+            return next_state
+    else:
+        def repeat(state: int) -> int:
+            offset = nfa._splice(fragment, state)
+            return fragment_end + offset if fragment_end != 0 else state
+
     # Create the required 'min' repetitions
     current_state = start_state
     for _ in range(node.min):
-        current_state = __convert_node(node.node, current_state)
+        current_state = repeat(current_state)
 
-    end_state = NFAState()
+    if node.max == node.min:
+        return current_state
 
+    end_state = nfa._add_state()
     if node.max == None:
-        optional_state = current_state
-        optional_state._add_epsilon_transition(end_state)  # Optional jump to the end
-        optional_state = __convert_node(node.node, optional_state)
-        optional_state._add_epsilon_transition(end_state)
+        # Any number of further repetitions
+        loop_state = nfa._add_state()
+        nfa._add_epsilon_transition(current_state, loop_state)
+        nfa._add_epsilon_transition(loop_state, end_state)
+        nfa._add_epsilon_transition(repeat(loop_state), loop_state)
     else:
         # For the remaining up to 'max - min', create optional states
-        optional_state = current_state
         for _ in range(node.max - node.min):
-            optional_state._add_epsilon_transition(end_state)  # Optional jump to the end
-            optional_state = __convert_node(node.node, optional_state)  # Next repetition
+            nfa._add_epsilon_transition(current_state, end_state)  # Optional jump to the end
+            current_state = repeat(current_state)  # Next repetition
 
-        optional_state._add_epsilon_transition(end_state)  # Connect the last optional state to the end
+        nfa._add_epsilon_transition(current_state, end_state)  # Connect the last optional state to the end
 
     return end_state
 
-def __convert_group_node(node: GroupNode, start_state: NFAState) -> NFAState:
-    return __convert_node(node.node, start_state)
+def __convert_group_node(node: GroupNode, nfa: NFA, start_state: int) -> int:
+    return __convert_node(node.node, nfa, start_state)
 
-def __convert_zero_or_one_node(node: ZeroOrOneNode, start_state: NFAState) -> NFAState:
-    end_state = NFAState()
-    start_state._add_epsilon_transition(end_state)
-    __convert_node(node.node, start_state)._add_epsilon_transition(end_state)
+def __convert_zero_or_one_node(node: ZeroOrOneNode, nfa: NFA, start_state: int) -> int:
+    end_state = nfa._add_state()
+    nfa._add_epsilon_transition(start_state, end_state)
+    nfa._add_epsilon_transition(__convert_node(node.node, nfa, start_state), end_state)
     return end_state
 
-def __convert_escaped_character_node(node: EscapedCharacterNode, start_state: NFAState) -> NFAState:
-    end_state = NFAState()
-
+def __convert_escaped_character_node(node: EscapedCharacterNode, nfa: NFA, start_state: int) -> int:
     if node.value == 'd':  # Digit shorthand
-        for char in '0123456789':
-            start_state._add_transition(char, end_state)
+        return __add_intervals(DIGIT, nfa, start_state)
     elif node.value == 'w':  # Word character shorthand
-        for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_':
-            start_state._add_transition(char, end_state)
+        return __add_intervals(WORD, nfa, start_state)
     elif node.value == 's':  # Whitespace shorthand
-        for char in ' \t\n\r\f\v':
-            start_state._add_transition(char, end_state)
+        return __add_intervals(SPACE, nfa, start_state)
     else:
-        start_state._add_transition(node.value, end_state)
+        return __add_intervals(((ord(node.value), ord(node.value)),), nfa, start_state)
 
-    return end_state
-
-def ast_to_nfa(ast: ASTNode) -> NFAState:
-    start_state = NFAState()
-    end_state = __convert_node(ast, start_state)
-    end_state.is_final = True
-    return start_state
+def ast_to_nfa(ast: ASTNode) -> NFA:
+    nfa = NFA()
+    start_state = nfa._add_state()
+    end_state = __convert_node(ast, nfa, start_state)
+    nfa.is_final[end_state] = 1
+    return nfa._freeze()
 
 if __name__ == '__main__':
-    def parse(pattern: str) -> NFAState:
+    def parse(pattern: str) -> NFA:
         return ast_to_nfa(ASTParser(pattern).parse())
     
-    def match(compiled: NFAState, string: str) -> bool:
+    def match(compiled: NFA, string: str) -> bool:
         return compiled.match(string)
     
-    def log(pattern: str, compiled: NFAState) -> None:
-        print(f"Pattern '{pattern}' compiled to NFA:\n{compiled.to_dot()}")
+    def log(pattern: str, compiled: NFA) -> None:
+        print(f"Pattern '{pattern}' compiled to NFA with {compiled.n_states} states:\n{compiled.to_dot()}")
 
     test_regex(parse, match, log)
-        
\ No newline at end of file
+
+    union, offsets = NFA.union([parse('ab'), parse('[0-9]+')])
+    assert offsets == [1, 1 + parse('ab').n_states]
+    assert union.match('ab') and union.match('42') and not union.match('a1')
+    print("Test passed for the union of NFAs.")
+
+    nfa = parse('(a*)*b')
+    closures = nfa.epsilon_closures()
+    assert all(state in closures[state] for state in range(nfa.n_states))
+    assert closures[0] == nfa.epsilon_closure([0]) and len(closures[0]) > 1
+    assert nfa.epsilon_closure(range(nfa.n_states)) == frozenset(range(nfa.n_states))
+    print("Test passed for epsilon closures.")
+
+    # Counted repetitions are spliced copies of the body, {n} repeats exactly n times and {n,} at least n times
+    for pattern, matching, not_matching in [
+        ('a{3}', ['aaa'], ['aa', 'aaaa']),
+        ('a{2,}', ['aa', 'aaaaaaa'], ['a', '']),
+        ('(ab|c){2,3}', ['abc', 'cc', 'ababab', 'cabc'], ['ab', 'abababab']),
+        ('(a*b){0,2}', ['', 'b', 'aabab'], ['a', 'bbb']),
+        ('x(a?){3}y', ['xy', 'xaaay'], ['x', 'xaaaay']),
+        ('\\w{1,1000}', ['a' * 1000, '_9'], ['', 'a' * 1001]),
+    ]:
+        compiled = parse(pattern)
+        assert all(compiled.match(string) for string in matching) and not any(compiled.match(string) for string in not_matching), f"Test failed for '{pattern}'"
+    assert parse('[a-z]{5,500}').n_states == 5 + 495 + 2
+    print("Test passed for counted repetitions.")
@@ -0,0 +1,223 @@
+"""
+Rewrites the AST of a pattern into an equivalent one that becomes a smaller NFA.
+
+- Groups are dropped, nested concatenations and alternations are flattened.
+- Quantifiers of quantifiers are collapsed, e.g. `(x*)*` and `(x+)?` become `x*`.
+- Duplicate branches of an alternation are dropped and the branches are factored into a trie:
+  `foo|foobar|fox` becomes `fo(o(bar)?|x)` and `abc|xbc` becomes `[ax]bc`.
+- Branches that are single characters are folded into one class, `a|b|\\d` becomes `[ab0-9]`.
+
+Every engine matches leftmost-longest (or the whole string), so the order of the branches of an alternation never matters.
+"""
+
+from src.ast import ASTNode, ASTParser, AlternationNode, ConcatenationNode, LiteralNode, RangeNode, ClassNode, ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode, SpecificQuantifierNode, GroupNode, EscapedCharacterNode
+from src.charset import DIGIT, SPACE, WORD, Interval
+from src.stats import CompileStats, stage
+from src.token import Tokenizer
+
+
+# (key, node) pairs, the key identifies the node for comparisons
+Sequence = list[tuple[str, ASTNode]]
+
+
+def __key(node: ASTNode) -> str:
+    # The nodes define equality but are not hashable, their representation identifies them just as well
+    return repr(node)
+
+def __ranges(intervals: tuple[Interval, ...]) -> list[RangeNode]:
+    return [RangeNode(chr(start), chr(end)) for start, end in intervals]
+
+def __character_ranges(node: ASTNode) -> list[RangeNode] | None:
+    """The ranges of a node that matches exactly one character, None for every other node."""
+    if isinstance(node, LiteralNode):
+        return [RangeNode(node.value, node.value)]
+    elif isinstance(node, RangeNode):
+        return [node]
+    elif isinstance(node, ClassNode):
+        return node.ranges
+    elif isinstance(node, EscapedCharacterNode):
+        shorthands = {'d': DIGIT, 'w': WORD, 's': SPACE}
+        return __ranges(shorthands[node.value]) if node.value in shorthands else [RangeNode(node.value, node.value)]
+    return None
+
+def __bounds(node: ASTNode) -> tuple[int, int | None] | None:
+    if isinstance(node, ZeroOrMoreNode):
+        return 0, None
+    elif isinstance(node, OneOrMoreNode):
+        return 1, None
+    elif isinstance(node, ZeroOrOneNode):
+        return 0, 1
+    return None
+
+def __repeat(node: ASTNode, min: int, max: int | None) -> ASTNode:
+    """`node` repeated min to max times, collapsed with a `*`, `+` or `?` it is made of."""
+    if max == 0:
+        return SpecificQuantifierNode(node, 0, 0)
+    inner = __bounds(node)
+    if inner is not None:
+        inner_min, inner_max = inner
+        if inner_max is None:
+            # Repetitions of x* or x+ can be any number of x from min * inner_min on
+            min, max = min * inner_min, None
+        else:
+            # Repetitions of x? can be any number of x up to max
+            min = 0
+        node = node.node
+
+    if (min, max) == (1, 1):
+        return node
+    elif (min, max) == (0, None):
+        return ZeroOrMoreNode(node)
+    elif (min, max) == (1, None):
+        return OneOrMoreNode(node)
+    elif (min, max) == (0, 1):
+        return ZeroOrOneNode(node)
+    return SpecificQuantifierNode(node, min, max)
+
+def __concatenate(nodes: list[ASTNode | None]) -> ASTNode | None:
+    # None stands for the empty string
+    flat: list[ASTNode] = []
+    for node in nodes:
+        if isinstance(node, ConcatenationNode):
+            flat.extend(node.nodes)
+        elif node is not None:
+            flat.append(node)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else ConcatenationNode(flat)
+
+def __alternate(branches: list[ASTNode]) -> ASTNode:
+    # Single characters are folded into one class, in place of the first of them
+    folded: list[ASTNode] = []
+    ranges: list[RangeNode] = []
+    for branch in branches:
+        character_ranges = __character_ranges(branch)
+        if character_ranges is None:
+            folded.append(branch)
+            continue
+        if not ranges:
+            folded.append(branch)
+        ranges.extend(character_ranges)
+    if len(folded) < len(branches):
+        index = next(i for i, branch in enumerate(folded) if __character_ranges(branch) is not None)
+        folded[index] = ClassNode(list({(range_node.start, range_node.end): range_node for range_node in ranges}.values()))
+    return folded[0] if len(folded) == 1 else AlternationNode(folded)
+
+def __common_suffix(sequences: list[Sequence]) -> int:
+    length = 0
+    shortest = min(len(sequence) for sequence in sequences)
+    while length < shortest and all(sequence[-1 - length][0] == sequences[0][-1 - length][0] for sequence in sequences):
+        length += 1
+    return length
+
+def __factor(sequences: list[Sequence]) -> ASTNode | None:
+    """
+    The alternation of the distinct sequences with shared prefixes and suffixes factored out, None if it only matches the empty string.
+    Sequences stay distinct when the same first units or the same suffix are removed from all of them.
+    """
+    is_optional = any(not sequence for sequence in sequences)
+    sequences = [sequence for sequence in sequences if sequence]
+    if not sequences:
+        return None
+
+    groups: dict[str, list[Sequence]] = {}
+    for sequence in sequences:
+        groups.setdefault(sequence[0][0], []).append(sequence)
+
+    if len(sequences) == 1:
+        node = __concatenate([node for _, node in sequences[0]])
+    elif len(groups) == 1:
+        # Every branch starts with the same unit
+        node = __concatenate([sequences[0][0][1], __factor([sequence[1:] for sequence in sequences])])
+    elif suffix := __common_suffix(sequences):
+        node = __concatenate([__factor([sequence[:-suffix] for sequence in sequences])] + [node for _, node in sequences[0][-suffix:]])
+    else:
+        node = __alternate([__factor(group) for group in groups.values()])
+    return __repeat(node, 0, 1) if is_optional else node
+
+def __sequence(node: ASTNode) -> Sequence:
+    return [(__key(unit), unit) for unit in (node.nodes if isinstance(node, ConcatenationNode) else [node])]
+
+def optimize(node: ASTNode) -> ASTNode:
+    if isinstance(node, GroupNode):
+        return optimize(node.node)
+    elif isinstance(node, ConcatenationNode):
+        return __concatenate([optimize(subnode) for subnode in node.nodes]) or ConcatenationNode([])
+    elif isinstance(node, AlternationNode):
+        branches: list[ASTNode] = []
+        for subnode in node.nodes:
+            subnode = optimize(subnode)
+            branches.extend(subnode.nodes if isinstance(subnode, AlternationNode) else [subnode])
+        sequences = {tuple(key for key, _ in sequence): sequence for sequence in map(__sequence, branches)}
+        return __factor(list(sequences.values())) or ConcatenationNode([])
+    elif isinstance(node, (ZeroOrMoreNode, OneOrMoreNode, ZeroOrOneNode)):
+        return __repeat(optimize(node.node), *__bounds(node))
+    elif isinstance(node, SpecificQuantifierNode):
+        return __repeat(optimize(node.node), node.min, node.max)
+    elif isinstance(node, (LiteralNode, RangeNode, ClassNode, EscapedCharacterNode)):
+        return node
+    else:
+        raise Exception(f"Unknown node type: {node}")
+
+def parse_unoptimized(pattern: str, stats: CompileStats | None = None) -> ASTNode:
+    """The AST of pattern as the parser returns it. The tokens are timed separately, but the pattern is only tokenized once."""
+    with stage(stats, 'tokenize'):
+        tokens = list(Tokenizer.tokenize(pattern))
+    if stats is not None:
+        stats.counts["tokens"] = len(tokens)
+    with stage(stats, 'parse'):
+        return ASTParser(pattern, tokens).parse()
+
+def parse_pattern(pattern: str, stats: CompileStats | None = None, parsed: ASTNode | None = None) -> ASTNode:
+    """The optimized AST of pattern, ready for `ast_to_nfa`. parsed is the AST of `parse_unoptimized` if the caller already has it."""
+    if parsed is None:
+        parsed = parse_unoptimized(pattern, stats)
+    with stage(stats, 'optimize'):
+        return optimize(parsed)
+
+
+if __name__ == '__main__':
+    import itertools
+    import re
+    from src.nfa import ast_to_nfa
+    from src.test import REGEX_TEST_CASES
+
+    def parse(pattern: str) -> ASTNode:
+        return ASTParser(pattern).parse()
+
+    expected_rewrites = {
+        '((ab))': 'ab',
+        'a|b|c': '[abc]',
+        'a|\\d|b': '[a0-9b]',
+        '(x*)*': 'x*',
+        '(x+)?': 'x*',
+        '(x?)+': 'x*',
+        '((x+)+)+': 'x+',
+        '(x?){2,3}': 'x{0,3}',
+        '(x+){2,3}': 'x{2,}',
+        'foo|foobar|fox': 'fo(o(bar)?|x)',
+        'abc|xbc': '[ax]bc',
+        'ab|ab|ac': 'a[bc]',
+        'a(b|c)d|abd': 'a[bc]d',
+    }
+    for pattern, expected in expected_rewrites.items():
+        optimized = optimize(parse(pattern))
+        assert str(optimized) == str(optimize(parse(expected))) and optimized == optimize(optimized), f"Test failed for '{pattern}'. Expected {expected}, but got {optimized}"
+    print(f"Test passed for {len(expected_rewrites)} rewrites.")
+
+    # The optimized AST matches exactly the same strings, with at most as many NFA states
+    patterns = [case["pattern"] for case in REGEX_TEST_CASES] + list(expected_rewrites) + ['(a|ab)(c|bcd)?d*', '(ab|a)(b|c)?', '((a|b)*|c)+d', 'a{0,0}b|ab']
+    for pattern in patterns:
+        original, optimized = ast_to_nfa(parse(pattern)), ast_to_nfa(optimize(parse(pattern)))
+        assert optimized.n_states <= original.n_states, f"Test failed for '{pattern}': {optimized.n_states} > {original.n_states} states"
+        alphabet = sorted({character for character in pattern if character.isalnum()} | {'-', '@', '.'})[:6]
+        for length in range(5):
+            for string in map(''.join, itertools.product(alphabet, repeat=length)):
+                expected = re.fullmatch(pattern, string) is not None
+                assert optimized.match(string) == expected, f"Test failed for '{pattern}' and '{string}'"
+    print(f"Test passed for {len(patterns)} equivalent patterns.")
+
+    words = ['for', 'foreach', 'format', 'from', 'function', 'fun', 'future', 'false', 'final', 'finally']
+    original, optimized = ast_to_nfa(parse('|'.join(words))), ast_to_nfa(optimize(parse('|'.join(words))))
+    assert all(optimized.match(word) for word in words) and not optimized.match('fo')
+    print(f"Test passed for a keyword list, {original.n_states} NFA states reduced to {optimized.n_states}.")
@@ -0,0 +1,139 @@
+import threading
+from array import array
+from src.charset import Text, as_symbols
+from src.nfa import NFA, ast_to_nfa
+from src.ast import ASTNode
+from src.optimize import parse_pattern
+from src.stats import CompileStats, stage
+from src.test import test_regex
+
+
+class SparseSet:
+    """
+    A set of integers in [0, capacity) with O(1) add, membership test and clear.
+    Both arrays are allocated once, clearing the set just resets its size.
+    """
+
+    __slots__ = ('dense', 'sparse', 'size')
+
+    def __init__(self, capacity: int) -> None:
+        self.dense = array('i', [0]) * capacity
+        self.sparse = array('i', [0]) * capacity
+        self.size = 0
+
+    def add(self, value: int) -> bool:
+        if value in self:
+            return False
+        self.dense[self.size] = value
+        self.sparse[value] = self.size
+        self.size += 1
+        return True
+
+    def clear(self) -> None:
+        self.size = 0
+
+    def __contains__(self, value: int) -> bool:
+        index = self.sparse[value]
+        return index < self.size and self.dense[index] == value
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return iter(self.dense[:self.size])
+
+
+class PikeVM:
+    """
+    Simulates the NFA by advancing the set of all active states one character at a time (Thompson's construction).
+
+    Every state is visited at most once per character, so matching takes O(len(nfa) * len(string)) time
+    and, unlike a backtracking matcher, never recurses. The two state sets are allocated once per thread
+    and reused by every match of that thread.
+    """
+
+    def __init__(self, nfa: NFA) -> None:
+        # The NFA states are already numbered, the start state is 0
+        self.n_states = nfa.n_states
+        self.start = 0
+        self.is_final = bytes(nfa.is_final)
+        self.epsilon_transitions = nfa.epsilon_transitions
+        self.transitions = nfa.transitions
+        self.__local = threading.local()
+
+    def _add_closure(self, active: SparseSet, state: int, stack: list[int]) -> None:
+        epsilon_transitions = self.epsilon_transitions
+        if not active.add(state):
+            return
+        stack.append(state)
+        while stack:
+            for next_state in epsilon_transitions[stack.pop()]:
+                if active.add(next_state):
+                    stack.append(next_state)
+
+    def match(self, string: Text) -> bool:
+        transitions = self.transitions
+        codepoints = map(ord, string) if isinstance(string, str) else as_symbols(string)
+        sets = getattr(self.__local, 'sets', None)
+        if sets is None:
+            sets = self.__local.sets = (SparseSet(self.n_states), SparseSet(self.n_states))
+        current, following = sets
+        current.clear()
+        stack: list[int] = []
+        self._add_closure(current, self.start, stack)
+
+        for codepoint in codepoints:
+            if not current.size:
+                return False
+
+            following.clear()
+            for state in current:
+                for start, end, next_state in transitions[state]:
+                    if start <= codepoint <= end:
+                        self._add_closure(following, next_state, stack)
+            current, following = following, current
+
+        return any(self.is_final[state] for state in current)
+
+
+def compile(pattern: str, stats: CompileStats | None = None, ast: ASTNode | None = None) -> PikeVM:
+    ast = parse_pattern(pattern, stats) if ast is None else ast
+    with stage(stats, 'nfa'):
+        nfa = ast_to_nfa(ast)
+    if stats is not None:
+        stats.record_nfa(nfa)
+    return PikeVM(nfa)
+
+if __name__ == '__main__':
+    import time
+
+    def parse(pattern: str) -> PikeVM:
+        return compile(pattern)
+
+    def match(compiled: PikeVM, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: PikeVM) -> None:
+        print(f"Pattern '{pattern}' compiled to {compiled.n_states} NFA states")
+
+    test_regex(parse, match, log)
+    test_regex(parse, lambda compiled, string: compiled.match(string.encode('latin-1')), lambda pattern, compiled: None)
+
+    # Exponential for a backtracker and far deeper than the recursion limit, linear for the VM
+    start_time = time.time()
+    compiled = compile('(a*)*b')
+    assert not compiled.match('a' * 5000)
+    assert compiled.match('a' * 5000 + 'b')
+    # The reused state sets start out empty for every string
+    assert not compiled.match('a' * 10) and compiled.match('b') and not compiled.match('') and not compiled.match('ba')
+    print(f"Matched pathological pattern in {time.time() - start_time:.3f}s.")
+
+    # Threads sharing one VM each get their own state sets
+    from concurrent.futures import ThreadPoolExecutor
+    compiled = compile('(a|b)*a(a|b){6,6}')
+    strings = [''.join('ab'[(i >> bit) & 1] for bit in range(12)) for i in range(4096)]
+    expected = [string[-7] == 'a' for string in strings]
+    with ThreadPoolExecutor(8) as executor:
+        for _ in range(5):
+            assert list(executor.map(compiled.match, strings)) == expected
+    print("Test passed for concurrent matches.")
@@ -1,23 +1,314 @@
-from src.dfa import compile as dfa_compile, DFAState
+from typing import Iterable, Iterator
+from src.aho import SPECIAL_CHARACTERS, AhoCorasick, compile as aho_compile, pattern_keywords
+from src.ast import ASTNode
+from src.charset import Text
+from src.cache import CacheInfo, CompileCache
+from src.codegen import GeneratedDFA, ModuleCache, compile as codegen_compile
+from src.dense import DenseDFA, bool_array, compile as dense_compile
+from src.derivative import LazyDerivativeDFA, compile as derivative_compile, compile_lazy as derivative_compile_lazy
+from src.dfa import Budget, BudgetExceeded, compile as dfa_compile, DFAState
+from src.glushkov import Glushkov, MAX_POSITIONS, compile as glushkov_compile
+from src.lazy import LazyDFA, compile as lazy_compile
+from src.literals import Prefilter, extract_literals
+from src.optimize import parse_pattern, parse_unoptimized
+from src.pike import PikeVM, compile as pike_compile
+from src.search import LazySearcher, Match, Searcher
+from src.serialize import DiskCache
+from src.stats import CompileStats, report, stage
+from src.stream import LazyMatcher, Matcher
 
-def compile(pattern: str) -> DFAState:
-    return dfa_compile(pattern)
 
-def match(pattern: str, string: str) -> bool:
+Automaton = DFAState | DenseDFA | LazyDFA | LazyDerivativeDFA | PikeVM | AhoCorasick | Glushkov | GeneratedDFA
+
+# Used by engine='auto' if no budget is given: DFAs beyond this size fall back to the Glushkov engine or the Pike VM
+DEFAULT_BUDGET = Budget(max_states=10_000, max_bytes=64 << 20)
+
+
+class Regex:
+    """
+    A compiled pattern. `match` runs the automaton of the chosen engine on the whole string,
+    `search`, `finditer` and `findall` look for leftmost-longest matches anywhere in the string.
+    `stats` holds the timings and automaton sizes of the compilation.
+
+    DFAs that are built on demand (for searching, `match_many` and `matcher`) are held to the same `budget`
+    and raise `BudgetExceeded` instead of growing without bounds, unless `fallback` is set: then they are replaced
+    by lazy DFAs over the NFA, like for the engines that never build a DFA ('lazy', 'pike', 'glushkov', 'lazy_derivative').
+    """
+
+    def __init__(self, pattern: str, engine: str, automaton: Automaton, stats: CompileStats | None = None, budget: Budget | None = None, fallback: bool = False, ast: ASTNode | None = None, keywords: list[str] | None = None) -> None:
+        self.pattern = pattern
+        self.engine = engine
+        self.automaton = automaton
+        self.budget = budget
+        self.fallback = fallback
+        self.stats = stats if stats is not None else CompileStats(pattern, engine)
+        # The AST the automaton was compiled from and the keywords of an alternation of literals, kept for the automata built on demand
+        self.__ast = ast
+        self.__keywords = keywords
+        with self.stats.stage('literals'):
+            if isinstance(automaton, AhoCorasick):
+                self.prefilter = automaton.prefilter
+            else:
+                self.prefilter = Prefilter(extract_literals(self.__parsed()))
+        self.__searcher: Searcher | AhoCorasick | None = None
+        self.__dense: DenseDFA | None = None
+        self.__lazy: LazyDFA | None = None
+        # Whether a full DFA of the pattern fits into the budget, None until one was needed
+        if isinstance(automaton, (DFAState, DenseDFA, GeneratedDFA)):
+            self.__has_dfa: bool | None = True
+        else:
+            self.__has_dfa = None if fallback and self.stats.fallback is None else False
+
+    def __parsed(self) -> ASTNode:
+        if self.__ast is None:
+            self.__ast = parse_pattern(self.pattern)
+        return self.__ast
+
+    @property
+    def searcher(self) -> Searcher | AhoCorasick:
+        # Only built once the pattern is actually used for searching, alternations of literals are searched with Aho-Corasick
+        if self.__searcher is None:
+            if isinstance(self.automaton, AhoCorasick):
+                self.__searcher = self.automaton
+            elif self.__keywords is not None and len(self.__keywords) > 1:
+                self.__searcher = AhoCorasick(self.__keywords)
+            elif self.__has_dfa is False:
+                self.__searcher = LazySearcher(self.__parsed())
+            else:
+                try:
+                    self.__searcher = Searcher(self.__parsed(), self.budget)
+                except BudgetExceeded:
+                    if not self.fallback:
+                        raise
+                    self.__searcher = LazySearcher(self.__parsed())
+        return self.__searcher
+
+    @property
+    def dense(self) -> DenseDFA | None:
+        """The table-driven DFA, reused from the automaton when possible. None if the pattern is matched without a DFA."""
+        if self.__dense is None and self.__has_dfa is not False:
+            if isinstance(self.automaton, DenseDFA):
+                self.__dense = self.automaton
+            elif isinstance(self.automaton, DFAState):
+                self.__dense = DenseDFA.from_dfa(self.automaton)
+            else:
+                try:
+                    self.__dense = DenseDFA.from_dfa(dfa_compile(self.pattern, budget=self.budget, ast=self.__parsed()))
+                except BudgetExceeded:
+                    if not self.fallback:
+                        raise
+                    self.__has_dfa = False
+        return self.__dense
+
+    @property
+    def lazy(self) -> LazyDFA:
+        """A lazy DFA over the NFA, for streaming patterns that are matched without a DFA."""
+        if self.__lazy is None:
+            self.__lazy = self.automaton if isinstance(self.automaton, LazyDFA) else lazy_compile(self.pattern, ast=self.__parsed())
+        return self.__lazy
+
+    def match(self, string: Text) -> bool:
+        # Strings without the required literals are rejected, and a pure literal pattern never runs the automaton
+        if self.prefilter.is_useful:
+            decided = self.prefilter.match(string)
+            if decided is not None:
+                return decided
+        return self.automaton.match(string)
+
+    def match_many(self, strings: Iterable[Text]) -> "numpy.ndarray | list[bool]":
+        if isinstance(self.automaton, AhoCorasick):
+            return self.automaton.match_many(strings)
+        dense = self.dense
+        if dense is None:
+            return bool_array([self.match(string) for string in strings])
+        return dense.match_many(strings)
+
+    def matcher(self) -> Matcher | LazyMatcher:
+        dense = self.dense
+        return Matcher(dense) if dense is not None else LazyMatcher(self.lazy)
+
+    def search(self, string: Text, pos: int = 0, endpos: int | None = None) -> Match | None:
+        return self.searcher.search(string, pos, endpos)
+
+    def finditer(self, string: Text, pos: int = 0, endpos: int | None = None) -> Iterator[Match]:
+        return self.searcher.finditer(string, pos, endpos)
+
+    def findall(self, string: Text, pos: int = 0, endpos: int | None = None) -> list[Text]:
+        return [match.group() for match in self.searcher.finditer(string, pos, endpos)]
+
+    def __repr__(self) -> str:
+        return f"Regex({repr(self.pattern)}, engine={repr(self.engine)})"
+
+
+__cache: CompileCache[Regex] = CompileCache(maxsize=512)
+__disk_cache: DiskCache | None = None
+__module_cache: ModuleCache | None = None
+
+def __build(pattern: str, minimize: bool, engine: str, budget: Budget | None) -> Regex:
+    stats = CompileStats(pattern, engine)
+    # With 'auto', DFAs that are needed later on are replaced by lazy DFAs if they do not fit into the budget either
+    fallback = engine == 'auto'
+    # The pattern is parsed at most once: the keyword check, the engines, the literal extraction and the searcher share the AST.
+    # Plain keyword lists are recognized without the parser
+    parsed = parse_unoptimized(pattern, stats) if engine != 'aho' and any(char in SPECIAL_CHARACTERS for char in pattern) else None
+    keywords = pattern_keywords(pattern, parsed) if engine != 'aho' else None
+    if engine == 'auto' and keywords is not None:
+        # Alternations of literals never need subset construction
+        engine = stats.engine = 'aho'
+    ast = parse_pattern(pattern, stats, parsed) if engine != 'aho' else None
+    if engine == 'auto':
+        # The dense DFA if it fits into the budget. Otherwise the bit-parallel position automaton for small patterns,
+        # and the linear-time Pike VM for the others
+        if budget is None:
+            budget = DEFAULT_BUDGET
+        try:
+            engine, automaton = 'dense', dense_compile(pattern, minimize, stats, budget, ast)
+        except BudgetExceeded as error:
+            stats.fallback = str(error)
+            try:
+                engine, automaton = 'glushkov', glushkov_compile(pattern, stats, MAX_POSITIONS, ast)
+            except BudgetExceeded:
+                engine, automaton = 'pike', pike_compile(pattern, stats, ast)
+        stats.engine = engine
+    elif engine == 'dfa':
+        automaton = dfa_compile(pattern, minimize, stats, budget, ast)
+    elif engine == 'dense' and __disk_cache is not None:
+        with stage(stats, 'disk_cache'):
+            automaton = __disk_cache.get_or_compile(pattern, minimize, budget, ast)
+        stats.record_dense(automaton)
+    elif engine == 'dense':
+        automaton = dense_compile(pattern, minimize, stats, budget, ast)
+    elif engine == 'lazy':
+        automaton = lazy_compile(pattern, stats=stats, ast=ast)
+    elif engine == 'pike':
+        automaton = pike_compile(pattern, stats, ast)
+    elif engine == 'aho':
+        automaton = aho_compile(pattern, stats, parsed)
+    elif engine == 'glushkov':
+        automaton = glushkov_compile(pattern, stats, ast=ast)
+    elif engine == 'derivative':
+        automaton = derivative_compile(pattern, minimize, stats, budget, ast)
+    elif engine == 'lazy_derivative':
+        automaton = derivative_compile_lazy(pattern, stats=stats, ast=ast)
+    elif engine == 'codegen' and __module_cache is not None:
+        with stage(stats, 'disk_cache'):
+            automaton = __module_cache.get_or_compile(pattern, minimize, budget, ast)
+        stats.record_codegen(automaton)
+    elif engine == 'codegen':
+        automaton = codegen_compile(pattern, minimize, stats, budget, ast)
+    else:
+        raise Exception(f"Unknown engine: {engine}")
+
+    regex = Regex(pattern, engine, automaton, stats, budget, fallback, ast, keywords)
+    stats.counts["memory_bytes"] = __memory_bytes(stats)
+    report(stats)
+    return regex
+
+def __memory_bytes(stats: CompileStats) -> int:
+    # Estimated size of the automaton the compiled pattern keeps, the lazy DFAs and the Pike VM keep the NFA or the pattern's terms
+    for name in ("dense_bytes", "codegen_bytes", "minimized_bytes", "dfa_bytes", "glushkov_bytes", "nfa_bytes", "derivative_bytes"):
+        if name in stats.counts:
+            return stats.counts[name]
+    return 0
+
+def compile(pattern: str, minimize: bool = True, engine: str = 'dfa', budget: Budget | None = None) -> Regex:
+    """
+    Compiles pattern with one of the engines 'dfa', 'dense', 'lazy', 'pike', 'aho', 'glushkov', 'derivative', 'lazy_derivative', 'codegen' or 'auto'.
+    'derivative' and 'lazy_derivative' build the DFA from Brzozowski derivatives of the pattern instead of an NFA.
+    'aho' only accepts alternations of literals (like `word1|word2|...`), 'auto' uses it for them.
+
+    `budget` limits the states, memory and time subset construction may use. The DFA engines raise `BudgetExceeded`
+    when it is exceeded. 'auto' builds the dense DFA within the budget (`DEFAULT_BUDGET` if none is given) and falls back
+    to the bit-parallel 'glushkov' engine for patterns with at most `MAX_POSITIONS` character positions, to the Pike VM otherwise.
+    The engine that was used is `Regex.engine`, and `Regex.stats.fallback` says why the DFA was abandoned.
+    """
+    return __cache.get_or_build((pattern, minimize, engine, budget), lambda: __build(pattern, minimize, engine, budget))
+
+def match(pattern: str, string: Text) -> bool:
     return compile(pattern).match(string)
 
+def match_many(pattern: str, strings: Iterable[Text]) -> "numpy.ndarray | list[bool]":
+    return compile(pattern).match_many(strings)
+
+def search(pattern: str, string: Text) -> Match | None:
+    return compile(pattern).search(string)
+
+def finditer(pattern: str, string: Text) -> Iterator[Match]:
+    return compile(pattern).finditer(string)
+
+def findall(pattern: str, string: Text) -> list[Text]:
+    return compile(pattern).findall(string)
+
+def cache_info() -> CacheInfo:
+    return __cache.info()
+
+def set_cache_size(maxsize: int) -> None:
+    __cache.resize(maxsize)
+
+def clear_cache() -> None:
+    __cache.clear()
+
+def set_disk_cache(directory: str | None) -> None:
+    """
+    Keeps the DFAs compiled with engine='dense' (as binary files) and engine='codegen' (as Python modules)
+    in the given directory across processes, None disables it.
+    """
+    global __disk_cache, __module_cache
+    __disk_cache = DiskCache(directory) if directory is not None else None
+    __module_cache = ModuleCache(directory) if directory is not None else None
+
 if __name__ == '__main__':
     print("Example usage:")
     print(f"{match('a(b|c)*d', 'abccbd')=}")
     print(f"{match('a(b|c)*d', 'abccbde')=}")
     print("It works!")
     print()
-    print("It is recommended to use the 'compile' function to compile the pattern once and then use the resulting DFAState to match multiple strings.")
+    print("It is recommended to use the 'compile' function to compile the pattern once and then use the resulting Regex to match multiple strings.")
     print("This is much faster than compiling the pattern every time a string is matched.")
+    print("Patterns passed to 'match' are compiled once and kept in a bounded LRU cache as well:")
+    print(f"{cache_info()=}")
     print()
     print("Example usage:")
     print("compiled = compile('a(b|c)*d')")
     compiled = compile('a(b|c)*d')
     print(f"{compiled.match('abccbd')=}")
-    print(f"{compiled.match('abccbde')=}")     
-    
\ No newline at end of file
+    print(f"{compiled.match('abccbde')=}")
+    print()
+    print("Searching for all leftmost-longest matches in a longer string:")
+    print(f"{compiled.search('xxabdxxacbd')=}")
+    print(f"{findall('[0-9]+', 'order 66, room 101 and 7')=}")
+    print()
+    print("Matching input that arrives in chunks:")
+    matcher = compiled.matcher()
+    for chunk in ['ab', 'cc', 'bd']:
+        matcher.feed(chunk)
+    print(f"{matcher.is_accepting=}")
+    print()
+    print("Matching many strings at once:")
+    print(f"{compile('[A-Z]{2,2}[0-9]{4,4}').match_many(['AB1234', 'A1234', b'XY0000'])=}")
+    print()
+    print("Falling back to the Pike VM when the DFA would outgrow its budget:")
+    guarded = compile('(a|b)*a(a|b){80,80}', engine='auto', budget=Budget(max_states=1000))
+    print(f"{guarded.engine=}, {guarded.stats.fallback=}")
+    print(f"{guarded.match('a' + 'b' * 80)=}")
+    print("Searching, batches and streaming then run on lazy DFAs over the NFA instead:")
+    print(f"{guarded.search('bb' + 'a' * 81 + 'c')=}")
+    print(f"{guarded.match_many(['a' + 'b' * 80, 'b' * 81])=}")
+    guarded_matcher = guarded.matcher()
+    for chunk in ['a', 'b' * 40, 'b' * 40]:
+        guarded_matcher.feed(chunk)
+    print(f"{guarded_matcher.is_accepting=}")
+    print()
+    print("Alternations of literals are compiled into an Aho-Corasick automaton:")
+    keywords = compile('error|warning|fatal|panic', engine='auto')
+    print(f"{keywords.engine=}, {keywords.automaton=}")
+    print(f"{keywords.findall('warning: disk almost full, then a fatal error')=}")
+    # Batches come back as the same type whichever automaton matched them
+    assert type(keywords.match_many(['error'])) is type(guarded.match_many(['a'])) is type(compiled.match_many(['ad']))
+    print()
+    print("Small patterns whose DFA does not fit are matched bit-parallel by their position automaton instead of the Pike VM:")
+    small = compile('(a|b)*a(a|b){16,16}', engine='auto')
+    print(f"{small.engine=}, {small.automaton=}")
+    print(f"{small.match('a' + 'b' * 16)=}")
+    print(f"{small.findall('a' + 'b' * 16 + 'c' + 'a' * 17)=}")
+    print(f"{compile('[a-z]+@[a-z]+', engine='auto').engine=}")
@@ -0,0 +1,85 @@
+from src.charset import Text
+from src.dense import DenseDFA
+from src.dfa import DFAState, minimize_dfa, nfa_to_dfa
+from src.nfa import NFA, ast_to_nfa
+from src.optimize import parse_pattern
+
+
+class RegexSet:
+    """
+    Matches a string against many patterns at once.
+
+    The NFAs of all patterns are joined under a single start state and determinized together,
+    each DFA state knows which patterns accept in it as a bitmask (bit i for `patterns[i]`).
+    Finding every matching pattern therefore takes a single pass over the string.
+    """
+
+    def __init__(self, patterns: list[str], minimize: bool = True) -> None:
+        self.patterns = list(patterns)
+
+        nfas = [ast_to_nfa(parse_pattern(pattern)) for pattern in self.patterns]
+        nfa, offsets = NFA.union(nfas)
+        pattern_of: dict[int, int] = {}
+        for i, (pattern_nfa, offset) in enumerate(zip(nfas, offsets)):
+            for final_state in pattern_nfa.final_states():
+                pattern_of[final_state + offset] = i
+
+        def mask_of(state: DFAState) -> int:
+            mask = 0
+            for nfa_state in state.nfa_states:
+                if nfa_state in pattern_of:
+                    mask |= 1 << pattern_of[nfa_state]
+            return mask
+
+        dfa = nfa_to_dfa(nfa)
+        if minimize:
+            dfa = minimize_dfa(dfa, key=mask_of)
+
+        self.dfa = DenseDFA.from_dfa(dfa)
+        # masks[state] are the patterns accepting in that state of the dense DFA, state 0 is the dead state
+        self.masks = [0] + [mask_of(state) for state in DenseDFA.number_states(dfa)]
+
+    def match_mask(self, string: Text) -> int:
+        dfa = self.dfa
+        table, n_classes = dfa.table, dfa.n_classes
+        state = dfa.start
+
+        for class_id in dfa.class_ids(string):
+            state = table[state * n_classes + class_id]
+            if state == DenseDFA.DEAD:
+                return 0
+
+        return self.masks[state]
+
+    def matches(self, string: Text) -> set[int]:
+        mask = self.match_mask(string)
+        return {i for i in range(len(self.patterns)) if mask >> i & 1}
+
+    def is_match(self, string: Text) -> bool:
+        return self.match_mask(string) != 0
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+
+if __name__ == '__main__':
+    from src.test import REGEX_TEST_CASES
+    from src.dfa import compile
+
+    patterns = [case["pattern"] for case in REGEX_TEST_CASES]
+    regex_set = RegexSet(patterns)
+    compiled = [compile(pattern) for pattern in patterns]
+
+    strings = {string for case in REGEX_TEST_CASES for string in case["matching"] + case["not_matching"]}
+    for string in sorted(strings):
+        expected = {i for i, dfa in enumerate(compiled) if dfa.match(string)}
+        actual = regex_set.matches(string)
+        assert actual == expected, f"Test failed for '{string}'. Expected {expected}, but got {actual}"
+    print(f"Test passed for {len(strings)} strings against {len(patterns)} patterns.")
+
+    regex_set = RegexSet(['[a-z]+', '[a-z]+\\d', 'ab+', '\\d+'])
+    assert regex_set.matches('abb') == {0, 2}
+    assert regex_set.match_mask('abc1') == 0b0010
+    assert regex_set.matches('!') == set() and not regex_set.is_match('!')
+    unminimized = RegexSet(regex_set.patterns, minimize=False)
+    print(f"Test passed for pattern masks, minimized from {unminimized.dfa.n_states} to {regex_set.dfa.n_states} states.")
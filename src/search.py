@@ -0,0 +1,392 @@
+from typing import Callable, Iterator
+from src.charset import Text, as_symbols
+from src.ast import ASTNode, ASTParser, ClassNode, ConcatenationNode, RangeNode, ZeroOrMoreNode
+from src.dense import DenseDFA
+from src.dfa import Budget, minimize_dfa, nfa_to_dfa
+from src.lazy import LazyDFA, LazyDFAState
+from src.literals import Prefilter, extract_literals
+from src.nfa import ast_to_nfa
+from src.optimize import optimize
+
+
+# Matches every code point, unlike the wildcard which only covers the first 256
+ANY_CHARACTER = ClassNode([RangeNode(chr(0), chr(0x10FFFF))])
+
+
+class Match:
+    def __init__(self, string: Text, start: int, end: int) -> None:
+        self.string = string
+        self.__start = start
+        self.__end = end
+
+    def start(self) -> int:
+        return self.__start
+
+    def end(self) -> int:
+        return self.__end
+
+    def span(self) -> tuple[int, int]:
+        return self.__start, self.__end
+
+    def group(self) -> Text:
+        return self.string[self.__start:self.__end]
+
+    def __repr__(self) -> str:
+        return f"Match(span={self.span()}, match={repr(self.group())})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Match) and self.string == other.string and self.span() == other.span()
+
+
+def _to_dense(ast: ASTNode, budget: Budget | None = None) -> DenseDFA:
+    return DenseDFA.from_dfa(minimize_dfa(nfa_to_dfa(ast_to_nfa(ast), budget=budget)))
+
+
+
+class _Trail:
+    """
+    The states forward scans went through by position, and the end of the longest match each of them still reached from there (-1 for none).
+    A later scan that arrives at a position in the same state stops, the rest of the text would play out the same way.
+    Scans start at increasing positions, so positions before the latest start are dropped once they make up most of the trail.
+    """
+
+    __slots__ = ('first', 'states', 'ends')
+
+    def __init__(self, first: int) -> None:
+        self.first = first
+        self.states: list = []
+        self.ends: list[int] = []
+
+    def record(self, start: int, states: list, is_final: Callable[[object], bool], end: int) -> int | None:
+        """Records a scan, states[k] being its state at start + k and end the longest match end it reached after them. Returns its longest match end."""
+        ends = [0] * len(states)
+        for k in range(len(states) - 1, -1, -1):
+            if end == -1 and is_final(states[k]):
+                end = start + k
+            ends[k] = end
+
+        index = start - self.first
+        if index < 0 or index > len(self.states):
+            self.first, self.states, self.ends = start, states, ends
+        else:
+            if index > 1024 and 2 * index > len(self.states):
+                del self.states[:index], self.ends[:index]
+                self.first, index = start, 0
+            # Replaces the positions the scan went through, and appends those beyond the end of the trail
+            self.states[index:index + len(states)] = states
+            self.ends[index:index + len(ends)] = ends
+        return end if end != -1 else None
+
+
+class _Classes:
+    """The class ids of a text for one dense DFA, translated in aligned blocks the first time a scan reads them."""
+
+    SHIFT = 12
+    SIZE = 1 << SHIFT
+
+    def __init__(self, dfa: DenseDFA, string: Text) -> None:
+        self.dfa = dfa
+        self.symbols = string if isinstance(string, str) else memoryview(string).cast('B')
+        self.blocks: dict[int, bytes | list[int]] = {}
+        self.lowest = 0
+
+    def block(self, position: int) -> bytes | list[int]:
+        index = position >> _Classes.SHIFT
+        block = self.blocks.get(index)
+        if block is None:
+            block = self.blocks[index] = self.dfa.translate(self.symbols[index << _Classes.SHIFT:(index + 1) << _Classes.SHIFT])
+        return block
+
+    def drop_before(self, position: int) -> None:
+        # Scans never go back, so blocks that end before position are not read again
+        index = position >> _Classes.SHIFT
+        while self.lowest < index:
+            self.blocks.pop(self.lowest, None)
+            self.lowest += 1
+
+
+class _DenseScan:
+    """The scans of one text with the DFAs of a `Searcher`."""
+
+    def __init__(self, searcher: "Searcher", string: Text, pos: int, endpos: int) -> None:
+        self.forward, self.unanchored = searcher.forward, searcher.unanchored
+        self.forward_classes, self.unanchored_classes = _Classes(self.forward, string), _Classes(self.unanchored, string)
+        self.endpos = endpos
+        self.trail = _Trail(pos)
+        forward = self.forward
+        # starters[class id] is 1 iff a match can start with a character of the class
+        self.starters = None if forward.accepting[forward.start] else bytes(
+            int(forward.table[forward.start * forward.n_classes + class_id] != DenseDFA.DEAD) for class_id in range(forward.n_classes)
+        ) + bytes(max(0, 256 - forward.n_classes))
+
+    def candidates(self, low: int, high: int) -> Iterator[int]:
+        """The positions in [low, high] where a match may start, most others are rejected by their first character."""
+        starters, classes = self.starters, self.forward_classes
+        if starters is None:
+            yield from range(low, high + 1)
+            return
+        position = low
+        while position < min(high + 1, self.endpos):
+            block, block_start = classes.block(position), position & -_Classes.SIZE
+            block_end = min(block_start + len(block), high + 1, self.endpos)
+            if isinstance(block, bytes):
+                flags = block[position - block_start:block_end - block_start].translate(starters)
+                offset = flags.find(1)
+                while offset != -1:
+                    yield position + offset
+                    offset = flags.find(1, offset + 1)
+            else:
+                for candidate in range(position, block_end):
+                    if starters[block[candidate - block_start]]:
+                        yield candidate
+            position = block_end
+
+    def first_end(self, pos: int) -> int | None:
+        dfa, classes, endpos = self.unanchored, self.unanchored_classes, self.endpos
+        table, n_classes, accepting = dfa.table, dfa.n_classes, dfa.accepting
+        classes.drop_before(pos)
+        state, position = dfa.start, pos
+        if accepting[state]:
+            return position
+        while position < endpos:
+            block, block_start = classes.block(position), position & -_Classes.SIZE
+            for class_id in block[position - block_start:endpos - block_start]:
+                state = table[state * n_classes + class_id]
+                position += 1
+                if accepting[state]:
+                    return position
+        return None
+
+    def longest_end(self, start: int) -> int | None:
+        dfa, classes, endpos, trail = self.forward, self.forward_classes, self.endpos, self.trail
+        table, n_classes, accepting = dfa.table, dfa.n_classes, dfa.accepting
+        classes.drop_before(start)
+        known_states, known_ends, first = trail.states, trail.ends, trail.first
+        states: list[int] = []
+        state, position, end, block_start, block = dfa.start, start, -1, 0, b''
+        while True:
+            index = position - first
+            if 0 <= index < len(known_states) and known_states[index] == state:
+                end = known_ends[index]
+                break
+            states.append(state)
+            if position == endpos:
+                break
+            if position - block_start >= len(block):
+                block, block_start = classes.block(position), position & -_Classes.SIZE
+            state = table[state * n_classes + block[position - block_start]]
+            position += 1
+            if state == DenseDFA.DEAD:
+                break
+        return trail.record(start, states, accepting.__getitem__, end)
+
+
+class _LazyScan:
+    """The scans of one text with the lazy DFAs of a `LazySearcher`."""
+
+    def __init__(self, searcher: "Searcher", string: Text, pos: int, endpos: int) -> None:
+        self.forward, self.unanchored = searcher.forward, searcher.unanchored
+        self.symbols = as_symbols(string)
+        self.endpos = endpos
+        self.trail = _Trail(pos)
+
+    def candidates(self, low: int, high: int) -> Iterator[int]:
+        return iter(range(low, high + 1))
+
+    def first_end(self, pos: int) -> int | None:
+        dfa, symbols = self.unanchored, self.symbols
+        state = dfa.start
+        for position in range(pos, self.endpos):
+            if state.is_final:
+                return position
+            state = dfa.step(state, symbols[position])
+        return self.endpos if state.is_final else None
+
+    def longest_end(self, start: int) -> int | None:
+        dfa, symbols, endpos, trail = self.forward, self.symbols, self.endpos, self.trail
+        known_states, known_ends, first = trail.states, trail.ends, trail.first
+        states: list[LazyDFAState] = []
+        state, position, end = dfa.start, start, -1
+        while True:
+            index = position - first
+            # States are compared by identity, states of a flushed cache are never found again
+            if 0 <= index < len(known_states) and known_states[index] is state:
+                end = known_ends[index]
+                break
+            states.append(state)
+            if position == endpos:
+                break
+            state = dfa.step(state, symbols[position])
+            position += 1
+            if state is dfa.dead:
+                break
+        return trail.record(start, states, lambda state: state.is_final, end)
+
+
+class Searcher:
+    """
+    Finds leftmost-longest matches of a pattern in linear time.
+
+    Two DFAs are built from the same AST:
+    - `unanchored` for `.*R` runs forward and stops at the first position where any match ends,
+      which rejects texts without a match in a single pass. The leftmost match starts at or before that position.
+    - `forward` for `R` runs from each candidate start up to that position to the end of its longest match.
+      The first candidate that has one is the leftmost start.
+    A scan stops as soon as the DFA is dead (minimization drops every state that can not reach an accepting one),
+    or when it reaches a position in the state an earlier scan was in there: that scan's result still holds.
+    So scans from neighbouring starts share their work, and `findall` stays linear even for patterns like `a|a[a-z]*b`.
+    The text is translated to class ids in blocks as the scans reach them, a match near the start never reads the rest.
+    Texts without the literals every match contains are skipped by the prefilter before any DFA runs,
+    and patterns that are a single literal are searched for with `find` alone.
+    Each DFA is built within `budget`, if one is given.
+    """
+
+    def __init__(self, ast: ASTNode, budget: Budget | None = None) -> None:
+        self.prefilter = Prefilter(extract_literals(ast))
+        ast = optimize(ast)
+        self.forward = self._automaton(ast, budget)
+        self.unanchored = self._automaton(ConcatenationNode([ZeroOrMoreNode(ANY_CHARACTER), ast]), budget)
+
+    def _automaton(self, ast: ASTNode, budget: Budget | None) -> DenseDFA:
+        return _to_dense(ast, budget)
+
+    def _scan(self, string: Text, pos: int, endpos: int) -> _DenseScan | _LazyScan:
+        return _DenseScan(self, string, pos, endpos)
+
+    def finditer(self, string: Text, pos: int = 0, endpos: int | None = None) -> Iterator[Match]:
+        length = len(string) if isinstance(string, str) else memoryview(string).nbytes
+        endpos = length if endpos is None else min(endpos, length)
+        if pos > endpos or not self.prefilter.may_contain_match(string, pos, endpos):
+            return
+        if self.prefilter.literals.exact:
+            literal_length = len(self.prefilter.literals.exact)
+            start = self.prefilter.find_literal(string, pos, endpos)
+            if start is not None:
+                while start != -1:
+                    yield Match(string, start, start + literal_length)
+                    start = self.prefilter.find_literal(string, start + literal_length, endpos)
+                return
+
+        scan = self._scan(string, pos, endpos)
+        position = pos
+        while position <= endpos:
+            first_end = scan.first_end(position)
+            if first_end is None:
+                return
+            # Some match ends at first_end, so the leftmost match starts at or before it
+            end = None
+            for start in scan.candidates(position, first_end):
+                end = scan.longest_end(start)
+                if end is not None:
+                    break
+            assert end is not None, "A match ends at first_end, so one of the candidates starts it"
+            yield Match(string, start, end)
+            # After an empty match the next one has to start at least one character later
+            position = end if end > start else end + 1
+
+    def search(self, string: Text, pos: int = 0, endpos: int | None = None) -> Match | None:
+        return next(self.finditer(string, pos, endpos), None)
+
+
+class LazySearcher(Searcher):
+    """
+    Searches like `Searcher`, but the DFAs are lazy DFAs over the NFA that are determinized while scanning.
+    Used for patterns whose full DFAs would be too large: memory stays bounded by the cache of each lazy DFA
+    and every character still costs at most one determinization step.
+    """
+
+    def _automaton(self, ast: ASTNode, budget: Budget | None) -> LazyDFA:
+        return LazyDFA(ast_to_nfa(ast))
+
+    def _scan(self, string: Text, pos: int, endpos: int) -> _DenseScan | _LazyScan:
+        return _LazyScan(self, string, pos, endpos)
+
+
+if __name__ == '__main__':
+    import random
+    import re
+    import time
+
+    test_cases = [
+        ("[a-z]+", "abc 123 de f"),
+        ("\\d+", "order 66, room 101 and 7"),
+        ("a*", "baaac"),
+        ("(foo)+|bar", "foofoo bar fobar foo"),
+        ("[a-z]+@[a-z]+\\.com", "mail me@example.com or you@test.com!"),
+        ("x", "no match here"),
+        ("(ab)*", ""),
+        ("aa", "aaaaa baab aa"),
+        ("x\\d+y", "x1 x22y xy x333y"),
+    ]
+
+    for pattern, string in test_cases:
+        expected = [match.span() for match in re.finditer(pattern, string)]
+        for searcher in (Searcher(ASTParser(pattern).parse()), LazySearcher(ASTParser(pattern).parse())):
+            actual = [match.span() for match in searcher.finditer(string)]
+            assert actual == expected, f"Test failed for pattern '{pattern}'. Expected {expected}, but got {actual}"
+        print(f"Test passed for pattern '{pattern}'.")
+
+    # Leftmost-longest: the longest alternative wins, not the first one
+    searcher = Searcher(ASTParser("a|ab|abc").parse())
+    assert searcher.search("xxabcd") == Match("xxabcd", 2, 5)
+    assert searcher.search("xxabcd", 3) is None
+    assert [match.group() for match in searcher.finditer("abcabab")] == ["abc", "ab", "ab"]
+    print("Test passed for leftmost-longest semantics.")
+
+    # Against a brute force search, the match ending first is not always the leftmost one ('bc' ends before 'abcd')
+    def brute_force(pattern: str, string: str) -> list[tuple[int, int]]:
+        spans, position = [], 0
+        while position <= len(string):
+            spans_at = ((start, [end for end in range(start, len(string) + 1) if re.fullmatch(pattern, string[start:end])]) for start in range(position, len(string) + 1))
+            start, ends = next(((start, ends) for start, ends in spans_at if ends), (None, None))
+            if start is None:
+                break
+            spans.append((start, max(ends)))
+            position = max(ends) if max(ends) > start else max(ends) + 1
+        return spans
+
+    rng = random.Random(0)
+    for pattern in ['abcd|bc', 'a|a[a-z]*b', '(ab|a)(bc|c)?', 'b(ab)*a?', '(a|b)*c|ba', 'x?y?', 'a[bc]*d|bcd?']:
+        searchers = (Searcher(ASTParser(pattern).parse()), LazySearcher(ASTParser(pattern).parse()))
+        for _ in range(200):
+            string = ''.join(rng.choice('abcdxy') for _ in range(rng.randint(0, 12)))
+            expected = brute_force(pattern, string)
+            for searcher in searchers:
+                actual = [match.span() for match in searcher.finditer(string)]
+                assert actual == expected, f"Test failed for '{pattern}' and '{string}'. Expected {expected}, but got {actual}"
+    print("Test passed against a brute force search.")
+
+    # Scans from neighbouring starts share their work, every 'a' is a match but only the first scan reads to the end
+    searcher = Searcher(ASTParser("a|a[a-z]*b").parse())
+    seconds = []
+    for n in [10_000, 40_000]:
+        start_time = time.perf_counter()
+        assert len(list(searcher.finditer('a' * n))) == n
+        seconds.append(time.perf_counter() - start_time)
+    assert seconds[1] < 8 * seconds[0], f"findall is not linear: {seconds}"
+    # A match at the start of a long text only translates the blocks the scans read
+    text = "abc " + "x" * 5_000_000
+    scan = Searcher(ASTParser("[a-z]+").parse())._scan(text, 0, len(text))
+    assert scan.first_end(0) == 1 and scan.longest_end(0) == 3
+    assert len(scan.forward_classes.blocks) == len(scan.unanchored_classes.blocks) == 1
+    print(f"Test passed for linear scans ({seconds[0] * 1000:.0f}ms and {seconds[1] * 1000:.0f}ms).")
+
+    searcher = Searcher(ASTParser("\\d+").parse())
+    data = bytearray(b"order 66, room 101 and 7")
+    assert [match.group() for match in searcher.finditer(data)] == [b"66", b"101", b"7"]
+    assert searcher.search(memoryview(data), 10).span() == (15, 18)
+    searcher = LazySearcher(ASTParser("\\d+").parse())
+    assert [match.group() for match in searcher.finditer(data)] == [b"66", b"101", b"7"]
+    print("Test passed for binary input.")
+
+    # The DFAs of this pattern have millions of states, the lazy ones only build what the text visits
+    searcher = LazySearcher(ASTParser("(a|b)*a(a|b){20,20}").parse())
+    text = "x" + "ab" * 30 + "x" + "b" * 30
+    assert [match.span() for match in searcher.finditer(text)] == [match.span() for match in re.finditer("(a|b)*a(a|b){20,20}", text)]
+    print("Test passed for lazy searching.")
+
+    searcher = Searcher(ASTParser("ab").parse())
+    for text in ("xabyab", b"xabyab", memoryview(b"xabyab")):
+        assert [match.span() for match in searcher.finditer(text, 1, 6)] == [(1, 3), (4, 6)]
+    assert searcher.search("xabyab", 2, 5) is None and Searcher(ASTParser("Δ").parse()).search(b"\xce\x94") is None
+    print("Test passed for literal patterns.")
@@ -0,0 +1,191 @@
+"""
+Binary format of a compiled DenseDFA, all integers are little endian:
+```
+magic          4 bytes   b'RXDF'
+version        u16       FORMAT_VERSION
+state size     u8        item size of the table entries (1, 2 or 4 bytes, the smallest that fits every state)
+reserved       u8
+n_states       u32
+n_classes      u32
+start          u32
+n_intervals    u32
+table          n_states * n_classes entries of `state size` bytes
+accepting      ceil(n_states / 8) bytes, bit i set iff state i is accepting
+intervals      n_intervals * (start u32, end u32, class u32)
+```
+"""
+
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import BinaryIO
+from src.ast import ASTNode
+from src.dense import ClassMap, DenseDFA, compile as dense_compile
+from src.dfa import Budget
+
+
+MAGIC = b'RXDF'
+FORMAT_VERSION = 1
+# Part of the keys of the disk caches, bump it whenever a pattern may compile to a different automaton
+# (tokenizer, parser, optimizer or construction changes), so files written by older versions are never loaded
+COMPILER_VERSION = 1
+
+__HEADER = struct.Struct('<4sHBBIIII')
+__TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+
+
+def __little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def __read_array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def to_bytes(dfa: DenseDFA) -> bytes:
+    state_size = 1 if dfa.n_states <= 0xFF else 2 if dfa.n_states <= 0xFFFF else 4
+    table = array(__TYPECODES[state_size], dfa.table)
+
+    accepting = bytearray((dfa.n_states + 7) // 8)
+    for state, is_accepting in enumerate(dfa.accepting):
+        if is_accepting:
+            accepting[state // 8] |= 1 << (state % 8)
+
+    intervals = array('I', [value for interval in dfa.classes.intervals for value in interval])
+    header = __HEADER.pack(MAGIC, FORMAT_VERSION, state_size, 0, dfa.n_states, dfa.n_classes, dfa.start, len(dfa.classes.intervals))
+    return header + __little_endian(table) + bytes(accepting) + __little_endian(intervals)
+
+def from_bytes(data: bytes) -> DenseDFA:
+    if len(data) < __HEADER.size:
+        raise Exception("Truncated DFA data")
+    magic, version, state_size, _, n_states, n_classes, start, n_intervals = __HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise Exception("Not a serialized DFA")
+    if version != FORMAT_VERSION:
+        raise Exception(f"Unsupported DFA format version {version}, expected {FORMAT_VERSION}")
+    if state_size not in __TYPECODES:
+        raise Exception(f"Invalid state size {state_size}")
+    if n_classes == 0 or start >= n_states:
+        raise Exception(f"Invalid start state {start} of {n_states} states and {n_classes} classes")
+
+    offset = __HEADER.size
+    table_size = n_states * n_classes * state_size
+    accepting_size = (n_states + 7) // 8
+    if len(data) != offset + table_size + accepting_size + n_intervals * 12:
+        raise Exception("Truncated DFA data")
+
+    table = array('i', __read_array(__TYPECODES[state_size], data[offset:offset + table_size]))
+    if max(table) >= n_states:
+        raise Exception(f"Invalid transition to state {max(table)} of {n_states} states")
+    offset += table_size
+
+    accepting_bits = data[offset:offset + accepting_size]
+    accepting = bytes(accepting_bits[state // 8] >> (state % 8) & 1 for state in range(n_states))
+    offset += accepting_size
+
+    values = __read_array('I', data[offset:])
+    intervals = [(values[i], values[i + 1], values[i + 2]) for i in range(0, len(values), 3)]
+    if any(class_id >= n_classes for _, _, class_id in intervals):
+        raise Exception(f"Invalid character class, the DFA has {n_classes} classes")
+
+    return DenseDFA(table, ClassMap(intervals), accepting, start)
+
+def dump(dfa: DenseDFA, file: BinaryIO) -> None:
+    file.write(to_bytes(dfa))
+
+def load(file: BinaryIO) -> DenseDFA:
+    return from_bytes(file.read())
+
+
+class DiskCache:
+    """
+    Keeps serialized DFAs in a directory, one file per pattern named after the hash of the pattern and its compile options.
+    Loading a cached DFA skips the tokenizer, the parser, the NFA and subset construction entirely.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, pattern: str, minimize: bool = True) -> str:
+        key = f"{FORMAT_VERSION}\0{COMPILER_VERSION}\0{minimize}\0{pattern}".encode('utf-8', 'surrogatepass')
+        return os.path.join(self.directory, hashlib.sha256(key).hexdigest() + '.rxdf')
+
+    def get_or_compile(self, pattern: str, minimize: bool = True, budget: Budget | None = None, ast: ASTNode | None = None) -> DenseDFA:
+        path = self.path(pattern, minimize)
+        try:
+            with open(path, 'rb') as file:
+                return load(file)
+        except Exception:
+            # Missing, corrupt or outdated file, it is (over)written below
+            pass
+
+        dfa = dense_compile(pattern, minimize, budget=budget, ast=ast)
+        # Write to a temporary file first, so concurrent readers never see a partially written file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                dump(dfa, file)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        return dfa
+
+
+if __name__ == '__main__':
+    import io
+    from src.test import REGEX_TEST_CASES, test_regex
+
+    def parse(pattern: str) -> DenseDFA:
+        data = to_bytes(dense_compile(pattern))
+        assert to_bytes(from_bytes(data)) == data
+        return from_bytes(data)
+
+    def match(compiled: DenseDFA, string: str) -> bool:
+        return compiled.match(string)
+
+    def log(pattern: str, compiled: DenseDFA) -> None:
+        print(f"Pattern '{pattern}' serialized to {len(to_bytes(compiled))} bytes")
+
+    test_regex(parse, match, log)
+
+    buffer = io.BytesIO()
+    dump(dense_compile('[a-z]+'), buffer)
+    buffer.seek(0)
+    assert load(buffer).match('abc')
+    valid = to_bytes(dense_compile('[a-z]+'))
+    n_states = dense_compile('[a-z]+').n_states
+    for invalid, message in [
+        (b'RXDF' + bytes(30), 'version'),
+        (valid[:16] + struct.pack('<I', n_states) + valid[20:], 'start'),
+        (valid[:__HEADER.size] + bytes([n_states]) + valid[__HEADER.size + 1:], 'transition'),
+        (valid[:-4] + struct.pack('<I', 99), 'class'),
+        (valid[:-1], 'Truncated'),
+    ]:
+        try:
+            from_bytes(invalid)
+        except Exception as error:
+            assert message in str(error), f"Expected an error about '{message}', got '{error}'"
+        else:
+            assert False, f"Expected an error about '{message}'"
+    print("Test passed for dump and load.")
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = DiskCache(directory)
+        for case in REGEX_TEST_CASES:
+            cache.get_or_compile(case["pattern"])
+        assert len(os.listdir(directory)) == len(REGEX_TEST_CASES)
+        for case in REGEX_TEST_CASES:
+            compiled = cache.get_or_compile(case["pattern"])
+            assert all(compiled.match(string) for string in case["matching"])
+            assert not any(compiled.match(string) for string in case["not_matching"])
+    print("Test passed for the disk cache.")
@@ -0,0 +1,179 @@
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Callable, ContextManager, Iterator
+
+if TYPE_CHECKING:
+    # Only for annotations, the automata modules import this one
+    from src.codegen import GeneratedDFA
+    from src.dense import DenseDFA
+    from src.derivative import Terms
+    from src.dfa import DFAState
+    from src.glushkov import Glushkov
+    from src.nfa import NFA
+
+
+class CompileStats:
+    """
+    Measurements of one compilation of a pattern.
+
+    `seconds` holds the time spent in every stage (tokenize, parse, optimize, nfa, epsilon_closure, dfa, derivative, minimize, dense, glushkov, codegen, literals)
+    in the order they ran, and `counts` the sizes of the automata that were built: states, edges, epsilon closure work
+    and estimated memory in bytes.
+    """
+
+    def __init__(self, pattern: str, engine: str = 'dfa') -> None:
+        self.pattern = pattern
+        self.engine = engine
+        self.seconds: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        # Why the engine was chosen over the requested one, None if the requested engine was used
+        self.fallback: str | None = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.seconds.values())
+
+    def record_nfa(self, nfa: "NFA") -> None:
+        self.counts["nfa_states"] = nfa.n_states
+        self.counts["nfa_edges"] = sum(len(edges) for edges in nfa.transitions)
+        self.counts["nfa_epsilon_edges"] = sum(len(targets) for targets in nfa.epsilon_transitions)
+        self.counts["nfa_bytes"] = estimate_nfa_bytes(nfa)
+        if nfa._closures is not None:
+            # Size of the precomputed epsilon closure table, states on a cycle share one closure
+            self.counts["epsilon_closure_states"] = sum(len(closure) for closure in {id(closure): closure for closure in nfa._closures}.values())
+
+    def record_dfa(self, name: str, start: "DFAState") -> None:
+        states = start.get_all_states()
+        self.counts[f"{name}_states"] = len(states)
+        self.counts[f"{name}_edges"] = sum(len(state.transitions) for state in states)
+        self.counts[f"{name}_bytes"] = estimate_dfa_bytes(states)
+
+    def record_dense(self, dense: "DenseDFA") -> None:
+        self.counts["dense_states"] = dense.n_states
+        self.counts["dense_classes"] = dense.n_classes
+        self.counts["dense_bytes"] = estimate_dense_bytes(dense)
+
+    def record_glushkov(self, glushkov: "Glushkov") -> None:
+        self.counts["glushkov_positions"] = glushkov.n_positions
+        self.counts["glushkov_bytes"] = estimate_glushkov_bytes(glushkov)
+
+    def record_terms(self, terms: "Terms") -> None:
+        self.counts["derivative_terms"] = len(terms)
+        self.counts["derivative_bytes"] = estimate_terms_bytes(terms)
+
+    def record_codegen(self, generated: "GeneratedDFA") -> None:
+        self.counts["codegen_lines"] = len(generated.source.splitlines())
+        self.counts["codegen_bytes"] = estimate_codegen_bytes(generated)
+
+    def as_dict(self) -> dict[str, str | int | float]:
+        """A flat dictionary, ready to be exported to a metrics system."""
+        return {
+            "pattern": self.pattern,
+            "engine": self.engine,
+            **({"fallback": self.fallback} if self.fallback is not None else {}),
+            "total_seconds": self.total_seconds,
+            **{f"seconds.{name}": seconds for name, seconds in self.seconds.items()},
+            **{f"counts.{name}": count for name, count in self.counts.items()},
+        }
+
+    def __repr__(self) -> str:
+        stages = ', '.join(f"{name}={seconds * 1000:.3f}ms" for name, seconds in self.seconds.items())
+        counts = ', '.join(f"{name}={count}" for name, count in self.counts.items())
+        fallback = f", fallback={repr(self.fallback)}" if self.fallback is not None else ''
+        return f"CompileStats({repr(self.pattern)}, engine={repr(self.engine)}{fallback}, {stages}, {counts})"
+
+
+def stage(stats: CompileStats | None, name: str) -> ContextManager:
+    """Times the stage if stats are collected, does nothing otherwise."""
+    return stats.stage(name) if stats is not None else nullcontext()
+
+def estimate_nfa_bytes(nfa: "NFA") -> int:
+    size = sys.getsizeof(nfa.transitions) + sys.getsizeof(nfa.epsilon_transitions) + sys.getsizeof(nfa.is_final)
+    for edges, targets in zip(nfa.transitions, nfa.epsilon_transitions):
+        size += sys.getsizeof(edges) + sum(sys.getsizeof(edge) for edge in edges) + sys.getsizeof(targets)
+    return size
+
+def estimate_dfa_state_bytes(state: "DFAState") -> int:
+    size = sys.getsizeof(state) + sys.getsizeof(state.__dict__) + sys.getsizeof(state.nfa_states)
+    return size + sys.getsizeof(state.transitions) + sys.getsizeof(state.starts) + sys.getsizeof(state.ends) + sys.getsizeof(state.targets)
+
+def estimate_dfa_bytes(states: set["DFAState"]) -> int:
+    return sum(estimate_dfa_state_bytes(state) for state in states)
+
+def estimate_dense_bytes(dense: "DenseDFA") -> int:
+    return sys.getsizeof(dense.table) + sys.getsizeof(dense.accepting) + sys.getsizeof(dense.classes) + sys.getsizeof(dense.classes.intervals) + sys.getsizeof(dense.byte_classes)
+
+def estimate_glushkov_bytes(glushkov: "Glushkov") -> int:
+    size = sys.getsizeof(glushkov.follow) + sum(sys.getsizeof(targets) for targets in glushkov.follow)
+    for _, table in glushkov.chunks:
+        size += sys.getsizeof(table) + sum(sys.getsizeof(targets) for targets in table)
+    return size + sys.getsizeof(glushkov.masks) + sys.getsizeof(glushkov.byte_masks) + sys.getsizeof(glushkov.classes.intervals)
+
+def estimate_terms_bytes(terms: "Terms") -> int:
+    size = 0
+    for term in terms.values():
+        size += sys.getsizeof(term) + sys.getsizeof(term.children) + sys.getsizeof(term.starts) + sys.getsizeof(term.derivatives)
+    return size
+
+def estimate_codegen_bytes(generated: "GeneratedDFA") -> int:
+    # The bytecode of the generated functions, the memoized transitions grow while matching
+    return sum(sys.getsizeof(function.__code__.co_code) for function in (generated.step, generated.match))
+
+
+__hooks: list[Callable[[CompileStats], None]] = []
+
+def add_hook(hook: Callable[[CompileStats], None]) -> None:
+    """Calls hook with the stats of every pattern compiled by `src.regex.compile` from now on (e.g. to export them as metrics)."""
+    __hooks.append(hook)
+
+def remove_hook(hook: Callable[[CompileStats], None]) -> None:
+    __hooks.remove(hook)
+
+def report(stats: CompileStats) -> None:
+    for hook in list(__hooks):
+        hook(stats)
+
+
+if __name__ == '__main__':
+    from src.regex import clear_cache, compile
+    from src.test import REGEX_TEST_CASES
+    # Run as a script this module is __main__, the hooks src.regex reports to are the ones of src.stats
+    from src.stats import CompileStats, add_hook, remove_hook
+
+    reported: list[CompileStats] = []
+    add_hook(reported.append)
+    clear_cache()
+    for case in REGEX_TEST_CASES:
+        for engine in ('dfa', 'dense', 'lazy', 'pike'):
+            stats = compile(case["pattern"], engine=engine).stats
+            assert stats is reported[-1] and stats.engine == engine
+            assert {'tokenize', 'parse', 'nfa', 'literals'} <= stats.seconds.keys() and stats.counts["memory_bytes"] > 0
+            assert stats.counts["nfa_states"] > stats.counts["nfa_edges"] // 2
+        stats = compile(case["pattern"], engine='glushkov').stats
+        assert {'parse', 'glushkov'} <= stats.seconds.keys() and stats.counts["memory_bytes"] == stats.counts["glushkov_bytes"] > 0
+        stats = compile(case["pattern"], engine='derivative').stats
+        assert 'nfa' not in stats.seconds and stats.counts["minimized_states"] <= stats.counts["dfa_states"] and stats.counts["derivative_terms"] > 0
+        stats = compile(case["pattern"], engine='codegen').stats
+        assert 'codegen' in stats.seconds and stats.counts["memory_bytes"] == stats.counts["codegen_bytes"] > 0
+        stats = compile(case["pattern"], engine='lazy_derivative').stats
+        assert stats.counts["memory_bytes"] == stats.counts["derivative_bytes"] > 0
+        stats = compile(case["pattern"], engine='dense').stats
+        assert stats.counts["minimized_states"] <= stats.counts["dfa_states"] and stats.counts["dense_states"] == stats.counts["minimized_states"] + 1
+        assert stats.counts["epsilon_closure_unions"] <= stats.counts["epsilon_closure_lookups"]
+        print(stats)
+
+    # Cached patterns are not compiled again, so they are not reported again
+    count = len(reported)
+    compile(REGEX_TEST_CASES[0]["pattern"])
+    remove_hook(reported.append)
+    assert len(reported) == count and all(isinstance(value, (str, int, float)) for value in reported[0].as_dict().values())
+    print("Test passed for compile stats and hooks.")
@@ -0,0 +1,126 @@
+from src.charset import Text, as_symbols
+from src.dense import DenseDFA, compile as dense_compile
+from src.lazy import LazyDFA, compile as lazy_compile
+from src.test import test_regex
+
+
+class Matcher:
+    """
+    Matches a pattern against input that arrives in chunks.
+
+    Only the current DFA state is kept between chunks, so arbitrarily long streams are matched in constant memory.
+    Once the matcher is dead no continuation of the input can match anymore and further chunks are skipped.
+    """
+
+    def __init__(self, dfa: DenseDFA) -> None:
+        self.dfa = dfa
+        self.state = dfa.start
+        self.consumed = 0
+
+    def feed(self, chunk: Text) -> None:
+        dfa = self.dfa
+        table, n_classes = dfa.table, dfa.n_classes
+        state = self.state
+        if state == DenseDFA.DEAD:
+            return
+
+        for offset, class_id in enumerate(dfa.class_ids(chunk)):
+            state = table[state * n_classes + class_id]
+            if state == DenseDFA.DEAD:
+                self.consumed += offset + 1
+                break
+        else:
+            self.consumed += len(chunk) if isinstance(chunk, str) else memoryview(chunk).nbytes
+        self.state = state
+
+    @property
+    def is_accepting(self) -> bool:
+        return self.dfa.accepting[self.state] == 1
+
+    @property
+    def is_dead(self) -> bool:
+        return self.state == DenseDFA.DEAD
+
+    def reset(self) -> None:
+        self.state = self.dfa.start
+        self.consumed = 0
+
+
+class LazyMatcher:
+    """
+    The same as `Matcher`, over a lazy DFA for patterns whose full DFA would be too large.
+    The current state is the set of active NFA states, so memory stays bounded by the cache of the lazy DFA.
+    """
+
+    def __init__(self, dfa: LazyDFA) -> None:
+        self.dfa = dfa
+        self.state = dfa.start
+        self.consumed = 0
+
+    def feed(self, chunk: Text) -> None:
+        dfa = self.dfa
+        state = self.state
+        if state is dfa.dead:
+            return
+
+        symbols = as_symbols(chunk)
+        for offset, symbol in enumerate(symbols):
+            state = dfa.step(state, symbol)
+            if state is dfa.dead:
+                self.consumed += offset + 1
+                break
+        else:
+            self.consumed += len(symbols)
+        self.state = state
+
+    @property
+    def is_accepting(self) -> bool:
+        return self.state.is_final
+
+    @property
+    def is_dead(self) -> bool:
+        return self.state is self.dfa.dead
+
+    def reset(self) -> None:
+        self.state = self.dfa.start
+        self.consumed = 0
+
+
+if __name__ == '__main__':
+    def parse(pattern: str) -> DenseDFA:
+        return dense_compile(pattern)
+
+    def match(compiled: DenseDFA | LazyDFA, string: str) -> bool:
+        # Feed the string in chunks of every size, the result must not depend on where the chunks are split
+        results = set()
+        for chunk_size in range(1, len(string) + 2):
+            matcher = Matcher(compiled) if isinstance(compiled, DenseDFA) else LazyMatcher(compiled)
+            for i in range(0, len(string), chunk_size):
+                matcher.feed(string[i:i + chunk_size])
+            results.add(matcher.is_accepting)
+        assert len(results) == 1, f"Chunking changed the result for '{string}'"
+        return results.pop()
+
+    def log(pattern: str, compiled: DenseDFA) -> None:
+        pass
+
+    test_regex(parse, match, log)
+    test_regex(lambda pattern: lazy_compile(pattern, max_cache_size=4), match, log)
+
+    matcher = Matcher(dense_compile('(ab)+'))
+    matcher.feed('aba')
+    assert not matcher.is_accepting and not matcher.is_dead
+    matcher.feed('b')
+    assert matcher.is_accepting
+    matcher.feed('b' + 'x' * 1000)
+    assert matcher.is_dead and matcher.consumed == 5
+    matcher.reset()
+    assert not matcher.is_dead and matcher.consumed == 0
+
+    matcher = LazyMatcher(lazy_compile('(a|b)*a(a|b){20,20}', max_cache_size=100))
+    for _ in range(100):
+        matcher.feed(b'ab' * 50)
+    assert not matcher.is_accepting
+    matcher.feed('a' * 21)
+    assert matcher.is_accepting and matcher.consumed == 10_021 and not matcher.is_dead
+    print("Test passed for streaming state.")
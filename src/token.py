@@ -1,5 +1,5 @@
 import enum
-from typing import Generator
+from typing import Generator, Iterable
 
 
 class TokenType(enum.Enum):
@@ -33,8 +33,9 @@ class Token:
 
 
 class Tokenizer:
-    def __init__(self, regex) -> None:
-        self.__tokens = self.tokenize(regex)
+    def __init__(self, regex, tokens: Iterable[Token] | None = None) -> None:
+        # Tokens that were already produced by `tokenize` are parsed without tokenizing the pattern again
+        self.__tokens = iter(tokens) if tokens is not None else self.tokenize(regex)
         self.__previous = None
         self.__current = next(self.__tokens, None)
         
@@ -70,7 +71,8 @@ class Tokenizer:
         else:
             raise Exception(f"Expected {token_type} but got {self.current}")
 
-    def tokenize(self, regex: str) -> Generator[Token, None, None]:
+    @staticmethod
+    def tokenize(regex: str) -> Generator[Token, None, None]:
         def get(error_message: str = "Unexpected end of input") -> str:
             nonlocal i
             if i >= len(regex):